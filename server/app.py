@@ -1,36 +1,87 @@
 import json
 import os
+import time
 import uuid
-import requests 
-from flask import Flask, request, jsonify, render_template, Response
+import http_client
+import vector_store
+import embed_cache
+import semantic_cache
+import history
+import prompt_budget
+import metrics
+from flask import Flask, request, jsonify, render_template, Response, g
 from datetime import datetime
 from tools import *
-from google import create_data_json, fetch_static_map_image
+from google import create_data_json, fetch_static_map_image, MAP_ZOOM, MAP_SIZE, GOOGLE_MAPS_URL
+import map_cache
+from geo import GeoPoints
+import trip_store
+from geo_cache import cached_lat_lng
+from cache import all_stats
+import jobs
+import prefetch
+from pipeline import PipelineContext, remember, recall, dump_json
 
 app = Flask(__name__)
 
+# 啟動後於背景載入 embedding model 與向量資料庫，不阻塞啟動 (WARMUP_ON_START=0 則改為第一次使用時載入)
+if os.getenv("WARMUP_ON_START", "1") == "1":
+    vector_store.start_warmup()
+
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 BASE_DIR = os.path.dirname(__file__)
-DATA_FILE = os.path.join(BASE_DIR, 'json', 'trips_data.json')
-REQUEST_FILE = os.path.join(BASE_DIR, 'json', 'request.json') 
-RESPONSE_FILE = os.path.join(BASE_DIR, 'json', 'options.json') 
-
-# --- 資料讀寫輔助函式 ---
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return []
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return []
 
-def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+# --- request id 與 route 指標 ---
+# 這些 route 太頻繁 (監控 / 探針)，不輸出 log
+QUIET_ROUTES = {"/metrics", "/healthz", "/readyz"}
+
+@app.before_request
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.request_id = metrics.set_request_id(request.headers.get("X-Request-ID"))
+
+@app.after_request
+def _finish_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed = time.perf_counter() - g.get("request_start", time.perf_counter())
+    metrics.ROUTE_SECONDS.observe(elapsed, route=route, method=request.method)
+    metrics.ROUTE_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    response.headers["X-Request-ID"] = g.get("request_id", "-")
+    if metrics.LOG_STAGES and route not in QUIET_ROUTES:
+        print(f"🌐 [{g.get('request_id', '-')}] {request.method} {request.path} {response.status_code} {elapsed:.3f}s")
+    return response
+
+@app.teardown_request
+def _clear_request_id(exc):
+    metrics.clear_request_id()
+
+# --- 資料讀寫 ---
+# 旅程改存於 trip_store (SQLite)，第一次使用時會自動匯入舊的 trips_data.json
 
 # --- Google Maps Geocoding 查詢函式 ---
+def _geocode(address):
+    """
+    呼叫 Geocoding API，查無結果回傳 (None, None)，其他錯誤拋出例外 (不會被快取)
+    """
+    url = GOOGLE_MAPS_URL + "/maps/api/geocode/json"
+    params = {
+        "address": address,
+        "key": GOOGLE_API_KEY,
+        "language": "zh-TW"
+    }
+    
+    response = http_client.get(url, endpoint="geocode", params=params)
+    data = response.json()
+
+    if data['status'] == 'OK':
+        location = data['results'][0]['geometry']['location']
+        return location['lat'], location['lng']
+    if data['status'] == 'ZERO_RESULTS':
+        print(f"❌ 找不到地址：{address}")
+        return None, None
+    raise RuntimeError(f"Google API Error: {data['status']}")
+
 def get_coordinates(address):
     if not address:
         print("❌ 錯誤：地址是空的")
@@ -40,27 +91,25 @@ def get_coordinates(address):
         return None, None
     
     try:
-        url = "https://maps.googleapis.com/maps/api/geocode/json"
-        params = {
-            "address": address,
-            "key": GOOGLE_API_KEY,
-            "language": "zh-TW"
-        }
-        
-        response = requests.get(url, params=params)
-        data = response.json()
-
-        if data['status'] == 'OK':
-            location = data['results'][0]['geometry']['location']
-            return location['lat'], location['lng']
-        else:
-            print(f"❌ Google API Error: {data['status']}")
-            return None, None
+        # 相同地址直接使用快取 (與 google.get_lat_lng 共用)
+        return cached_lat_lng(address, _geocode)
             
     except Exception as e:
         print(f"❌ Geocoding Error: {e}")
         return None, None
 
+# --- 健康檢查 ---
+@app.route('/healthz')
+def healthz():
+    # process 活著就回 200
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/readyz')
+def readyz():
+    # 向量資料庫載入完成才算 ready
+    state = vector_store.state()
+    return jsonify(state), (200 if state["status"] == vector_store.READY else 503)
+
 # --- 首頁路由 ---
 @app.route('/')
 def home():
@@ -87,9 +136,7 @@ def create_trip():
             "schedule": []
         }
 
-        all_trips = load_data()
-        all_trips.append(new_trip)
-        save_data(all_trips)
+        trip_store.create_trip(new_trip)
 
         print(f"旅程已建立，ID: {new_id}，座標: {lat}, {lng}")
         
@@ -110,11 +157,10 @@ def update_meta():
         trip_id = req_data.get('trip_id')
         new_meta = req_data.get('meta')
 
-        all_trips = load_data()
-        target_trip = next((t for t in all_trips if t['id'] == trip_id), None)
+        old_meta = trip_store.get_meta(trip_id)
 
-        if target_trip:
-            old_location = target_trip['meta'].get('location')
+        if old_meta is not None:
+            old_location = old_meta.get('location')
             new_location = new_meta.get('location')
             
             lat, lng = None, None
@@ -125,13 +171,12 @@ def update_meta():
                 new_meta['lat'] = lat
                 new_meta['lng'] = lng
             else:
-                lat = target_trip['meta'].get('lat')
-                lng = target_trip['meta'].get('lng')
+                lat = old_meta.get('lat')
+                lng = old_meta.get('lng')
                 new_meta['lat'] = lat
                 new_meta['lng'] = lng
 
-            target_trip['meta'] = new_meta
-            save_data(all_trips)
+            trip_store.update_meta(trip_id, new_meta)
             
             return jsonify({
                 "status": "success", 
@@ -156,12 +201,7 @@ def add_item():
         if not trip_id:
             return jsonify({"status": "error", "message": "前端未傳送 ID"}), 400
 
-        all_trips = load_data()
-        target_trip = next((t for t in all_trips if t['id'] == trip_id), None)
-        
-        if target_trip:
-            target_trip['schedule'].append(new_item)
-            save_data(all_trips)
+        if trip_store.add_item(trip_id, new_item):
             return jsonify({"status": "success", "message": "項目已新增"}), 200
         else:
             return jsonify({"status": "error", "message": "找不到該旅程 ID"}), 404
@@ -174,101 +214,256 @@ def add_item():
 @app.route('/api/get_all_trips', methods=['GET'])
 def get_all_trips():
     try:
-        trips = load_data()
+        trips = trip_store.list_trips()
         return jsonify({"status": "success", "trips": trips}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-# --- [修正] API 4: 儲存需求為 request.json ---
+# --- API 3.5: 行程各項目之間的距離矩陣 ---
+@app.route('/api/trip_distances/<trip_id>', methods=['GET'])
+def trip_distances(trip_id):
+    try:
+        trip = trip_store.get_trip(trip_id)
+        if trip is None:
+            return jsonify({"status": "error", "message": "找不到該旅程 ID"}), 404
+
+        items = trip['schedule']
+        matrix = GeoPoints(items).pairwise() if items else []
+        return jsonify({
+            "status": "success",
+            "places": [item.get('place_name') for item in items],
+            # 座標缺失的項目距離為 null
+            "distances_km": [[round(float(d), 3) if d == d else None for d in row] for row in matrix]
+        }), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- 生成流程 (於背景 job 中執行) ---
+# 長輪詢最多等待幾秒
+LONG_POLL_TIMEOUT = 25
+
+def run_generation(ctx):
+    # call key AI to get 3 keys for google api
+    key_list = generate_keys(ctx)
+    print("Key AI complete !!!")
+
+    # call google api to collect shops in certain radius
+    create_data_json(ctx, key_list)
+    print("Google search complete !!!")
+    # call guide RAG AI to create options
+    generate_options_json(ctx)
+    remember(ctx)
+    # 在背景預先生成下一批，使用者按 regenerate 時可以直接回傳
+    prefetch.schedule(ctx)
+    print("RAG AI complete")
+
+def run_regeneration(ctx):
+    # 有需求相同的預先生成結果時直接使用 (仍在生成中則等它完成)，否則重新呼叫 RAG AI
+    if not prefetch.deliver(ctx, ctx.prefetched):
+        generate_options_json(ctx)
+    ctx.prefetched = None
+    remember(ctx)
+    prefetch.schedule(ctx)
+    print("RAG AI regenerate complete")
+
+def _submit_job(fn, ctx):
+    try:
+        job = jobs.submit(fn, ctx)
+    except jobs.QueueFullError as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+
+    return _job_response(job, ctx)
+
+def _job_response(job, ctx):
+    return jsonify({
+        "status": "accepted",
+        "message": "已開始生成",
+        "job_id": job.id,
+        "request_id": ctx.request_id,
+        "saved_data": ctx.request
+    }), 202
+
+# --- [修正] API 4: 產生 AI 選項 (背景執行，立即回傳 job id) ---
 @app.route('/api/generate_ai_prompt', methods=['POST'])
 def generate_ai_prompt():
     try:
         req_data = request.json
-        
-        with open(REQUEST_FILE, 'w', encoding='utf-8') as f:
-            json.dump(req_data, f, ensure_ascii=False, indent=4)
-        
-        print(f"✅ 已將原始需求儲存至 {REQUEST_FILE}")
-
-        # call key AI to get 3 keys for google api
-        key_list = generate_keys()
-        print("Key AI complete !!!")
 
-        # call google api to create data.json aka shops in certain radius
-        create_data_json(key_list)
-        print("Google search complete !!!")
-        # call guide RAG AI to create options.json 
-        generate_options_json()
-        print("RAG AI complete")
+        # 本次生成流程的 context，取代 request.json / data.json 的檔案往返
+        ctx = PipelineContext(req_data)
+        dump_json("request.json", req_data)
+        # 新的搜尋結果，先前預先生成的選項不再適用
+        prefetch.reset(ctx.session_id)
 
-
-        return jsonify({
-            "status": "success", 
-            "message": "資料已儲存",
-            "saved_data": req_data 
-        }), 200
+        return _submit_job(run_generation, ctx)
 
     except Exception as e:
-        print(f"❌ Error saving request json: {e}")
+        print(f"❌ Error generating options: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
     
 @app.route('/api/regenerate_ai_prompt', methods=['POST'])
 def regenerate_ai_prompt():
     try:
         req_data = request.json
-        
-        with open(REQUEST_FILE, 'w', encoding='utf-8') as f:
-            json.dump(req_data, f, ensure_ascii=False, indent=4)
-            
-        print(f"✅ 已將原始需求儲存至 {REQUEST_FILE}")
+
+        # 沿用同一個 session 上一次的 Google 搜尋結果
+        ctx = PipelineContext(req_data)
+        prev_ctx = recall(ctx.session_id)
+        if prev_ctx is None:
+            return jsonify({"status": "error", "message": "尚未產生過選項"}), 404
+        ctx.keys = prev_ctx.keys
+        ctx.places = prev_ctx.places
+        # 使用者就是想要新的選項，不能回傳語意快取中的舊結果
+        ctx.bypass_cache = True
+
+        # 預先生成已完成時直接在請求中交付，不需要排隊
+        ctx.prefetched = prefetch.take(ctx)
+        if ctx.prefetched is not None and ctx.prefetched.ready():
+            run_regeneration(ctx)
+            return _job_response(jobs.completed(ctx), ctx)
 
         # regenerate
-        generate_options_json()
+        return _submit_job(run_regeneration, ctx)
 
-        return jsonify({
-            "status": "success", 
-            "message": "資料已儲存",
-            "saved_data": req_data 
-        }), 200
+    except Exception as e:
+        print(f"❌ Error regenerating options: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- API 5: 查詢生成工作 (long-poll) ---
+@app.route('/api/get_ai_job/<job_id>', methods=['GET'])
+def get_ai_job(job_id):
+    try:
+        job = jobs.get_job(job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": "找不到該 job ID"}), 404
+
+        # ?wait=秒數，最多等到工作完成或逾時
+        wait = min(float(request.args.get('wait', 0)), LONG_POLL_TIMEOUT)
+        if wait > 0:
+            job.wait(wait)
+
+        return jsonify(job.to_dict()), 200
 
     except Exception as e:
-        print(f"❌ Error saving request json: {e}")
+        print(f"❌ Error reading job: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
     
+# --- API 5.5: 以 SSE 串流生成工作的推薦地點 ---
+# 沒有新資料時，每隔幾秒送一次 keep-alive
+SSE_KEEPALIVE = 15
+
+@app.route('/api/stream_ai_job/<job_id>', methods=['GET'])
+def stream_ai_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "找不到該 job ID"}), 404
+
+    def events():
+        seen = 0
+        while True:
+            new_options, finished = job.ctx.wait_for_options(seen, SSE_KEEPALIVE)
+            for option in new_options:
+                yield f"event: option\ndata: {json.dumps(option, ensure_ascii=False)}\n\n"
+            seen += len(new_options)
+
+            if finished:
+                yield f"event: done\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                return
+            if not new_options:
+                yield ": keep-alive\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 @app.route('/api/get_ai_options', methods=['GET'])
 def get_ai_options():
     try:
-        if not os.path.exists(RESPONSE_FILE):
+        ctx = recall(request.args.get('trip_id'))
+        if ctx is None or ctx.options is None:
             return jsonify({"status": "waiting", "message": "AI genetating..."}), 404
-        with open(RESPONSE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        # delete options.json
-        # os.remove(RESPONSE_FILE)
 
-        return jsonify({"status": "success", "options": data}), 200
+        return jsonify({"status": "success", "options": ctx.options}), 200
     
     except Exception as e:
-        print(f"❌ Error reading options.json: {e}")
+        print(f"❌ Error reading options: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
     
+# 地圖圖片的瀏覽器快取時間 (秒)
+MAP_IMAGE_MAX_AGE = 7 * 86400
+
 @app.route('/api/map_image')
 def get_map_image():
     try:
         lat = request.args.get('lat')
         lng = request.args.get('lng')
+        if not lat or not lng:
+            return "Image generation failed", 400
+
+        # 圖片內容只由 (經緯度, zoom, size) 決定，可用來當作 strong ETag
+        etag = map_cache.image_key(lat, lng, MAP_ZOOM, MAP_SIZE)
+        cache_headers = {
+            "ETag": f'"{etag}"',
+            "Cache-Control": f"public, max-age={MAP_IMAGE_MAX_AGE}, immutable"
+        }
+        if etag in request.if_none_match:
+            return Response(status=304, headers=cache_headers)
 
         image_content = fetch_static_map_image(lat, lng)
 
         if image_content:
-            return Response(image_content, mimetype='image/png')
+            return Response(image_content, mimetype='image/png', headers=cache_headers)
         else:
             return "Image generation failed", 400
     
+    except ValueError:
+        return "Invalid coordinates", 400
     except Exception as e:
         print(f"Proxy Error: {e}")
         return "Error fetching map", 500
 
 
+# --- 快取命中統計 ---
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    caches = all_stats()
+    caches["map_image"] = map_cache.stats()
+    caches["retrieval"] = embed_cache.stats()
+    caches["semantic"] = semantic_cache.stats()
+    caches["history"] = history.stats()
+    caches["prefetch"] = prefetch.stats()
+    return jsonify({"status": "success", "caches": caches}), 200
+
+# --- 對外 HTTP 連線統計 ---
+@app.route('/api/http_stats', methods=['GET'])
+def http_stats():
+    return jsonify({"status": "success", "hosts": http_client.stats()}), 200
+
+# --- RAG prompt token 統計 ---
+@app.route('/api/prompt_stats', methods=['GET'])
+def prompt_stats():
+    return jsonify({"status": "success", "prompt": prompt_budget.stats()}), 200
+
+# --- Prometheus 指標 ---
+def _cache_gauges():
+    caches = all_stats()
+    caches["map_image"] = map_cache.stats()
+    caches["semantic"] = semantic_cache.stats()
+    caches["prefetch"] = prefetch.stats()
+    gauges = [
+        ("cache_hits", "快取累計命中次數", [({"cache": name}, s["hits"]) for name, s in caches.items()]),
+        ("cache_misses", "快取累計未命中次數", [({"cache": name}, s["misses"]) for name, s in caches.items()]),
+        ("cache_hit_ratio", "快取命中率", [({"cache": name}, s["hit_ratio"]) for name, s in caches.items()]),
+        ("generation_jobs_pending", "排隊與執行中的生成工作數", [({}, jobs.pending())]),
+    ]
+    return gauges
+
+metrics.register_collector(_cache_gauges)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,441 @@
+import os, json
+import io
+import sys
+import copy
+import time
+import timeit
+import random
+import shutil
+import sqlite3
+import hashlib
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+
+"""離線 micro-benchmark
+不需要 LLM gateway、Google API 與 embedding model，依 json/ 中 data.json、RAG_LLM_reply.json、
+trips_data.json 的格式產生不同大小的假資料，量測 pipeline 中在本機執行的步驟：
+    parsing    parse_options_prompt、parse_rag_output (含名稱比對)、parse_key_output
+    retrieval  retrieve_context (合成的 FAISS shard + 以 hash 產生向量的假 embedding model)
+    trips      trip_store 的新增、查詢、更新、列出與匯入，以及舊版 load_data / save_data 的整檔 json 讀寫
+
+結果輸出為 JSON；指定 --baseline 時與舊的結果比較各項的 median，變慢超過門檻時以狀態碼 1 結束
+
+    python benchmark.py
+    python benchmark.py --only parsing --candidates 20,1000 --output bench.json
+    python benchmark.py --quick --baseline bench_old.json --threshold 0.2
+"""
+
+BASE_DIR = os.path.dirname(__file__)
+JSON_DIR = os.path.join(BASE_DIR, 'json')
+
+SUITES = ("parsing", "retrieval", "trips")
+CANDIDATE_SIZES = [20, 100, 1000, 10000]
+CHUNK_SIZES = [1000, 10000, 100000]
+TRIP_SIZES = [10, 1000, 10000, 100000]
+QUICK_SIZES = {"candidates": [20, 1000], "chunks": [1000], "trips": [10, 1000]}
+
+# 每一項量測幾次 (每次至少執行 0.2 秒，單次就超過 1 秒的項目只量 3 次)
+REPEAT = 5
+SLOW_REPEAT = 3
+# 合成向量的維度 (與 embeddinggemma-300m 相同)
+EMBEDDING_DIM = 768
+# 變慢超過 threshold 且絕對差距超過此毫秒數才算退步，避免極短的項目因雜訊誤報
+MIN_DELTA_MS = 0.05
+SEED = 42
+
+
+# --- 量測 ---
+def measure(fn, repeat: int = None) -> dict:
+    """以 timeit 量測 fn 單次執行的時間 (毫秒)"""
+    repeat = repeat or REPEAT
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    if number == 1 and elapsed > 1.0:
+        repeat = min(repeat, SLOW_REPEAT)
+    samples = sorted(t / number * 1000 for t in timer.repeat(repeat=repeat, number=number))
+    return {
+        "runs": repeat,
+        "loops": number,
+        "min_ms": round(samples[0], 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+    }
+
+
+def record(results: list, name: str, size: int, unit: str, fn, **kwargs) -> None:
+    result = dict(name=name, size=size, unit=unit, **measure(fn, **kwargs))
+    results.append(result)
+    print(f"⏱️ {name:<32} {size:>7} {unit:<10} median {result['median_ms']:>10.3f} ms  "
+          f"(min {result['min_ms']:.3f}, p95 {result['p95_ms']:.3f})")
+
+
+@contextlib.contextmanager
+def quiet():
+    """parse_rag_block 等函式會 print 除錯訊息，量測時不輸出"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _load_json(filename: str):
+    with open(os.path.join(JSON_DIR, filename), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# --- 假資料 ---
+def make_places(n: int, rng: random.Random) -> dict:
+    """以 data.json 中的地點為樣板，產生 n 個不重複的候選地點 (含 short_id)"""
+    from candidates import CandidateStore
+
+    templates = _load_json('data.json')["results"]
+    results = []
+    for i in range(n):
+        place = copy.deepcopy(templates[i % len(templates)])
+        place["name"] = f"{place['name']} {i + 1}號店"
+        place["place_id"] = f"bench-{i}"
+        place["vicinity"] = f"測試路{i % 300 + 1}段{i + 1}號"
+        place["rating"] = round(rng.uniform(3.0, 5.0), 1)
+        location = place["geometry"]["location"]
+        location["lat"] += rng.uniform(-0.02, 0.02)
+        location["lng"] += rng.uniform(-0.02, 0.02)
+        results.append(place)
+
+    store = CandidateStore()
+    store.add_results("benchmark", results)
+    return store.to_places()
+
+
+def make_rag_reply(places: dict, rng: random.Random) -> str:
+    """
+    依 RAG_LLM_reply.json 的格式產生 5 個推薦地點的回覆
+    推薦的是候選清單後段的地點，其中兩個有編號、兩個只有完整名稱、
+    一個只有不完整的名稱 (會走到逐一比對名稱的部分比對)
+    """
+    results = places["results"]
+    picks = results[-5:] if len(results) >= 5 else results
+    blocks = []
+    for i, place in enumerate(picks):
+        lines = [f"推薦地點{i + 1}:"]
+        name = place["name"]
+        if i < 2:
+            lines.append(f"    編號 : {place['short_id']}")
+        elif i == 4:
+            name = name + " (總店)"
+        lines += [
+            f"    地點名稱 : {name}",
+            f"    地址 : {place['vicinity']}",
+            f"    評分 : {place['rating']}",
+            f"    推薦文 : 多元遊戲區、互動體驗，孩子玩得盡興，家長也能安心。{rng.randint(1, 99)}",
+            "    tags : 互動遊戲、家庭友善、人氣高",
+        ]
+        blocks.append("\n".join(lines))
+    return "\n---------\n".join(blocks)
+
+
+def make_trips(n: int, rng: random.Random) -> list:
+    """以 trips_data.json 的第一筆旅程為樣板，產生 n 筆旅程 (每筆 1~5 個行程項目)"""
+    template = _load_json('trips_data.json')[0]
+    item = template["schedule"][0] if template.get("schedule") else {"place_name": "測試地點"}
+    trips = []
+    for i in range(n):
+        trip = copy.deepcopy(template)
+        trip["id"] = f"bench-trip-{i}"
+        trip["created_at"] = f"2025-01-01 00:00:{i % 60:02d}"
+        trip["meta"]["trip_name"] = f"測試旅程 {i}"
+        trip["schedule"] = [dict(item, place_name=f"{item.get('place_name', '')} {j}")
+                            for j in range(rng.randint(1, 5))]
+        trips.append(trip)
+    return trips
+
+
+class HashEmbeddings:
+    """以文字的 hash 產生固定的單位向量，取代 embedding model (只有 embed_query / embed_documents)"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def embed_query(self, text: str) -> list:
+        import numpy as np
+
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self.embed_query(t) for t in texts]
+
+
+def build_vector_db(path: str, n: int, location: tuple, dim: int = EMBEDDING_DIM) -> None:
+    """
+    在 path 建立 createDB.py 格式的合成向量資料庫：
+    行程所在地區的 shard 放 3/4 的 chunk，其餘放在 general，皆為 flat (內積) index
+    """
+    import numpy as np
+    import faiss
+
+    rng = np.random.default_rng(SEED)
+    sizes = {"bench_region": n - n // 4, "general": n // 4}
+    shards = {}
+    conn = sqlite3.connect(os.path.join(path, "docstore.db"))
+    conn.execute("CREATE TABLE chunks (id TEXT PRIMARY KEY, region TEXT NOT NULL, row INTEGER NOT NULL, "
+                 "source_file TEXT NOT NULL, content TEXT NOT NULL, metadata TEXT NOT NULL, "
+                 "content_hash TEXT NOT NULL)")
+    conn.execute("CREATE INDEX idx_chunks_region_row ON chunks (region, row)")
+    for region, count in sizes.items():
+        if count == 0:
+            continue
+        vectors = rng.standard_normal((count, dim)).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        index = faiss.IndexFlatIP(dim)
+        index.add(vectors)
+
+        shard_path = os.path.join(path, "shards", region)
+        os.makedirs(shard_path)
+        faiss.write_index(index, os.path.join(shard_path, "vectors.index"))
+        with open(os.path.join(shard_path, "index_meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"index_type": "flat", "ntotal": count, "dim": dim, "search_params": {}}, f)
+
+        rows = []
+        for row in range(count):
+            # 相鄰的 chunk 前後重疊，與 chunk_overlap 切出來的段落相同
+            content = f"{region} 第{row}段：" + "台灣旅遊景點與美食介紹，" * 20 + f"第{row + 1}段開頭"
+            rows.append((f"{region}-{row}", region, row, "benchmark.txt", content,
+                         json.dumps({"source": "benchmark.txt"}), hashlib.sha256(content.encode()).hexdigest()))
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        shards[region] = {
+            "name": region,
+            "center": list(location) if region != "general" else None,
+            "radius_km": 30 if region != "general" else None,
+            "ntotal": count,
+            "index_type": "flat",
+            "path": os.path.join("shards", region),
+        }
+    conn.commit()
+    conn.close()
+
+    with open(os.path.join(path, "routing.json"), "w", encoding="utf-8") as f:
+        json.dump({"model": "benchmark", "general": "general", "shards": shards}, f, ensure_ascii=False)
+
+
+# --- 各項量測 ---
+def bench_parsing(results: list, sizes: list) -> None:
+    from parsing import parse_options_prompt, parse_rag_output, parse_key_output
+
+    req_data = _load_json('request.json')
+    for n in sizes:
+        rng = random.Random(SEED)
+        places = make_places(n, rng)
+        reply = make_rag_reply(places, rng)
+        key_reply = '"' + ", ".join(f"關鍵字{i}" for i in range(n)) + '"'
+
+        record(results, "parsing.parse_options_prompt", n, "candidates",
+               lambda: parse_options_prompt("適合小孩放電的室內景點", "家庭", places))
+
+        def parse_reply():
+            with quiet():
+                options = parse_rag_output(reply, places, req_data)
+            assert all(o["place_id"] for o in options), "推薦地點沒有對應回候選地點"
+
+        record(results, "parsing.parse_rag_output", n, "candidates", parse_reply)
+        record(results, "parsing.parse_key_output", n, "keywords", lambda: parse_key_output(key_reply))
+
+
+def bench_retrieval(results: list, sizes: list) -> None:
+    import vector_store
+    from llm_client import retrieve_context
+
+    req_data = _load_json('request.json')
+    location = (req_data["coordinates"]["lat"], req_data["coordinates"]["lng"])
+    for n in sizes:
+        path = tempfile.mkdtemp(prefix="bench_faiss_")
+        try:
+            build_vector_db(path, n, location)
+            vector_store.load_local(path, HashEmbeddings())
+            with quiet():
+                vector_store.get_shard("bench_region")
+                vector_store.get_shard("general")
+
+            # 每次都是新的 query：embedding 與檢索結果都不會命中快取
+            counter = iter(range(sys.maxsize))
+            record(results, "retrieval.retrieve_context.cold", n, "chunks",
+                   lambda: retrieve_context(f"[{n}] 適合親子的室內景點 #{next(counter)}", location))
+
+            # 相同 query：直接使用快取的檢索結果，只從 docstore 取回文字
+            query = f"[{n}] 適合親子的室內景點"
+            retrieve_context(query, location)
+            record(results, "retrieval.retrieve_context.warm", n, "chunks",
+                   lambda: retrieve_context(query, location))
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _use_trip_db(db_file: str, json_file: str) -> None:
+    """讓 trip_store 改用指定的資料庫 (每個大小各自一個)"""
+    import trip_store
+
+    conn = getattr(trip_store._local, "conn", None)
+    if conn is not None:
+        conn.close()
+        trip_store._local.conn = None
+    trip_store.DB_FILE = db_file
+    trip_store.LEGACY_JSON_FILE = json_file
+    trip_store._initialized = False
+
+
+def bench_trips(results: list, sizes: list) -> None:
+    import trip_store
+
+    original = (trip_store.DB_FILE, trip_store.LEGACY_JSON_FILE)
+    for n in sizes:
+        rng = random.Random(SEED)
+        trips = make_trips(n, rng)
+        path = tempfile.mkdtemp(prefix="bench_trips_")
+        try:
+            json_file = os.path.join(path, "trips_data.json")
+
+            # 舊版 app.py 每次請求都整檔讀寫 trips_data.json
+            def save_data():
+                with open(json_file, 'w', encoding='utf-8') as f:
+                    json.dump(trips, f, ensure_ascii=False, indent=4)
+
+            def load_data():
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+
+            record(results, "trips.legacy_save_data", n, "trips", save_data)
+            record(results, "trips.legacy_load_data", n, "trips", load_data)
+
+            _use_trip_db(os.path.join(path, "trips.db"), json_file)
+
+            def import_json():
+                with quiet():
+                    trip_store.import_json(json_file)
+
+            record(results, "trips.import_json", n, "trips", import_json)
+
+            ids = [t["id"] for t in trips]
+            new_ids = iter(range(sys.maxsize))
+            meta = dict(trips[0]["meta"], trip_name="更新後的旅程")
+            item = trips[0]["schedule"][0]
+
+            # 會新增資料的項目放在最後，以免影響其他項目的資料量
+            record(results, "trips.get_trip", n, "trips", lambda: trip_store.get_trip(rng.choice(ids)))
+            record(results, "trips.list_trips", n, "trips", trip_store.list_trips)
+            record(results, "trips.update_meta", n, "trips", lambda: trip_store.update_meta(rng.choice(ids), meta))
+            record(results, "trips.add_item", n, "trips", lambda: trip_store.add_item(rng.choice(ids), item))
+            record(results, "trips.create_trip", n, "trips",
+                   lambda: trip_store.create_trip(dict(trips[0], id=f"bench-new-{next(new_ids)}")))
+        finally:
+            _use_trip_db(*original)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# --- 與舊結果比較 ---
+def compare(results: list, baseline: dict, threshold: float, min_delta_ms: float = MIN_DELTA_MS) -> list:
+    """
+    以 (name, size) 對應舊結果，比較 median
+
+    Returns:
+        list: 每項的 baseline_ms、median_ms、change (變化比例) 與 regression
+    """
+    old = {(r["name"], r["size"]): r for r in baseline.get("results", [])}
+    comparison = []
+    for result in results:
+        before = old.get((result["name"], result["size"]))
+        if before is None or not before["median_ms"]:
+            continue
+        change = result["median_ms"] / before["median_ms"] - 1
+        comparison.append({
+            "name": result["name"],
+            "size": result["size"],
+            "baseline_ms": before["median_ms"],
+            "median_ms": result["median_ms"],
+            "change": round(change, 4),
+            "regression": change > threshold and result["median_ms"] - before["median_ms"] > min_delta_ms,
+        })
+    return comparison
+
+
+def _parse_sizes(text: str) -> list:
+    return [int(s) for s in text.split(",") if s.strip()]
+
+
+def main(argv: list = None) -> int:
+    global REPEAT
+    parser = argparse.ArgumentParser(description="pipeline 本機步驟的離線 benchmark")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"要執行的項目，以逗號分隔 ({', '.join(SUITES)})")
+    parser.add_argument("--candidates", type=_parse_sizes, help="候選地點數量，例如 20,1000")
+    parser.add_argument("--chunks", type=_parse_sizes, help="合成 FAISS index 的 chunk 數量")
+    parser.add_argument("--trips", type=_parse_sizes, help="旅程數量")
+    parser.add_argument("--quick", action="store_true", help="只跑較小的資料量")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="每項量測次數")
+    parser.add_argument("--output", default="benchmark.json", help="結果輸出的 JSON 檔")
+    parser.add_argument("--baseline", help="要比較的舊結果 JSON 檔")
+    parser.add_argument("--threshold", type=float, default=0.2, help="median 變慢超過此比例視為退步")
+    args = parser.parse_args(argv)
+
+    suites = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"未知的項目: {', '.join(sorted(unknown))}")
+
+    REPEAT = args.repeat
+    # 各階段的耗時 log 會混進量測的時間 (需在載入 metrics 之前設定)
+    os.environ.setdefault("METRICS_LOG", "0")
+
+    sizes = {
+        "candidates": args.candidates or (QUICK_SIZES["candidates"] if args.quick else CANDIDATE_SIZES),
+        "chunks": args.chunks or (QUICK_SIZES["chunks"] if args.quick else CHUNK_SIZES),
+        "trips": args.trips or (QUICK_SIZES["trips"] if args.quick else TRIP_SIZES),
+    }
+
+    results = []
+    start = time.perf_counter()
+    if "parsing" in suites:
+        bench_parsing(results, sizes["candidates"])
+    if "retrieval" in suites:
+        bench_retrieval(results, sizes["chunks"])
+    if "trips" in suites:
+        bench_trips(results, sizes["trips"])
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "suites": suites,
+            "sizes": sizes,
+            "seconds": round(time.perf_counter() - start, 2),
+        },
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        report["baseline"] = {"file": args.baseline, "threshold": args.threshold,
+                              "comparison": compare(results, baseline, args.threshold)}
+        print(f"\n📊 與 {args.baseline} 比較 (門檻 +{args.threshold:.0%})")
+        for c in report["baseline"]["comparison"]:
+            mark = "❌" if c["regression"] else "✅"
+            print(f"{mark} {c['name']:<32} {c['size']:>7}  {c['baseline_ms']:>10.3f} → {c['median_ms']:>10.3f} ms "
+                  f"({c['change']:+.1%})")
+        regressions = [c for c in report["baseline"]["comparison"] if c["regression"]]
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"\n✅ 結果已寫入 {args.output}")
+
+    if regressions:
+        print(f"❌ {len(regressions)} 項比 baseline 慢超過 {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import os, json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+"""兩層快取
+第一層為記憶體中的 LRU，第二層為 SQLite 的持久化快取 (重啟後仍有效)
+每筆資料都有 TTL，另外可以用較短的 negative_ttl 快取「查無結果」
+"""
+
+BASE_DIR = os.path.dirname(__file__)
+CACHE_DB_FILE = os.getenv("CACHE_DB_FILE", os.path.join(BASE_DIR, 'json', 'cache.db'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace   TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    value       TEXT,
+    expires_at  REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+# 所有建立過的快取，給統計資訊使用
+_registry = {}
+
+
+class TieredCache:
+    def __init__(self, namespace: str, max_items: int = 1024, ttl: float = 7 * 86400,
+                 negative_ttl: float = 3600, persistent: bool = True):
+        """
+        :param namespace: 快取名稱，同一個 SQLite 檔案內以此區分
+        :param max_items: 記憶體 LRU 最多保留幾筆
+        :param ttl: 一般資料的有效秒數
+        :param negative_ttl: 查無結果 (None) 的有效秒數
+        :param persistent: 是否使用 SQLite 持久化
+        """
+        self.namespace = namespace
+        self.max_items = max_items
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.persistent = persistent
+
+        self._memory = OrderedDict()    # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._schema_ready = False
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        _registry[namespace] = self
+
+    # --- SQLite ---
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(CACHE_DB_FILE, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                conn.executescript(_SCHEMA)
+                # 啟動時順便清掉已過期的資料
+                with conn:
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at < ?",
+                                 (self.namespace, time.time()))
+                self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def _disk_get(self, key: str):
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"❌ 快取讀取失敗 ({self.namespace}): {e}")
+            return None
+        if row is None or row[1] < time.time():
+            return None
+        return (json.loads(row[0]) if row[0] is not None else None), row[1]
+
+    def _disk_set(self, key: str, value, expires_at: float) -> None:
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key,
+                     json.dumps(value, ensure_ascii=False) if value is not None else None,
+                     expires_at)
+                )
+        except sqlite3.Error as e:
+            print(f"❌ 快取寫入失敗 ({self.namespace}): {e}")
+
+    # --- 記憶體 LRU ---
+    def _memory_put_locked(self, key: str, value, expires_at: float) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    # --- 對外介面 ---
+    def get(self, key: str):
+        """
+        Returns:
+            (bool, value): 是否命中, 快取的值 (查無結果時為 None)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] >= now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[0]
+                del self._memory[key]
+
+        entry = self._disk_get(key) if self.persistent else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._memory_put_locked(key, entry[0], entry[1])
+            self.hits += 1
+            self.disk_hits += 1
+            return True, entry[0]
+
+    def set(self, key: str, value, ttl: float = None) -> None:
+        """寫入快取，value 為 None 時視為查無結果，使用 negative_ttl"""
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._memory_put_locked(key, value, expires_at)
+        if self.persistent:
+            self._disk_set(key, value, expires_at)
+
+    def get_or_fetch(self, key: str, fetch, ttl: float = None):
+        """命中時直接回傳，否則呼叫 fetch() 取得並寫入快取 (fetch 拋出例外時不寫入)"""
+        hit, value = self.get(key)
+        if hit:
+            return value
+        value = fetch()
+        self.set(key, value, ttl)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "memory_items": len(self._memory)
+            }
+
+
+def all_stats() -> dict:
+    """所有快取的命中統計"""
+    return {name: cache.stats() for name, cache in _registry.items()}
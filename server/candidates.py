@@ -0,0 +1,71 @@
+"""候選地點索引
+Google 三個關鍵字的搜尋結果以 place_id 合併，重複出現的地點只保留一筆，
+並記錄是哪些關鍵字搜到它；每間地點再給一個簡短且固定的編號 (P01, P02...) 讓 LLM 引用，
+解析回覆時以編號 (或完整名稱) 直接對應回地點，不再需要逐一比對名稱子字串
+"""
+
+
+class CandidateStore:
+    def __init__(self):
+        self._places = []           # 依第一次出現的順序
+        self._by_key = {}           # place_id (沒有時用名稱) -> place
+        self._by_short_id = {}      # P01 -> place
+        self._by_name = {}          # 名稱 -> place
+
+    @staticmethod
+    def _key(place: dict) -> str:
+        return place.get("place_id") or place.get("name", "")
+
+    def _index(self, place: dict) -> None:
+        self._by_key[self._key(place)] = place
+        self._by_short_id[place["short_id"]] = place
+        self._by_name.setdefault(place.get("name", ""), place)
+
+    def add_results(self, keyword: str, results: list) -> None:
+        """加入某個關鍵字的搜尋結果，已存在的地點只會多記一個關鍵字"""
+        for result in results:
+            place = self._by_key.get(self._key(result))
+            if place is None:
+                place = dict(result)
+                place["short_id"] = f"P{len(self._places) + 1:02d}"
+                place["keywords"] = []
+                self._places.append(place)
+                self._index(place)
+            if keyword and keyword not in place["keywords"]:
+                place["keywords"].append(keyword)
+
+    @classmethod
+    def from_places(cls, places: dict) -> "CandidateStore":
+        """由搜尋結果 (data.json 格式) 重建索引，已有 short_id 的地點沿用原本的編號"""
+        store = cls()
+        for result in places.get("results", []):
+            if "short_id" in result and store._key(result) not in store._by_key:
+                store._places.append(result)
+                store._index(result)
+            else:
+                store.add_results("", [result])
+        return store
+
+    def results(self) -> list:
+        return list(self._places)
+
+    def to_places(self, html_attributions: list = None) -> dict:
+        """輸出成原本 data.json 的格式"""
+        return {
+            "html_attributions": html_attributions or [],
+            "results": self.results(),
+            "status": "OK"
+        }
+
+    def resolve(self, short_id: str = None, name: str = None):
+        """以編號或完整名稱取得地點，找不到時回傳 None"""
+        if short_id:
+            place = self._by_short_id.get(short_id.strip().upper())
+            if place is not None:
+                return place
+        if name:
+            return self._by_name.get(name.strip())
+        return None
+
+    def __len__(self) -> int:
+        return len(self._places)
@@ -0,0 +1,123 @@
+import os
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from cache import TieredCache
+import vector_store
+
+"""Query embedding 快取
+retrieve_context 每次都要把整段 prompt 丟進 300M 參數的 embedding model，
+在 CPU 上是本地最花時間的步驟之一；相同 (正規化後) 的 query 直接使用快取的向量，
+檢索結果 (top-k 的 docstore id) 也一併快取，regenerate 與熱門查詢可以完全跳過 encoder
+檢索結果的快取 key 包含搜尋的 shard，不同地區的行程不會拿到彼此的結果
+"""
+
+CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", str(86400)))
+
+# 候選地點排序用的地點名稱向量另外存放，一次幾十個地點不會把 query 向量擠出快取
+DOC_CACHE_SIZE = int(os.getenv("EMBED_DOC_CACHE_SIZE", "4096"))
+
+embedding_cache = TieredCache("query_embedding", max_items=CACHE_SIZE, ttl=CACHE_TTL, persistent=False)
+document_cache = TieredCache("document_embedding", max_items=DOC_CACHE_SIZE, ttl=CACHE_TTL, persistent=False)
+doc_ids_cache = TieredCache("retrieval_doc_ids", max_items=CACHE_SIZE, ttl=CACHE_TTL, persistent=False)
+
+_stats_lock = threading.Lock()
+_encode_count = 0          # 送進 embedding model 的文字段數 (批次 encode 時每段各算一次)
+_encode_seconds = 0.0
+
+
+def normalize_query(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).strip()
+    return re.sub(r"\s+", " ", text)
+
+
+def query_key(text: str) -> str:
+    return hashlib.sha256(normalize_query(text).encode("utf-8")).hexdigest()
+
+
+def embed_query(text: str, key: str = None) -> list:
+    """取得 query 的向量，命中快取時不經過 embedding model"""
+    key = key or query_key(text)
+    hit, vector = embedding_cache.get(key)
+    if hit:
+        return vector
+
+    global _encode_count, _encode_seconds
+    model = vector_store.get_embedding_model()
+    start = time.perf_counter()
+    vector = model.embed_query(text)
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _encode_count += 1
+        _encode_seconds += elapsed
+
+    embedding_cache.set(key, vector)
+    return vector
+
+
+def embed_documents(texts: list) -> list:
+    """
+    取得多段文字的向量 (document 格式)，只有沒快取過的文字才會送進 embedding model
+    """
+    global _encode_count, _encode_seconds
+    keys = [query_key(t) for t in texts]
+    vectors = [None] * len(texts)
+    missing = []
+    for i, key in enumerate(keys):
+        hit, vector = document_cache.get(key)
+        if hit:
+            vectors[i] = vector
+        else:
+            missing.append(i)
+
+    if missing:
+        model = vector_store.get_embedding_model()
+        start = time.perf_counter()
+        new_vectors = model.embed_documents([texts[i] for i in missing])
+        elapsed = time.perf_counter() - start
+        with _stats_lock:
+            _encode_count += len(missing)
+            _encode_seconds += elapsed
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+            document_cache.set(keys[i], vector)
+    return vectors
+
+
+def search(text: str, k: int = vector_store.TOP_K, location=None) -> list:
+    """
+    檢索與 text 最相關的 k 個段落 (Document)，query 向量與結果 id 皆會快取
+
+    :param location: 行程起點 (lat, lng)，只搜尋涵蓋該地點的 shard；None 時搜尋全部
+    """
+    qkey = query_key(text)
+    regions = vector_store.route(location)
+    key = f"{qkey}:{k}:{','.join(regions)}"
+    hit, doc_ids = doc_ids_cache.get(key)
+    if not hit:
+        vector = embed_query(text, key=qkey)
+        doc_ids = vector_store.search_ids(vector, k, regions or None)
+        doc_ids_cache.set(key, doc_ids)
+    return vector_store.get_documents(doc_ids)
+
+
+def stats() -> dict:
+    """命中率與估計省下的 encoder 時間 (以每段文字的平均 encode 時間估算)"""
+    with _stats_lock:
+        avg = _encode_seconds / _encode_count if _encode_count else 0.0
+        embed_stats = embedding_cache.stats()
+        doc_stats = document_cache.stats()
+        ids_stats = doc_ids_cache.stats()
+        # 命中 doc id 快取時連 embedding 快取都不用查
+        saved_calls = embed_stats["hits"] + doc_stats["hits"] + ids_stats["hits"]
+        return {
+            "embedding": embed_stats,
+            "document_embedding": doc_stats,
+            "doc_ids": ids_stats,
+            "encoded_texts": _encode_count,
+            "avg_encode_seconds": round(avg, 4),
+            "saved_seconds": round(saved_calls * avg, 2)
+        }
@@ -0,0 +1,20 @@
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+"""向量模型
+透過google/embeddinggemma-300m的embedding model，幫忙解析faiss_db內容，以及做查詢
+"""
+
+class EmbeddingGemmaEmbeddings(HuggingFaceEmbeddings):
+    def __init__(self, **kwargs):
+        super().__init__(
+            model_name="google/embeddinggemma-300m",
+            encode_kwargs={"normalize_embeddings": True},
+            **kwargs
+        )
+
+    def embed_documents(self, texts):
+        texts = [f"title: none | text: {t}" for t in texts]
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        return super().embed_query(f"task: search result | query: {text}")
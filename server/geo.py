@@ -0,0 +1,114 @@
+import re
+import numpy as np
+
+"""向量化的距離計算
+候選地點的座標存成連續的 numpy array，一次算出所有地點與起點的距離，
+用來過濾超出 max_travel_distance 的地點、依距離排序，以及計算行程各點之間的距離矩陣
+"""
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def parse_radius_km(req_data: dict, default: str = "1 km") -> float:
+    """將 "1.5 km" 這類的 max_travel_distance 轉成公里數"""
+    text = req_data.get("max_travel_distance") or default
+    match = re.search(r"[\d.]+", str(text))
+    return float(match.group()) if match else float(re.search(r"[\d.]+", default).group())
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """起點 (lat, lng) 到多個點的大圓距離 (公里)，lats / lngs 可為 array 或單一數值"""
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lngs, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def pairwise_km(lats, lngs):
+    """N 個點兩兩之間的距離矩陣 (N x N，公里)"""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))[:, None]
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))[:, None]
+    a = (np.sin((lats.T - lats) / 2) ** 2
+         + np.cos(lats) * np.cos(lats.T) * np.sin((lngs.T - lngs) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _location(item: dict):
+    """支援 Google 搜尋結果 (geometry.location) 與選項 / 行程項目 (lat, lng) 兩種格式"""
+    loc = item.get("geometry", {}).get("location") or item
+    try:
+        return float(loc.get("lat")), float(loc.get("lng"))
+    except (TypeError, ValueError):
+        return np.nan, np.nan
+
+
+class GeoPoints:
+    """一組地點的座標 (連續的 float64 array)，座標缺失時為 NaN"""
+
+    def __init__(self, items: list):
+        self.items = items
+        coords = np.array([_location(item) for item in items], dtype=np.float64).reshape(-1, 2)
+        self.lats = np.ascontiguousarray(coords[:, 0])
+        self.lngs = np.ascontiguousarray(coords[:, 1])
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def distances_from(self, lat: float, lng: float):
+        """所有地點到起點的距離 (公里)，座標缺失的地點為 inf"""
+        return np.nan_to_num(haversine_km(lat, lng, self.lats, self.lngs), nan=np.inf)
+
+    def within(self, lat: float, lng: float, radius_km: float, sort: bool = True):
+        """
+        只保留距離起點 radius_km 內的地點
+
+        Returns:
+            (list, array): 地點, 對應的距離 (sort=True 時由近到遠)
+        """
+        distances = self.distances_from(lat, lng)
+        idx = np.flatnonzero(distances <= radius_km)
+        if sort:
+            idx = idx[np.argsort(distances[idx], kind="stable")]
+        return [self.items[i] for i in idx], distances[idx]
+
+    def pairwise(self):
+        return pairwise_km(self.lats, self.lngs)
+
+
+def start_point(req_data: dict):
+    coords = req_data.get("coordinates") or {}
+    return float(coords.get("lat") or 0.0), float(coords.get("lng") or 0.0)
+
+
+def trip_location(req_data: dict):
+    """行程起點 (lat, lng)，請求中沒有有效座標時回傳 None"""
+    coords = req_data.get("coordinates") or {}
+    try:
+        return float(coords["lat"]), float(coords["lng"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def filter_places_by_radius(places: dict, req_data: dict) -> dict:
+    """
+    移除超出使用者 max_travel_distance 的候選地點，並依距離由近到遠排序 (data.json 格式)
+    """
+    results = places.get("results", [])
+    if not results:
+        return places
+    lat, lng = start_point(req_data)
+    kept, _ = GeoPoints(results).within(lat, lng, parse_radius_km(req_data))
+    if len(kept) < len(results):
+        print(f"📍 距離過濾：{len(results)} → {len(kept)} 間")
+    return dict(places, results=kept)
+
+
+def fill_distances(options: list, req_data: dict) -> list:
+    """一次算出所有選項與起點的距離，寫入 distance_info"""
+    if not options:
+        return options
+    lat, lng = start_point(req_data)
+    distances = GeoPoints(options).distances_from(lat, lng)
+    for option, distance in zip(options, distances):
+        option["distance_info"] = f"{distance:.2f} km" if np.isfinite(distance) else "未知距離"
+    return options
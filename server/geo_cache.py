@@ -0,0 +1,41 @@
+import os
+import re
+import unicodedata
+from cache import TieredCache
+
+"""地址 → 經緯度 快取
+app.get_coordinates (Geocoding API) 與 google.get_lat_lng (Text Search) 共用
+查無結果的地址也會快取 (較短的 TTL)，網路錯誤則不快取
+"""
+
+geocode_cache = TieredCache(
+    "geocode",
+    max_items=int(os.getenv("GEOCODE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 86400))),
+    negative_ttl=float(os.getenv("GEOCODE_NEGATIVE_TTL", str(86400)))
+)
+
+
+def normalize_address(address: str) -> str:
+    """統一全形/半形、大小寫、空白與「臺/台」，讓相同地點對到同一個 key"""
+    text = unicodedata.normalize("NFKC", address).strip().lower()
+    text = text.replace("臺", "台")
+    return re.sub(r"\s+", " ", text)
+
+
+def cached_lat_lng(address: str, fetch):
+    """
+    先查快取，沒有才呼叫 fetch(address) 取得 (lat, lng)
+
+    fetch 查無結果時應回傳 (None, None)，暫時性錯誤則應拋出例外 (不會被快取)
+    """
+    value = geocode_cache.get_or_fetch(
+        normalize_address(address),
+        lambda: _to_cache_value(fetch(address))
+    )
+    return (value[0], value[1]) if value else (None, None)
+
+
+def _to_cache_value(lat_lng):
+    lat, lng = lat_lng
+    return None if lat is None or lng is None else [lat, lng]
@@ -1,29 +1,53 @@
-import requests
+import http_client
 import json
-import time, os, re
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import dump_json
+import metrics
+from rate_limit import places_limiter
+from geo_cache import cached_lat_lng
+import map_cache
+from candidates import CandidateStore
+from geo import parse_radius_km, GeoPoints
+from places_cache import places_cache, radius_bucket, cache_key as places_cache_key
 
 BASE_DIR = os.path.dirname(__file__)
 # --- 1. 設定區 ---
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# 可用 GOOGLE_MAPS_BASE_URL 改連其他位址 (例如 loadtest_stubs.py 的本機 stub)
+GOOGLE_MAPS_URL = os.getenv("GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com")
+# 等待 Places API 限流的最長秒數
+SEARCH_TIMEOUT = 10
+# Static Maps 預設參數
+MAP_ZOOM = 15
+MAP_SIZE = "600x400"
 
-def get_lat_lng(location_name):
-    """取得地點經緯度"""
-    url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+def _text_search_lat_lng(location_name):
+    """呼叫 Text Search，查無結果回傳 (None, None)，其他錯誤拋出例外 (不會被快取)"""
+    url = GOOGLE_MAPS_URL + "/maps/api/place/textsearch/json"
     params = {'query': location_name, 'key': GOOGLE_API_KEY, 'language': 'zh-TW'}
     
+    res = http_client.get(url, endpoint="places_text", params=params).json()
+    if res['status'] == 'OK' and res['results']:
+        loc = res['results'][0]['geometry']['location']
+        print(f"📍 已定位：{location_name} ({loc['lat']}, {loc['lng']})")
+        return loc['lat'], loc['lng']
+    if res['status'] == 'ZERO_RESULTS':
+        return None, None
+    raise RuntimeError(f"Text Search Error: {res['status']}")
+
+def get_lat_lng(location_name):
+    """取得地點經緯度 (與 app.get_coordinates 共用快取)"""
     try:
-        res = requests.get(url, params=params).json()
-        if res['status'] == 'OK' and res['results']:
-            loc = res['results'][0]['geometry']['location']
-            print(f"📍 已定位：{location_name} ({loc['lat']}, {loc['lng']})")
-            return loc['lat'], loc['lng']
+        return cached_lat_lng(location_name, _text_search_lat_lng)
     except Exception as e:
         print(f"❌ 定位錯誤: {e}")
     return None, None
 
 def search_places(lat, lng, keyword, radius=1000):
     """搜尋單一關鍵字"""
-    url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+    url = GOOGLE_MAPS_URL + "/maps/api/place/nearbysearch/json"
     params = {
         'location': f"{lat},{lng}",
         'radius': radius,
@@ -34,80 +58,126 @@ def search_places(lat, lng, keyword, radius=1000):
     }
     
     try:
-        res = requests.get(url, params=params).json()
-        if res.get('status') == 'OK':
+        res = http_client.get(url, endpoint="places_nearby", params=params).json()
+        status = res.get('status')
+        if status in ('OK', 'ZERO_RESULTS'):
             return res
+        print(f"❌ 搜尋失敗 ({keyword}): {status}")
+    except Exception as e:
+        print(f"❌ 搜尋錯誤 ({keyword}): {e}")
+    return None
+
+def _within_radius(shops, lat, lng, radius):
+    """
+    只保留距離起點 radius 公尺內的地點
+    搜尋與快取用的是進位後的半徑級距與 geohash 格子，結果可能超出使用者實際的位置與距離
+    """
+    results = shops.get("results") or []
+    kept, _ = GeoPoints(results).within(lat, lng, radius / 1000, sort=False)
+    if len(kept) == len(results):
+        return shops
+    return dict(shops, results=kept)
+
+def _search_keyword(lat, lng, keyword, radius):
+    """在共用的限流器下搜尋單一關鍵字，失敗時回傳 None，不影響其他關鍵字"""
+    # 同一區域、關鍵字、半徑級距、時段的結果直接使用快取
+    key = places_cache_key(lat, lng, keyword, radius)
+    hit, shops = places_cache.get(key)
+    if hit:
+        print(f"⚡ 使用快取：{keyword}")
+        return _within_radius(shops, lat, lng, radius)
+
+    if not places_limiter.acquire(timeout=SEARCH_TIMEOUT):
+        print(f"❌ 搜尋逾時 ({keyword}): 超過 Places API 速率限制")
+        return None
+    print(f"🔍 [{metrics.current_request_id()}] 正在搜尋：{keyword}...")
+    try:
+        with metrics.stage("places_nearby"):
+            shops = search_places(lat, lng, keyword, radius_bucket(radius))
+            # search_places 自己處理了錯誤 (回傳 None)，在這裡計入階段錯誤數
+            if shops is None:
+                metrics.STAGE_ERRORS.inc(stage="places_nearby")
     except Exception as e:
         print(f"❌ 搜尋錯誤 ({keyword}): {e}")
-        return []
+        return None
+
+    # 失敗 (None) 不快取，下次重新查詢；快取保留整個級距的結果，同級距的其他半徑也能使用
+    if shops is None:
+        return None
+    places_cache.set(key, shops)
+    return _within_radius(shops, lat, lng, radius)
 
-def create_data_json(keys_list):
-    req_path = os.path.join(BASE_DIR, 'json', 'request.json')
-    with open(req_path, "r", encoding='utf-8') as f:
-        req_data = json.load(f)
+def create_data_json(ctx, keys_list):
+    """
+    依關鍵字搜尋附近地點，合併後存到 ctx.places (原 data.json)
+    """
+    req_data = ctx.request
     
     lat = req_data['coordinates'].get('lat', 0.0)
     lng = req_data['coordinates'].get('lng', 0.0)
 
-    max_travel_distance = req_data.get('max_travel_distance', "1 km")
-    radius = int (1000 * float(re.search(r"[\d.]+", max_travel_distance).group()))
+    radius = int(1000 * parse_radius_km(req_data))
 
-    merged_shops = {
-        "html_attributions": [],
-        "results": [],
-        "status": "OK"
-    }
+    # 各關鍵字同時搜尋，共用 process 內的 token bucket 限流
+    # (每個搜尋各複製一份目前的 context，搜尋執行緒才會帶著同一個 request id)
+    with metrics.stage("places_search"), ThreadPoolExecutor(max_workers=max(1, len(keys_list))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _search_keyword, lat, lng, key, radius)
+                   for key in keys_list]
+        results = [future.result() for future in futures]
 
-    for key in keys_list:
-        print(f"🔍 正在搜尋：{key}...")
-        shops = search_places(lat, lng, key, radius)
+    # 以 place_id 合併重複的地點，並記錄每間地點是被哪些關鍵字搜到
+    store = CandidateStore()
+    html_attributions = []
+    for key, shops in zip(keys_list, results):
+        if not shops:
+            continue
         
         # 合併 html_attributions
-        merged_shops["html_attributions"].extend(shops.get("html_attributions", []))
+        html_attributions.extend(shops.get("html_attributions", []))
         
         # 合併 results
-        merged_shops["results"].extend(shops.get("results", []))
-        
-        # merged_shops["status"] = shops.get("status", "OK")
-        
-        time.sleep(1) 
+        store.add_results(key, shops.get("results", []))
+
+    merged_shops = store.to_places(html_attributions)
+    ctx.places = merged_shops
+    dump_json("data.json", merged_shops)
 
-    data_path = os.path.join(BASE_DIR, "json", "data.json")
-    with open(data_path, "w", encoding="utf-8") as f:
-        json.dump(merged_shops, f, ensure_ascii=False, indent=4)
+    print(f"✅ 完成！共找到 {len(merged_shops['results'])} 間不重複的地點")
+    return merged_shops
 
-    print(f"✅ 完成！共找到 {len(merged_shops)} 筆資料，已儲存至 'data.json'")
+def _fetch_static_map(lat, lng, zoom, size):
+    google_url = (
+        f"{GOOGLE_MAPS_URL}/maps/api/staticmap?"
+        f"center={lat},{lng}&"
+        f"zoom={zoom}&"
+        f"size={size}&"
+        f"maptype=roadmap&"
+        f"markers=color:red%7C{lat},{lng}&"
+        f"key={GOOGLE_API_KEY}"
+    )
+    
+    response = http_client.get(google_url, endpoint="static_map")
+    
+    if response.status_code == 200:
+        return response.content 
+    else:
+        print(f"❌ Google Map API Error: {response.status_code} - {response.text}")
+        return None
 
-def fetch_static_map_image(lat, lng):
+def fetch_static_map_image(lat, lng, zoom=MAP_ZOOM, size=MAP_SIZE):
     """
     接收經緯度，向 Google Maps Static API 請求圖片，
     並回傳圖片的二進位資料 (bytes)。
+    相同 (經緯度, zoom, size) 的圖片會從 map_cache 直接取得
     """
     if not lat or not lng:
         return None
 
     try:
-        zoom = 15
-        size = "600x400"
-        
-        google_url = (
-            f"https://maps.googleapis.com/maps/api/staticmap?"
-            f"center={lat},{lng}&"
-            f"zoom={zoom}&"
-            f"size={size}&"
-            f"maptype=roadmap&"
-            f"markers=color:red%7C{lat},{lng}&"
-            f"key={GOOGLE_API_KEY}"
-        )
-        
-        response = requests.get(google_url)
-        
-        if response.status_code == 200:
-            return response.content 
-        else:
-            print(f"❌ Google Map API Error: {response.status_code} - {response.text}")
-            return None
+        lat, lng = map_cache.round_coord(lat), map_cache.round_coord(lng)
+        key = map_cache.image_key(lat, lng, zoom, size)
+        return map_cache.get_or_fetch(key, lambda: _fetch_static_map(lat, lng, zoom, size))
 
     except Exception as e:
         print(f"❌ Fetch Map Error: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,112 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict, deque
+
+"""RAG AI 的對話歷史 (依 session 區分)
+原本所有使用者共用同一個 _history，而且每一輪都保存完整的 final_prompt (含檢索段落與整份候選清單)，
+這裡改成以 trip / session id 分開保存，且只保存精簡後的內容：
+使用者這輪的需求摘要，以及 AI 推薦過的地點名稱
+
+- 每個 session 有 token 上限，超過時從最舊的一輪開始丟棄
+- 閒置太久或 session 數量超過上限時，淘汰最久沒用的 session
+"""
+
+MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "1024"))
+# 每個 session 保留的歷史 token 上限
+SESSION_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+# 最多保留幾輪
+MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "10"))
+# 閒置多久 (秒) 後清除
+IDLE_TTL = float(os.getenv("HISTORY_IDLE_TTL", str(6 * 3600)))
+
+_CJK = re.compile(r"[\u3000-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓文字每字約 1 個 token，其餘約 4 個字元 1 個 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def recommended_names(reply: str) -> list:
+    """從 RAG AI 的回覆中取出推薦過的地點名稱"""
+    return [m.strip() for m in re.findall(r"地點名稱\s*[:：]\s*(.+)", reply)]
+
+
+class _Session:
+    def __init__(self):
+        self.turns = deque()    # (user_text, assistant_text, tokens)
+        self.tokens = 0
+        self.last_used = time.time()
+
+
+_sessions = OrderedDict()
+_lock = threading.Lock()
+
+
+def _evict_locked(now: float) -> None:
+    while _sessions:
+        session_id, session = next(iter(_sessions.items()))
+        if len(_sessions) > MAX_SESSIONS or now - session.last_used > IDLE_TTL:
+            del _sessions[session_id]
+        else:
+            break
+
+
+def get_messages(session_id: str) -> list:
+    """取得該 session 的歷史對話 (chat messages 格式)"""
+    now = time.time()
+    with _lock:
+        _evict_locked(now)
+        session = _sessions.get(session_id)
+        if session is None:
+            return []
+        session.last_used = now
+        _sessions.move_to_end(session_id)
+        messages = []
+        for user_text, assistant_text, _ in session.turns:
+            messages.append({"role": "user", "content": user_text})
+            messages.append({"role": "assistant", "content": assistant_text})
+        return messages
+
+
+def record_turn(session_id: str, user_note: str, reply: str) -> None:
+    """
+    以精簡的形式記錄一輪對話
+
+    :param user_note: 使用者這輪需求的摘要 (不含檢索資料與候選清單)
+    :param reply: RAG AI 的完整回覆，只會保留其中推薦的地點名稱
+    """
+    names = recommended_names(reply)
+    assistant_text = "已推薦：" + "、".join(names) if names else reply[:200]
+    tokens = estimate_tokens(user_note) + estimate_tokens(assistant_text)
+
+    now = time.time()
+    with _lock:
+        session = _sessions.get(session_id)
+        if session is None:
+            session = _sessions[session_id] = _Session()
+        session.turns.append((user_note, assistant_text, tokens))
+        session.tokens += tokens
+        session.last_used = now
+        _sessions.move_to_end(session_id)
+
+        while session.turns and (session.tokens > SESSION_TOKEN_BUDGET or len(session.turns) > MAX_TURNS):
+            _, _, old_tokens = session.turns.popleft()
+            session.tokens -= old_tokens
+        _evict_locked(now)
+
+
+def clear(session_id: str) -> None:
+    with _lock:
+        _sessions.pop(session_id, None)
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "sessions": len(_sessions),
+            "total_tokens": sum(s.tokens for s in _sessions.values())
+        }
@@ -0,0 +1,136 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+"""對外 HTTP 連線
+LLM gateway 與 Google APIs 共用同一個 requests.Session，
+以 keep-alive 連線池避免每次呼叫都重新 TCP + TLS 握手，
+並統一處理逾時、429/5xx 重試 (含 jitter 的指數退避) 以及各 host 的延遲 / 錯誤統計
+(同時記錄到 metrics 的 http_client_* 指標)
+"""
+
+# 每個 host 保留的連線數
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+# 最多重試次數 (不含第一次)
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+# 退避的基本秒數與上限
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+# 各 endpoint 的 (連線逾時, 讀取逾時) 秒數
+TIMEOUTS = {
+    "llm_chat": (5, 300),
+    "geocode": (3, 10),
+    "places_text": (3, 10),
+    "places_nearby": (3, 15),
+    "static_map": (3, 15),
+    "default": (5, 30),
+}
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 讀取逾時時對方可能仍在處理 (LLM 生成不是冪等的，且讀取逾時本身就很長)，這些 endpoint 不重試讀取逾時
+NO_READ_TIMEOUT_RETRY = {"llm_chat"}
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(host: str, endpoint: str, elapsed: float, error: bool, retried: bool) -> None:
+    metrics.HTTP_CLIENT_SECONDS.observe(elapsed, host=host, endpoint=endpoint)
+    if error:
+        metrics.HTTP_CLIENT_ERRORS.inc(host=host, endpoint=endpoint)
+    if retried:
+        metrics.HTTP_CLIENT_RETRIES.inc(host=host, endpoint=endpoint)
+    with _stats_lock:
+        s = _stats.setdefault(host, {
+            "requests": 0, "errors": 0, "retries": 0,
+            "total_seconds": 0.0, "max_seconds": 0.0
+        })
+        s["requests"] += 1
+        s["total_seconds"] += elapsed
+        s["max_seconds"] = max(s["max_seconds"], elapsed)
+        if error:
+            s["errors"] += 1
+        if retried:
+            s["retries"] += 1
+
+
+def _backoff(attempt: int, response=None) -> float:
+    """第 attempt 次重試前要等待的秒數，429 時優先採用 Retry-After"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, delay)     # full jitter
+
+
+def request(method: str, url: str, endpoint: str = "default", retries: int = None, **kwargs):
+    """
+    送出 HTTP 請求，429 / 5xx / 連線錯誤會自動重試 (NO_READ_TIMEOUT_RETRY 中的 endpoint 讀取逾時時不重試)
+
+    :param endpoint: TIMEOUTS 中的名稱，決定逾時設定
+    :param retries: 覆寫重試次數
+    :return: requests.Response (重試用盡時回傳最後一次的 response)
+    :raises requests.RequestException: 重試用盡後仍連線失敗
+    """
+    host = urlsplit(url).netloc
+    kwargs.setdefault("timeout", TIMEOUTS.get(endpoint, TIMEOUTS["default"]))
+    # 帶上目前的 request id，讓 gateway 端的 log 也能對應回同一次生成
+    request_id = metrics.current_request_id()
+    if request_id != "-":
+        kwargs["headers"] = dict(kwargs.get("headers") or {}, **{"X-Request-ID": request_id})
+    retries = MAX_RETRIES if retries is None else retries
+
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            response = _session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record(host, endpoint, time.perf_counter() - start, True, attempt > 0)
+            if attempt >= retries or (isinstance(e, requests.ReadTimeout) and endpoint in NO_READ_TIMEOUT_RETRY):
+                raise
+            print(f"⚠️ [{metrics.current_request_id()}] {host} 連線失敗，重試中 ({attempt + 1}/{retries}): {e}")
+            time.sleep(_backoff(attempt))
+            attempt += 1
+            continue
+
+        failed = response.status_code in RETRY_STATUS
+        _record(host, endpoint, time.perf_counter() - start, failed or response.status_code >= 400, attempt > 0)
+        if not failed or attempt >= retries:
+            return response
+
+        print(f"⚠️ [{metrics.current_request_id()}] {host} 回應 {response.status_code}，重試中 ({attempt + 1}/{retries})")
+        delay = _backoff(attempt, response)
+        response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def get(url: str, endpoint: str = "default", **kwargs):
+    return request("GET", url, endpoint=endpoint, **kwargs)
+
+
+def post(url: str, endpoint: str = "default", **kwargs):
+    return request("POST", url, endpoint=endpoint, **kwargs)
+
+
+def stats() -> dict:
+    """各 host 的請求數、錯誤數、重試數與平均 / 最大延遲"""
+    with _stats_lock:
+        result = {}
+        for host, s in _stats.items():
+            result[host] = dict(s)
+            result[host]["avg_seconds"] = round(s["total_seconds"] / s["requests"], 4) if s["requests"] else 0.0
+        return result
@@ -0,0 +1,133 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+"""背景生成工作
+/api/generate_ai_prompt 不再佔住 Flask worker 等整條 LLM / Google 流程，
+而是把工作丟到固定數量的背景執行緒，立即回傳 job id，
+前端再以 job id 查詢 (long-poll) 屬於自己的結果
+"""
+
+# 同時執行的生成工作數量
+MAX_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+# 排隊 + 執行中的工作上限，超過就直接拒絕，避免無限堆積
+MAX_PENDING = int(os.getenv("GENERATION_MAX_PENDING", "32"))
+# 完成的工作保留多久 (秒) 供前端取回
+JOB_TTL = int(os.getenv("GENERATION_JOB_TTL", "600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+
+class QueueFullError(RuntimeError):
+    """排隊中的工作已達上限"""
+
+
+class Job:
+    def __init__(self, ctx):
+        self.id = str(uuid.uuid4())
+        self.ctx = ctx
+        self.status = QUEUED
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def wait(self, timeout: float) -> bool:
+        """等待工作完成，回傳是否已完成"""
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        data = {"job_id": self.id, "status": self.status}
+        if self.status == DONE:
+            data["options"] = self.ctx.options
+        elif self.status == ERROR:
+            data["message"] = self.error
+        return data
+
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="generation")
+_jobs = {}
+_jobs_lock = threading.Lock()
+_pending = 0
+
+
+def _prune_locked() -> None:
+    now = time.time()
+    expired = [job_id for job_id, job in _jobs.items()
+               if job.finished_at and now - job.finished_at > JOB_TTL]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def _run(job: Job, fn) -> None:
+    global _pending
+    job.status = RUNNING
+    # 背景執行緒沿用建立 job 的請求的 request id
+    with metrics.bind_request_id(job.ctx.request_id):
+        metrics.STAGE_SECONDS.observe(time.time() - job.created_at, stage="job_queue")
+        try:
+            with metrics.stage(fn.__name__):
+                fn(job.ctx)
+            job.status = DONE
+        except Exception as e:
+            print(f"❌ [{job.ctx.request_id}] Job {job.id} 失敗: {e}")
+            job.error = str(e)
+            job.status = ERROR
+        finally:
+            job.finished_at = time.time()
+            with _jobs_lock:
+                _pending -= 1
+            job.ctx.finish()
+            job._done.set()
+
+
+def submit(fn, ctx) -> Job:
+    """
+    將 fn(ctx) 排入背景執行
+
+    Raises:
+        QueueFullError: 排隊中的工作已達 MAX_PENDING
+    """
+    global _pending
+    job = Job(ctx)
+    with _jobs_lock:
+        _prune_locked()
+        if _pending >= MAX_PENDING:
+            raise QueueFullError("目前生成請求過多，請稍後再試")
+        _pending += 1
+        _jobs[job.id] = job
+    _executor.submit(_run, job, fn)
+    return job
+
+
+def completed(ctx) -> Job:
+    """
+    登記一個已在請求中完成的工作 (不經過執行緒)，讓前端照常以 job id 取得結果
+    """
+    job = Job(ctx)
+    job.status = DONE
+    job.finished_at = time.time()
+    ctx.finish()
+    job._done.set()
+    with _jobs_lock:
+        _prune_locked()
+        _jobs[job.id] = job
+    return job
+
+
+def pending() -> int:
+    """排隊與執行中的工作數"""
+    with _jobs_lock:
+        return _pending
+
+
+def get_job(job_id: str):
+    """以 job id 取得工作，不存在或已過期時回傳 None"""
+    with _jobs_lock:
+        return _jobs.get(job_id)
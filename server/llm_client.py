@@ -1,80 +1,50 @@
 
 # llm_client.py
-import requests
+import http_client
 import os
 import json
 import textwrap
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from parsing import parse_key_prompt
-from huggingface_hub import login
+from pipeline import dump_json
+import embed_cache
+import history
+import prompt_budget
+import metrics
 
 
 print("llm_client.py Initializing ...")
 BASE_DIR = os.path.dirname(__file__)
-BASE_URL = "https://api-gateway.netdb.csie.ncku.edu.tw"
+# 可用 LLM_BASE_URL 改連其他 gateway (例如 loadtest_stubs.py 的本機 stub)
+BASE_URL = os.getenv("LLM_BASE_URL", "https://api-gateway.netdb.csie.ncku.edu.tw")
 ENDPOINT = "/api/chat"
 
 API_KEY = os.environ.get("LLM_API_KEY")
 
-# --- 內部對話歷史，自動初始化 ---
-_history = []
+# 對話歷史改由 history 模組依 session 保存 (精簡內容 + token 上限)
 
-# 可調整保留最近幾輪對話
-MAX_HISTORY = 10
-
-"""向量模型
-透過google/embeddinggemma-300m的embedding model，幫忙解析faiss_db內容，以及做查詢
-"""
-
-class EmbeddingGemmaEmbeddings(HuggingFaceEmbeddings):
-    def __init__(self, **kwargs):
-        super().__init__(
-            model_name="google/embeddinggemma-300m",
-            encode_kwargs={"normalize_embeddings": True},
-            **kwargs
-        )
-
-    def embed_documents(self, texts):
-        texts = [f"title: none | text: {t}" for t in texts]
-        return super().embed_documents(texts)
-
-    def embed_query(self, text):
-        return super().embed_query(f"task: search result | query: {text}")
-
-HF_TOKEN = os.environ.get("HUGGING_FACE_TOKEN")
-if not HF_TOKEN:
-    raise RuntimeError("HUGGING_FACE_TOKEN not set")
-
-login(token=HF_TOKEN)
-faiss_path = os.path.join(os.path.dirname(BASE_DIR), "vector_dataset", "faiss_db")
+def retrieve_chunks(user_input: str, location=None) -> list:
+    """
+    從 FAISS 資料庫檢索最相關的段落 (依相似度排序)
 
-embedding_model = EmbeddingGemmaEmbeddings()
-vectorstore = FAISS.load_local(
-    faiss_path,
-    embeddings=embedding_model,
-    allow_dangerous_deserialization=True
-)
-retriever = vectorstore.as_retriever(search_kwargs={"k": 4})    #每次檢索 4 個相關段落
+    :param location: 行程起點 (lat, lng)，只搜尋該地區的 shard
+    """
+    # 相同 query 直接使用快取的向量與檢索結果 (向量資料庫尚未載入完成時會在這裡等待)
+    with metrics.stage("retrieve_context"):
+        docs = embed_cache.search(user_input, location=location)
+    return [doc.page_content for doc in docs]
 
-def retrieve_context(user_input: str) -> str:
+def retrieve_context(user_input: str, location=None) -> str:
     """
     從 FAISS 資料庫檢索最相關的段落
     """
-    docs = retriever.invoke(user_input)
-    retrieved_chunks = "\n\n".join([doc.page_content for doc in docs])
-    return retrieved_chunks
+    return "\n\n".join(prompt_budget.merge_chunks(retrieve_chunks(user_input, location)))
 
-def call_RAG_llm(model: str, user_prompt: str) -> str:
+def _build_RAG_request(model: str, user_prompt: str, stream: bool, session_id: str = None, location=None):
     """
-    Call LLM chat API with automatic assistant history management.
+    組出 RAG AI 的請求內容 (system prompt + 該 session 的 history + 檢索資料 + user prompt)
 
-    :param model: model name, e.g. "llama3.1:70b"
-    :param prompt: user prompt
-    :return: assistant reply text
+    :return: (url, headers, payload, final_prompt, prompt_tokens)
     """
-    global _history  # 使用 module 內部 history
-
     system_prompt = textwrap.dedent("""
         你是一位資深的導遊，熟知台灣各處的美食、景點與娛樂
         能夠依照使用者不同的需求，推薦恰當且人性化的地點選擇
@@ -87,7 +57,7 @@ def call_RAG_llm(model: str, user_prompt: str) -> str:
         請嚴格依照回覆格式做回應
                              
         回覆格式：
-        1. 內容要包含地點名稱、地址、評分、推薦文、tags
+        1. 內容要包含編號、地點名稱、地址、評分、推薦文、tags，編號請照抄使用者提供的店家編號 (例如 P03)
         2. 每個推薦選項要用 --------- 做區隔
         3. 要以列點的方式輸出
         4. 不要將你的判斷文字輸出出來，只能有像是範例輸出的格式
@@ -101,6 +71,7 @@ def call_RAG_llm(model: str, user_prompt: str) -> str:
                                                                                        
         範例輸出：
         推薦地點1:
+            編號 : P03
             地點名稱 : xx飯館
             地址 : xx路x段xxx號
             評分 : 4.2
@@ -108,6 +79,7 @@ def call_RAG_llm(model: str, user_prompt: str) -> str:
             tags : 百年老店、在地美食
         ---------
         推薦地點2:
+            編號 : P07
             地點名稱 : xx古蹟
             地址 : xx路x段xxx號
             評分 : 4.2
@@ -123,24 +95,16 @@ def call_RAG_llm(model: str, user_prompt: str) -> str:
         "Content-Type": "application/json"
     }
 
-    # 建立 messages
-    messages = []
-    # 加入system prompt
-    messages.append({"role": "system", "content": system_prompt})
-
-    # 加入歷史對話，保留最後 MAX_HISTORY 輪
-    if _history:
-        history = _history[-MAX_HISTORY*2:]  # 每輪包含 user + assistant
-        messages.extend(history)
+    # 該 session 的歷史對話 (已精簡並限制 token 數)
+    history_messages = history.get_messages(session_id) if session_id else []
 
-    # 加入本輪 user prompt
     # 先用 FAISS 取回相關資料
-    retrieved_context = retrieve_context(user_prompt)
+    retrieved_chunks = retrieve_chunks(user_prompt, location)
 
-    # 將檢索結果整合到 prompt
-    final_prompt = f"根據下列資料：\n{retrieved_context}\n\n回答使用者的問題：{user_prompt}\n若無法回答則請自行上網查找資料。"
-
-    messages.append({"role": "user", "content": final_prompt})
+    # 依各區的 token 預算組出 messages (超出時依序刪減檢索段落、舊 history、排名較後的候選地點)
+    assembled = prompt_budget.assemble(system_prompt, history_messages, retrieved_chunks, user_prompt)
+    messages = assembled["messages"]
+    final_prompt = assembled["final_prompt"]
 
     # print("------------------")
     # print("Prompt of RAG AI: ")
@@ -151,7 +115,7 @@ def call_RAG_llm(model: str, user_prompt: str) -> str:
     payload = {
         "model": model,
         "messages": messages,
-        "stream": False,            #是否串流回傳 token
+        "stream": stream,           #是否串流回傳 token
         "temperature": 0.6,         #創意度，越高回答越自由
         "top_p": 0.9,
         "max_tokens": 100,          #最大回傳長度
@@ -161,7 +125,29 @@ def call_RAG_llm(model: str, user_prompt: str) -> str:
         # "user": "student001"      #設定使用者 ID
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    return url, headers, payload, final_prompt, assembled["tokens"]["total"]
+
+def _remember_turn(session_id: str, history_note: str, reply: str) -> None:
+    """將本輪對話以精簡形式加入該 session 的 history"""
+    if session_id:
+        history.record_turn(session_id, history_note or "", reply)
+
+def call_RAG_llm(model: str, user_prompt: str, session_id: str = None, history_note: str = None,
+                 location=None) -> str:
+    """
+    Call LLM chat API with automatic assistant history management.
+
+    :param model: model name, e.g. "llama3.1:70b"
+    :param prompt: user prompt
+    :param session_id: trip / session id，決定使用哪一份 history (None 則不使用)
+    :param history_note: 存進 history 的本輪需求摘要
+    :param location: 行程起點 (lat, lng)，檢索時只搜尋該地區的資料
+    :return: assistant reply text
+    """
+    url, headers, payload, final_prompt, prompt_tokens = _build_RAG_request(
+        model, user_prompt, stream=False, session_id=session_id, location=location)
+
+    response = http_client.post(url, endpoint="llm_chat", headers=headers, json=payload)
 
     if response.status_code != 200:
         raise RuntimeError(
@@ -170,20 +156,75 @@ def call_RAG_llm(model: str, user_prompt: str) -> str:
 
     data = response.json()
 
-    # 儲存本輪 JSON
-    json_path = os.path.join(BASE_DIR, "json", "RAG_LLM_reply.json")
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    # 儲存本輪 JSON (僅 DEBUG_DUMP_JSON 開啟時)
+    dump_json("RAG_LLM_reply.json", data)
 
     # 取得 assistant 回覆
     reply = data["message"]["content"]
+    metrics.record_llm(model, payload["messages"], reply, prompt_tokens)
 
     # 將本輪對話加入 history
-    _history.append({"role": "user", "content": final_prompt})
-    _history.append({"role": "assistant", "content": reply})
+    _remember_turn(session_id, history_note, reply)
 
     return reply
 
+def _stream_token(line: str) -> str:
+    """
+    取出串流回覆中單行的文字片段
+    支援 Ollama 的 NDJSON 格式，以及 OpenAI 相容的 SSE (data: {...}) 格式
+    """
+    if line.startswith("data:"):
+        line = line[len("data:"):].strip()
+        if line == "[DONE]":
+            return ""
+    chunk = json.loads(line)
+    if "message" in chunk:
+        return chunk["message"].get("content", "")
+    choices = chunk.get("choices") or [{}]
+    return choices[0].get("delta", {}).get("content", "") or ""
+
+def stream_RAG_llm(model: str, user_prompt: str, session_id: str = None, history_note: str = None,
+                   location=None, record_history: bool = True):
+    """
+    以串流模式呼叫 RAG AI，每收到一段文字就 yield 出去
+    串流結束後，回覆一樣會加入 history (record_history=False 時由呼叫端自行決定何時加入)
+    中途停止讀取 (關閉 generator) 時連線會立即關閉
+
+    :param model: model name, e.g. "llama3.1:70b"
+    :param prompt: user prompt
+    :param session_id: trip / session id，決定使用哪一份 history (None 則不使用)
+    :param history_note: 存進 history 的本輪需求摘要
+    :param location: 行程起點 (lat, lng)，檢索時只搜尋該地區的資料
+    :param record_history: 是否在串流結束後將本輪對話加入 history
+    :return: generator of reply text fragments
+    """
+    url, headers, payload, final_prompt, prompt_tokens = _build_RAG_request(
+        model, user_prompt, stream=True, session_id=session_id, location=location)
+
+    with http_client.post(url, endpoint="llm_chat", headers=headers, json=payload, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"LLM API failed ({response.status_code}): {response.text}"
+            )
+
+        reply = ""
+        # NDJSON 回應通常沒有標示 charset，未指定時 iter_lines 會回傳 bytes
+        response.encoding = response.encoding or "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            token = _stream_token(line)
+            if token:
+                reply += token
+                yield token
+
+    dump_json("RAG_LLM_reply.json", {"model": model, "message": {"role": "assistant", "content": reply}})
+    metrics.record_llm(model, payload["messages"], reply, prompt_tokens)
+
+    # 將本輪對話加入 history
+    if record_history:
+        _remember_turn(session_id, history_note, reply)
+
 def call_key_llm(model: str, user_prompt: str) -> str:
     """
     Call LLM chat API.
@@ -240,7 +281,7 @@ def call_key_llm(model: str, user_prompt: str) -> str:
         # "user": "student001"      #設定使用者 ID
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    response = http_client.post(url, endpoint="llm_chat", headers=headers, json=payload)
 
     if response.status_code != 200:
         raise RuntimeError(
@@ -249,13 +290,12 @@ def call_key_llm(model: str, user_prompt: str) -> str:
 
     data = response.json()
 
-    # 儲存本輪 JSON
-    json_path = os.path.join(BASE_DIR, "json", "tag_LLM_reply.json")
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    # 儲存本輪 JSON (僅 DEBUG_DUMP_JSON 開啟時)
+    dump_json("tag_LLM_reply.json", data)
 
     # 取得 assistant 回覆
     reply = data["message"]["content"]
+    metrics.record_llm(model, messages, reply)
 
     return reply
 
@@ -0,0 +1,355 @@
+import os, json
+import sys
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from loadtest_stubs import StubState, STUB_DEFAULTS, parse_stub_spec, start_stubs, search_center
+
+"""多使用者壓力測試
+以 N 個同時執行的模擬使用者操作真正的 Flask app：
+    create_trip → generate_ai_prompt → get_ai_job (long-poll) → get_ai_options → map_image → add_item → trip_distances
+LLM gateway 與 Google Maps 由 loadtest_stubs.py 的本機 stub 取代 (延遲分布與錯誤率可調)，
+向量資料庫使用 benchmark.py 的合成 shard 與 hash embedding，不需要 Hugging Face 與任何 API key
+
+報告各 route 的 p50 / p95 / p99、吞吐量，以及正確性問題：
+    options_mismatch    get_ai_options 拿到的選項與自己的 job 結果不同 (例如多人共用 options.json)
+    foreign_place       選項的座標離自己的起點太遠，或 place_id 顯示它是在別的起點搜尋到的 (拿到別人的地點)
+    no_options          job 完成但沒有任何選項
+    schedule_mismatch   add_item 之後，旅程的行程項目與自己加入的不一致
+    job_timeout         生成 job 超過 JOB_TIMEOUT 仍未結束
+
+    python loadtest.py --users 20 --iterations 2
+    python loadtest.py --users 50 --stub llm_rag=3:8:0.05 --stub places=0.2:1:0.02 --output loadtest.json
+    python loadtest.py --target http://127.0.0.1:5000     # 對已啟動的 app (需自行指向 loadtest_stubs.py)
+"""
+
+BASE_DIR = os.path.dirname(__file__)
+
+# 一次生成最多等幾秒
+JOB_TIMEOUT = 300
+# 每個 HTTP 請求的逾時秒數
+REQUEST_TIMEOUT = 60
+# 選項離起點超過 (搜尋半徑 + 此值) 公里就視為拿到別人的地點
+FOREIGN_MARGIN_KM = 2.0
+# stub 地點的查詢座標離起點超過此公里數就視為別人的搜尋結果
+# (places_cache 以 geohash 格子共用結果，精度 6 的格子對角約 1.3 km)
+SEARCH_CENTER_MARGIN_KM = 1.5
+# 報告中每種正確性問題最多列出幾個例子
+MAX_EXAMPLES = 5
+# 合成向量資料庫的 chunk 數
+SYNTHETIC_CHUNKS = 2000
+
+
+def percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def distance_km(lat1, lng1, lat2, lng2) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (float(lat1), float(lng1), float(lat2), float(lng2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+class Recorder:
+    """各 route 的延遲與錯誤、完成的生成數與正確性問題 (thread-safe)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}     # route -> [秒]
+        self.errors = {}        # route -> 次數
+        self.violations = {}    # 類型 -> [例子]
+        self.generations = 0
+
+    def request(self, route: str, elapsed: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def violation(self, kind: str, user: int, detail: str) -> None:
+        with self.lock:
+            self.violations.setdefault(kind, []).append({"user": user, "detail": detail})
+        print(f"❌ 使用者 {user} {kind}: {detail}")
+
+    def report(self, seconds: float) -> dict:
+        with self.lock:
+            routes = {}
+            for route, samples in sorted(self.latencies.items()):
+                routes[route] = {
+                    "count": len(samples),
+                    "errors": self.errors.get(route, 0),
+                    "error_rate": round(self.errors.get(route, 0) / len(samples), 4),
+                    "p50_ms": round(percentile(samples, 0.50) * 1000, 1),
+                    "p95_ms": round(percentile(samples, 0.95) * 1000, 1),
+                    "p99_ms": round(percentile(samples, 0.99) * 1000, 1),
+                    "max_ms": round(max(samples) * 1000, 1),
+                }
+            total = sum(len(s) for route, s in self.latencies.items() if not route.startswith("flow:"))
+            return {
+                "throughput": {
+                    "requests": total,
+                    "requests_per_second": round(total / seconds, 2) if seconds else 0.0,
+                    "generations": self.generations,
+                    "generations_per_minute": round(self.generations / seconds * 60, 2) if seconds else 0.0,
+                },
+                "routes": routes,
+                "violations": {
+                    "count": sum(len(v) for v in self.violations.values()),
+                    "by_type": {kind: len(v) for kind, v in self.violations.items()},
+                    "examples": {kind: v[:MAX_EXAMPLES] for kind, v in self.violations.items()},
+                },
+            }
+
+
+class SimulatedUser:
+    """一個使用者的操作流程，每個使用者有自己的 session 與旅程"""
+
+    def __init__(self, user: int, base_url: str, recorder: Recorder, args):
+        self.user = user
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.args = args
+        self.http = requests.Session()
+        self.rng = random.Random(user)
+
+    def call(self, route: str, method: str, path: str, expect=(200,), **kwargs):
+        """送出請求並記錄延遲，連線失敗時回傳 None"""
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=REQUEST_TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.request(route, time.perf_counter() - start, False)
+            print(f"⚠️ 使用者 {self.user} {route} 連線失敗: {e}")
+            return None
+        self.recorder.request(route, time.perf_counter() - start, response.status_code in expect)
+        return response
+
+    def run(self) -> None:
+        time.sleep(self.args.ramp * self.user / max(1, self.args.users))
+        for iteration in range(self.args.iterations):
+            try:
+                self.run_once(iteration)
+            except Exception as e:
+                self.recorder.violation("client_error", self.user, f"{type(e).__name__}: {e}")
+
+    def run_once(self, iteration: int) -> None:
+        # 1. 建立旅程 (地址不同，起點座標也不同)
+        response = self.call("/api/create_trip", "POST", "/api/create_trip", json={
+            "trip_name": f"壓力測試 {self.user}-{iteration}",
+            "location": f"LOADTEST 使用者{self.user} 第{iteration}趟",
+            "date": "2025/10/20",
+            "companion": self.rng.choice(["家庭", "情侶", "朋友"]),
+            "transport": "大眾運輸",
+        })
+        if response is None or response.status_code != 200:
+            return
+        trip_id = response.json()["trip_id"]
+        start_point = response.json().get("start_point") or {}
+        if start_point.get("lat") is None:
+            self.recorder.violation("create_trip_no_coordinates", self.user, trip_id)
+            return
+
+        # 2. 產生選項並以 long-poll 等待
+        radius_km = self.rng.choice([1, 2, 3])
+        payload = {
+            "time_slot": "13:00 - 15:00",
+            "category_selection": [self.rng.choice(["美食", "景點", "娛樂"])],
+            "max_travel_distance": f"{radius_km} km",
+            "prompt": self.rng.choice(["", "想吃在地小吃", "適合小孩放電", "安靜可以聊天"]),
+            "companion": "家庭",
+            "trip_id": trip_id,
+            "session_id": trip_id,
+            "coordinates": {"lat": start_point["lat"], "lng": start_point["lng"]},
+            "stream": False,
+        }
+        flow_start = time.perf_counter()
+        response = self.call("/api/generate_ai_prompt", "POST", "/api/generate_ai_prompt",
+                             expect=(202,), json=payload)
+        if response is None or response.status_code != 202:
+            return
+        job_id = response.json()["job_id"]
+
+        job = None
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            response = self.call("/api/get_ai_job/<job_id>", "GET", f"/api/get_ai_job/{job_id}?wait=20")
+            if response is None or response.status_code != 200:
+                return
+            job = response.json()
+            if job["status"] in ("done", "error"):
+                break
+        if job is None or job["status"] not in ("done", "error"):
+            self.recorder.violation("job_timeout", self.user, job_id)
+            return
+        # 生成失敗 (例如 stub 注入的錯誤重試後仍失敗) 算在 flow:generation 的錯誤，不是正確性問題
+        self.recorder.request("flow:generation", time.perf_counter() - flow_start, job["status"] == "done")
+        if job["status"] == "error":
+            return
+        with self.recorder.lock:
+            self.recorder.generations += 1
+
+        options = job.get("options") or []
+        if not options:
+            self.recorder.violation("no_options", self.user, job_id)
+            return
+        for option in options:
+            if not option.get("place_id"):
+                continue
+            distance = distance_km(start_point["lat"], start_point["lng"], option["lat"], option["lng"])
+            if distance > radius_km + FOREIGN_MARGIN_KM:
+                self.recorder.violation("foreign_place", self.user,
+                                        f"{option['place_name']} 距離起點 {distance:.1f} km")
+                continue
+            # 距離在範圍內，但可能是附近其他使用者的搜尋結果
+            center = search_center(option["place_id"])
+            if center is not None:
+                offset = distance_km(start_point["lat"], start_point["lng"], *center)
+                if offset > SEARCH_CENTER_MARGIN_KM:
+                    self.recorder.violation("foreign_place", self.user,
+                                            f"{option['place_name']} 是在距離起點 {offset:.1f} km 的位置搜尋到的")
+
+        # 3. 以 trip id 再取一次選項，必須與自己的 job 結果相同
+        response = self.call("/api/get_ai_options", "GET", f"/api/get_ai_options?trip_id={trip_id}")
+        if response is not None and response.status_code == 200:
+            fetched = response.json().get("options") or []
+            if [o.get("place_id") for o in fetched] != [o.get("place_id") for o in options]:
+                self.recorder.violation("options_mismatch", self.user, f"trip {trip_id}")
+
+        # 4. 選項卡片的地圖
+        for option in options[:self.args.maps]:
+            self.call("/api/map_image", "GET", "/api/map_image",
+                      expect=(200, 304), params={"lat": option["lat"], "lng": option["lng"]})
+
+        # 5. 加入行程，並確認旅程中的項目是自己加入的
+        item = options[0]
+        response = self.call("/api/add_item", "POST", "/api/add_item", json={"trip_id": trip_id, "item": item})
+        if response is None or response.status_code != 200:
+            return
+        response = self.call("/api/trip_distances/<trip_id>", "GET", f"/api/trip_distances/{trip_id}")
+        if response is not None and response.status_code == 200:
+            places = response.json().get("places", [])
+            if places != [item["place_name"]]:
+                self.recorder.violation("schedule_mismatch", self.user, f"trip {trip_id}: {places}")
+
+
+def start_app(workdir: str, stubs: dict) -> str:
+    """
+    在背景執行緒以 werkzeug 啟動 Flask app (資料庫與快取都放在 workdir)，回傳 base url
+    設定需在 import app 之前寫入環境變數
+    """
+    os.environ.update({
+        "LLM_BASE_URL": stubs["llm_url"],
+        "GOOGLE_MAPS_BASE_URL": stubs["google_url"],
+        "GOOGLE_API_KEY": "loadtest",
+        "LLM_API_KEY": "loadtest",
+        "WARMUP_ON_START": "0",
+        "TRIP_DB_FILE": os.path.join(workdir, "trips.db"),
+        "CACHE_DB_FILE": os.path.join(workdir, "cache.db"),
+        "MAP_CACHE_DIR": os.path.join(workdir, "map_cache"),
+    })
+    # 各階段的耗時 log 改由報告呈現
+    os.environ.setdefault("METRICS_LOG", "0")
+    import logging
+    import vector_store
+    import benchmark
+
+    vectors = os.path.join(workdir, "faiss_db")
+    os.makedirs(vectors)
+    benchmark.build_vector_db(vectors, SYNTHETIC_CHUNKS, (23.5, 120.6))
+    vector_store.load_local(vectors, benchmark.HashEmbeddings())
+
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadtest-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def print_report(report: dict) -> None:
+    print(f"\n📊 {report['meta']['users']} 位使用者 × {report['meta']['iterations']} 次，"
+          f"共 {report['meta']['seconds']}s")
+    print(f"{'route':<34}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, r in report["routes"].items():
+        print(f"{route:<34}{r['count']:>7}{r['errors']:>8}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+    t = report["throughput"]
+    print(f"\n🚀 {t['requests_per_second']} req/s，{t['generations_per_minute']} 次生成 / 分鐘")
+    v = report["violations"]
+    if v["count"]:
+        print(f"❌ 正確性問題 {v['count']} 個：" + "、".join(f"{k} {n}" for k, n in v["by_type"].items()))
+    else:
+        print("✅ 沒有正確性問題")
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="以本機 stub 對 Flask app 做多使用者壓力測試")
+    parser.add_argument("--users", type=int, default=10, help="同時執行的使用者數")
+    parser.add_argument("--iterations", type=int, default=1, help="每位使用者執行幾次完整流程")
+    parser.add_argument("--ramp", type=float, default=2.0, help="在幾秒內陸續啟動所有使用者")
+    parser.add_argument("--maps", type=int, default=2, help="每次生成後讀取幾張地圖")
+    parser.add_argument("--stub", action="append", default=[], metavar="NAME=MEDIAN:P95:ERROR_RATE",
+                        help=f"調整某個 stub 的延遲與錯誤率 ({', '.join(STUB_DEFAULTS)})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--target", help="改測已啟動的 app (需自行以 loadtest_stubs.py 提供 stub)")
+    parser.add_argument("--output", help="報告輸出的 JSON 檔")
+    args = parser.parse_args(argv)
+
+    try:
+        config = dict(parse_stub_spec(spec) for spec in args.stub)
+    except ValueError as e:
+        parser.error(str(e))
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    state = None
+    try:
+        if args.target:
+            base_url = args.target
+        else:
+            state = StubState(config, args.seed)
+            stubs = start_stubs(state)
+            print(f"🧪 stub: LLM {stubs['llm_url']}，Google {stubs['google_url']}")
+            base_url = start_app(workdir, stubs)
+        print(f"🧪 對 {base_url} 啟動 {args.users} 位使用者 ...")
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users, thread_name_prefix="loadtest-user") as executor:
+            for user in range(args.users):
+                executor.submit(SimulatedUser(user, base_url, recorder, args).run)
+        seconds = time.perf_counter() - start
+
+        report = recorder.report(seconds)
+        report["meta"] = {
+            "target": base_url,
+            "users": args.users,
+            "iterations": args.iterations,
+            "seconds": round(seconds, 2),
+            "stubs": {name: dict(zip(("median", "p95", "error_rate"), spec))
+                      for name, spec in (state.config.items() if state else [])},
+        }
+        if state is not None:
+            report["stub_stats"] = state.stats
+        print_report(report)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=4)
+            print(f"✅ 報告已寫入 {args.output}")
+        return 1 if report["violations"]["count"] else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import json
+import re
+import sys
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+"""壓力測試用的本機 stub
+取代 LLM gateway (/api/chat) 與 Google Maps (Geocoding、Text Search、Nearby Search、Static Maps)，
+每個 endpoint 的延遲 (對數常態分布，以 median / p95 設定) 與錯誤率 (回應 503) 都可以調整
+
+回應內容是依請求決定的假資料：
+    Geocoding / Text Search  依地址的 hash 產生台灣範圍內的座標
+    Nearby Search            在查詢座標附近產生地點，place_id 以 "stub:<lat>,<lng>:" 開頭，
+                             壓力測試可以藉此檢查使用者拿到的地點是不是自己的
+    /api/chat                key AI 回三個關鍵字；RAG AI 從 prompt 的候選清單中挑 5 間，依規定格式回覆 (支援串流)
+    Static Maps              1x1 的 PNG
+
+    python loadtest_stubs.py --llm-port 8001 --google-port 8002 --stub llm_rag=3:8:0.05
+    # 另一個終端機
+    LLM_BASE_URL=http://127.0.0.1:8001 GOOGLE_MAPS_BASE_URL=http://127.0.0.1:8002 GOOGLE_API_KEY=stub python app.py
+"""
+
+# endpoint -> (median 秒, p95 秒, 錯誤率)
+STUB_DEFAULTS = {
+    "llm_key": (0.3, 0.8, 0.0),
+    "llm_rag": (1.5, 4.0, 0.0),
+    "geocode": (0.05, 0.15, 0.0),
+    "places": (0.15, 0.5, 0.0),
+    "static_map": (0.05, 0.2, 0.0),
+}
+# 每次 Nearby Search 回傳的地點數
+PLACES_PER_SEARCH = 8
+# 串流回覆切成幾段送出
+STREAM_PIECES = 12
+
+KEYWORD_POOL = ["小吃店", "咖啡廳", "親子樂園", "古蹟", "夜市", "公園", "甜點店", "博物館", "老街"]
+
+# 1x1 透明 PNG
+PNG_PIXEL = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+def parse_stub_spec(text: str) -> tuple:
+    """
+    解析 "名稱=median:p95:錯誤率" (後兩項可省略)，例如 llm_rag=3:8:0.05
+
+    :raises ValueError: 名稱不存在或數值格式錯誤
+    """
+    name, _, spec = text.partition("=")
+    if name not in STUB_DEFAULTS:
+        raise ValueError(f"未知的 stub: {name} (可用: {', '.join(STUB_DEFAULTS)})")
+    median, p95, error_rate = STUB_DEFAULTS[name]
+    values = [float(v) for v in spec.split(":") if v != ""]
+    if values:
+        median = values[0]
+        p95 = values[1] if len(values) > 1 else max(p95, median)
+        error_rate = values[2] if len(values) > 2 else error_rate
+    return name, (median, p95, error_rate)
+
+
+class StubState:
+    """所有 stub 共用的設定與統計"""
+
+    def __init__(self, config: dict = None, seed: int = None):
+        self.config = dict(STUB_DEFAULTS, **(config or {}))
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {name: {"requests": 0, "injected_errors": 0} for name in self.config}
+
+    def latency(self, name: str) -> float:
+        """依 median 與 p95 取一個對數常態分布的延遲"""
+        median, p95, _ = self.config[name]
+        with self.lock:
+            z = self.rng.gauss(0, 1)
+        if median <= 0:
+            return 0.0
+        sigma = math.log(p95 / median) / 1.645 if p95 > median else 0.0
+        return median * math.exp(sigma * z)
+
+    def should_fail(self, name: str) -> bool:
+        with self.lock:
+            self.stats[name]["requests"] += 1
+            failed = self.rng.random() < self.config[name][2]
+            if failed:
+                self.stats[name]["injected_errors"] += 1
+            return failed
+
+
+def _unit(text: str, salt: str) -> float:
+    """由文字 hash 出 [0, 1) 的固定值"""
+    digest = hashlib.sha256(f"{salt}:{text}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def geocode_location(address: str) -> dict:
+    """地址固定對應到台灣西部範圍內的一個座標"""
+    return {"lat": round(22.2 + _unit(address, "lat") * 2.8, 7),
+            "lng": round(120.2 + _unit(address, "lng") * 0.9, 7)}
+
+
+def place_prefix(lat, lng) -> str:
+    """Nearby Search 在 (lat, lng) 產生的地點，其 place_id 的開頭"""
+    return f"stub:{float(lat):.5f},{float(lng):.5f}:"
+
+
+def search_center(place_id: str):
+    """由 stub 地點的 place_id 取回產生它的 Nearby Search 查詢座標，不是 stub 的地點回傳 None"""
+    match = re.match(r"stub:(-?[0-9.]+),(-?[0-9.]+):", place_id or "")
+    return (float(match.group(1)), float(match.group(2))) if match else None
+
+
+def nearby_results(lat: float, lng: float, keyword: str, count: int = PLACES_PER_SEARCH) -> list:
+    results = []
+    for i in range(count):
+        seed = f"{lat},{lng},{keyword},{i}"
+        results.append({
+            "business_status": "OPERATIONAL",
+            "geometry": {"location": {"lat": lat + (_unit(seed, "dlat") - 0.5) * 0.008,
+                                      "lng": lng + (_unit(seed, "dlng") - 0.5) * 0.008}},
+            "name": f"{keyword}測試店 {place_prefix(lat, lng)[5:-1]} #{i + 1}",
+            "place_id": f"{place_prefix(lat, lng)}{keyword}:{i}",
+            "rating": round(3.5 + _unit(seed, "rating") * 1.5, 1),
+            "user_ratings_total": int(_unit(seed, "total") * 2000),
+            "types": ["point_of_interest", "establishment"],
+            "vicinity": f"測試路{i + 1}號",
+            "opening_hours": {"open_now": True},
+        })
+    return results
+
+
+# RAG prompt 候選清單中的一間店 (parse_options_prompt 的格式)
+_CANDIDATE_RE = re.compile(r"編號：(\S*)\s*\n\s*地點名稱：(.+)\n\s*地址：(.+)\n\s*評分：(.+)")
+
+
+def rag_reply(user_prompt: str, rng: random.Random) -> str:
+    candidates = _CANDIDATE_RE.findall(user_prompt)
+    picks = rng.sample(candidates, min(5, len(candidates)))
+    blocks = []
+    for i, (short_id, name, address, rating) in enumerate(picks):
+        blocks.append(
+            f"推薦地點{i + 1}:\n"
+            f"    編號 : {short_id}\n"
+            f"    地點名稱 : {name.strip()}\n"
+            f"    地址 : {address.strip()}\n"
+            f"    評分 : {rating.strip()}\n"
+            f"    推薦文 : 壓力測試用的推薦文，氣氛輕鬆適合全家大小一起前往。\n"
+            f"    tags : 測試、親子同樂、在地推薦"
+        )
+    return "\n---------\n".join(blocks)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None     # 由 make_server 設定
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, status: int = 200) -> None:
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def _fail(self, name: str) -> bool:
+        """依錯誤率注入 503，有注入時回傳 True"""
+        if not self.state.should_fail(name):
+            return False
+        self._send_json({"error": f"stub injected error ({name})"}, status=503)
+        return True
+
+    # --- Google Maps ---
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path in ("/maps/api/geocode/json", "/maps/api/place/textsearch/json"):
+            time.sleep(self.state.latency("geocode"))
+            if self._fail("geocode"):
+                return
+            address = params.get("address") or params.get("query", "")
+            self._send_json({"status": "OK", "results": [{"geometry": {"location": geocode_location(address)}}]})
+        elif url.path == "/maps/api/place/nearbysearch/json":
+            time.sleep(self.state.latency("places"))
+            if self._fail("places"):
+                return
+            lat, lng = (float(v) for v in params.get("location", "0,0").split(","))
+            results = nearby_results(lat, lng, params.get("keyword", ""))
+            self._send_json({"html_attributions": [], "results": results, "status": "OK"})
+        elif url.path == "/maps/api/staticmap":
+            time.sleep(self.state.latency("static_map"))
+            if self._fail("static_map"):
+                return
+            self._send(200, PNG_PIXEL, "image/png")
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    # --- LLM gateway ---
+    def do_POST(self):
+        if urlsplit(self.path).path != "/api/chat":
+            self._send_json({"error": "not found"}, status=404)
+            return
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        user_prompt = payload.get("messages", [{}])[-1].get("content", "")
+        is_rag = "請幫我從以下的店家" in user_prompt
+        name = "llm_rag" if is_rag else "llm_key"
+
+        delay = self.state.latency(name)
+        if self._fail(name):
+            return
+        with self.state.lock:
+            if is_rag:
+                reply = rag_reply(user_prompt, self.state.rng)
+            else:
+                reply = ", ".join(self.state.rng.sample(KEYWORD_POOL, 3))
+
+        if not payload.get("stream"):
+            time.sleep(delay)
+            self._send_json({"model": payload.get("model"), "message": {"role": "assistant", "content": reply},
+                             "done": True})
+            return
+
+        # Ollama 的 NDJSON 串流格式，總延遲平均分配在每一段之間
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        size = max(1, math.ceil(len(reply) / STREAM_PIECES))
+        pieces = [reply[i:i + size] for i in range(0, len(reply), size)] or [""]
+        for piece in pieces:
+            time.sleep(delay / len(pieces))
+            self._write_chunk(json.dumps({"message": {"role": "assistant", "content": piece}, "done": False},
+                                         ensure_ascii=False) + "\n")
+        self._write_chunk(json.dumps({"message": {"role": "assistant", "content": ""}, "done": True}) + "\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def make_server(state: StubState, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_stubs(state: StubState, host: str = "127.0.0.1", llm_port: int = 0, google_port: int = 0) -> dict:
+    """
+    在背景執行緒啟動 LLM gateway 與 Google Maps 的 stub (port 0 表示自動選擇)
+
+    Returns:
+        dict: llm_url, google_url, servers
+    """
+    servers = [make_server(state, host, llm_port), make_server(state, host, google_port)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, name="loadtest-stub", daemon=True).start()
+    llm, google = (f"http://{host}:{s.server_address[1]}" for s in servers)
+    return {"llm_url": llm, "google_url": google, "servers": servers}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="LLM gateway 與 Google Maps 的本機 stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llm-port", type=int, default=8001)
+    parser.add_argument("--google-port", type=int, default=8002)
+    parser.add_argument("--stub", action="append", default=[], metavar="NAME=MEDIAN:P95:ERROR_RATE",
+                        help=f"調整某個 stub 的延遲與錯誤率 ({', '.join(STUB_DEFAULTS)})")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    try:
+        config = dict(parse_stub_spec(spec) for spec in args.stub)
+    except ValueError as e:
+        parser.error(str(e))
+    stubs = start_stubs(StubState(config, args.seed), args.host, args.llm_port, args.google_port)
+    print(f"✅ LLM gateway stub: {stubs['llm_url']}")
+    print(f"✅ Google Maps stub: {stubs['google_url']}")
+    print(f"👉 LLM_BASE_URL={stubs['llm_url']} GOOGLE_MAPS_BASE_URL={stubs['google_url']} GOOGLE_API_KEY=stub")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,159 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+"""Static Maps 圖片快取
+以 (四捨五入後的經緯度, zoom, size) 算出內容位址 (sha256)，
+先查記憶體 LRU，再查硬碟目錄，都沒有才向 Google 取圖
+硬碟快取有總大小上限，超過時刪除最久沒被讀取的檔案
+"""
+
+BASE_DIR = os.path.dirname(__file__)
+MAP_CACHE_DIR = os.getenv("MAP_CACHE_DIR", os.path.join(BASE_DIR, 'json', 'map_cache'))
+# 記憶體 / 硬碟快取的大小上限 (bytes)
+MEMORY_LIMIT = int(os.getenv("MAP_CACHE_MEMORY_BYTES", str(16 * 1024 * 1024)))
+DISK_LIMIT = int(os.getenv("MAP_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+# 經緯度四捨五入到小數第幾位 (5 位約 1 公尺)
+COORD_DECIMALS = 5
+
+_memory = OrderedDict()     # key -> bytes
+_memory_bytes = 0
+_lock = threading.Lock()
+_disk_lock = threading.Lock()
+_disk_bytes = None          # 硬碟快取目前大小 (估計值)，第一次寫入時掃描目錄取得
+
+hits = 0
+disk_hits = 0
+misses = 0
+
+
+def round_coord(value) -> float:
+    return round(float(value), COORD_DECIMALS)
+
+
+def image_key(lat, lng, zoom: int, size: str) -> str:
+    """圖片的內容位址，同時作為 ETag"""
+    raw = f"{round_coord(lat)},{round_coord(lng)}|{zoom}|{size}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _path(key: str) -> str:
+    return os.path.join(MAP_CACHE_DIR, key[:2], f"{key}.png")
+
+
+def _memory_put_locked(key: str, content: bytes) -> None:
+    global _memory_bytes
+    if key in _memory:
+        _memory_bytes -= len(_memory.pop(key))
+    _memory[key] = content
+    _memory_bytes += len(content)
+    while _memory_bytes > MEMORY_LIMIT and _memory:
+        _, old = _memory.popitem(last=False)
+        _memory_bytes -= len(old)
+
+
+def _disk_get(key: str):
+    path = _path(key)
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        os.utime(path)      # 更新時間，作為 LRU 的依據
+        return content
+    except OSError:
+        return None
+
+
+def _disk_put(key: str, content: bytes) -> None:
+    path = _path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"❌ 地圖快取寫入失敗: {e}")
+        return
+    global _disk_bytes
+    with _disk_lock:
+        if _disk_bytes is not None:
+            _disk_bytes += len(content)
+        if _disk_bytes is None or _disk_bytes > DISK_LIMIT:
+            _disk_bytes = _evict_disk_locked()
+
+
+def _evict_disk_locked() -> int:
+    """
+    掃描硬碟快取，超過 DISK_LIMIT 時從最久沒用的檔案開始刪除
+
+    Returns:
+        int: 整理後的總大小
+    """
+    files = []
+    total = 0
+    for root, _, names in os.walk(MAP_CACHE_DIR):
+        for name in names:
+            if not name.endswith(".png"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= DISK_LIMIT:
+        return total
+    files.sort()
+    for _, size, path in files:
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+        if total <= DISK_LIMIT:
+            break
+    return total
+
+
+def get_or_fetch(key: str, fetch):
+    """
+    取得圖片內容，沒有快取時呼叫 fetch() 取得 (回傳 None 表示失敗，不快取)
+    """
+    global hits, disk_hits, misses
+    with _lock:
+        content = _memory.get(key)
+        if content is not None:
+            _memory.move_to_end(key)
+            hits += 1
+            return content
+
+    content = _disk_get(key)
+    if content is not None:
+        with _lock:
+            _memory_put_locked(key, content)
+            hits += 1
+            disk_hits += 1
+        return content
+
+    with _lock:
+        misses += 1
+    content = fetch()
+    if content:
+        with _lock:
+            _memory_put_locked(key, content)
+        _disk_put(key, content)
+    return content
+
+
+def stats() -> dict:
+    with _lock:
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "disk_hits": disk_hits,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "memory_bytes": _memory_bytes
+        }
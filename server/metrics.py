@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import uuid
+import threading
+import contextlib
+import contextvars
+
+"""延遲與用量指標
+記錄生成流程各階段 (key AI、Places 搜尋、檢索、RAG AI、解析)、各對外 host 與各 Flask route 的
+延遲 histogram、次數與錯誤數，以及 prompt / 回覆大小，/metrics 以 Prometheus 文字格式輸出
+
+每個 HTTP 請求有一個 request id (沿用 X-Request-ID header，沒有時自動產生)，
+背景 job 與搜尋執行緒也會帶著同一個 id，各階段的 log 都以 [request id] 開頭，
+可以從 log 還原單次生成經過的每個階段與花費的時間
+"""
+
+# 設定 METRICS_LOG=0 時不輸出每個階段的耗時 log
+LOG_STAGES = os.getenv("METRICS_LOG", "1") == "1"
+
+# 延遲 (秒) 與大小 (字元 / token) 的 histogram 區間
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+_registry = {}          # 名稱 -> Counter / Histogram
+_collectors = []        # 輸出時才計算的 gauge (快取命中率等)
+
+_request_id = contextvars.ContextVar("request_id", default="-")
+# 沿用外部傳入的 X-Request-ID 時只接受這些字元，避免把任意內容寫進 log
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+# --- request id ---
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+@contextlib.contextmanager
+def bind_request_id(request_id: str):
+    """在這段範圍內使用指定的 request id (背景執行緒接手請求時使用)"""
+    token = _request_id.set(request_id or "-")
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+def set_request_id(request_id: str = None) -> str:
+    """設定目前的 request id (不合法或沒有時產生新的)，回傳實際使用的 id"""
+    if not request_id or not _REQUEST_ID_PATTERN.match(request_id):
+        request_id = new_request_id()
+    _request_id.set(request_id)
+    return request_id
+
+
+def clear_request_id() -> None:
+    _request_id.set("-")
+
+
+# --- 指標 ---
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs) -> str:
+    pairs = list(pairs)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}       # label 值 -> 累計
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(zip(self.labels, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}       # label 值 -> [各區間次數, 總和, 次數]
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            entries = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in entries:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(float(bound)))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("pipeline_stage_seconds", "生成流程各階段的耗時 (秒)", ("stage",))
+STAGE_ERRORS = Counter("pipeline_stage_errors_total", "生成流程各階段拋出例外的次數", ("stage",))
+
+HTTP_CLIENT_SECONDS = Histogram("http_client_request_seconds", "對外 HTTP 請求的耗時 (秒，每次嘗試各記一筆)",
+                                ("host", "endpoint"))
+HTTP_CLIENT_ERRORS = Counter("http_client_errors_total", "對外 HTTP 請求失敗 (連線錯誤或 4xx/5xx) 的次數",
+                             ("host", "endpoint"))
+HTTP_CLIENT_RETRIES = Counter("http_client_retries_total", "對外 HTTP 請求的重試次數", ("host", "endpoint"))
+
+ROUTE_SECONDS = Histogram("http_server_request_seconds", "Flask route 的處理時間 (秒)", ("route", "method"))
+ROUTE_REQUESTS = Counter("http_server_requests_total", "Flask route 的請求數 (依狀態碼)", ("route", "method", "status"))
+
+LLM_PROMPT_CHARS = Histogram("llm_prompt_chars", "送出的 LLM prompt 字元數 (所有 message 加總)",
+                             ("model",), SIZE_BUCKETS)
+LLM_PROMPT_TOKENS = Histogram("llm_prompt_tokens", "RAG prompt 的 token 數 (prompt_budget 計算)",
+                              ("model",), SIZE_BUCKETS)
+LLM_RESPONSE_CHARS = Histogram("llm_response_chars", "LLM 回覆的字元數", ("model",), SIZE_BUCKETS)
+
+
+def register_collector(fn) -> None:
+    """
+    註冊輸出時才計算的 gauge
+    fn() 回傳 [(名稱, 說明, [(labels dict, 值), ...]), ...]
+    """
+    _collectors.append(fn)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """
+    記錄一個流程階段的耗時，區塊內拋出例外時計入錯誤數 (例外照常往外拋)
+
+        with metrics.stage("key_llm"):
+            reply = call_key_llm(...)
+    """
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if LOG_STAGES:
+            print(f"⏱️ [{current_request_id()}] {name} {elapsed:.3f}s" + (" ❌" if failed else ""))
+
+
+def record_llm(model: str, messages: list, reply: str = None, prompt_tokens: int = None) -> None:
+    """記錄 LLM prompt 與回覆的大小，reply 為 None 時只記 prompt"""
+    LLM_PROMPT_CHARS.observe(sum(len(m.get("content") or "") for m in messages), model=model)
+    if prompt_tokens is not None:
+        LLM_PROMPT_TOKENS.observe(prompt_tokens, model=model)
+    if reply is not None:
+        LLM_RESPONSE_CHARS.observe(len(reply), model=model)
+
+
+def render() -> str:
+    """所有指標的 Prometheus 文字格式"""
+    lines = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            gauges = collector()
+        except Exception as e:
+            print(f"❌ 指標收集失敗: {e}")
+            continue
+        for name, help, samples in gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.items())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
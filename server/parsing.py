@@ -1,25 +1,22 @@
 import os, json
 import textwrap, re
-from haversine import haversine, Unit
+from geo import fill_distances
+from candidates import CandidateStore
 
 BASE_DIR = os.path.dirname(__file__)
 
-def parse_options_prompt(additional_prompt: str, target: str) -> str:
+# RAG AI 回覆中，每個推薦地點之間的分隔線
+RAG_SEPARATOR = r'-{5,}'
+
+def parse_options_prompt(additional_prompt: str, target: str, data: dict) -> str:
     """
-    從 data.json 讀取餐廳資訊，生成 prompt 並加上額外的字串。
+    從 Google 搜尋結果 (原 data.json) 讀取餐廳資訊，生成 prompt 並加上額外的字串。
     """
     final_prompt = textwrap.dedent(f"""
             我這次旅遊一起的對象是：{target}
             並且我希望這些地點能滿足這些需求「{additional_prompt}」
         """)
 
-    # 取得目前檔案所在路徑
-    data_path = os.path.join(BASE_DIR, "json", "data.json")
-
-    # 讀取 JSON
-    with open(data_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     results = data.get("results", [])
 
 
@@ -30,11 +27,13 @@ def parse_options_prompt(additional_prompt: str, target: str) -> str:
         name = r.get("name", "未知名稱")
         address = r.get("vicinity", "未知地址")
         rating = r.get("rating", "未知評分")
+        short_id = r.get("short_id", "")
 
         i += 1
         prompt_list += textwrap.dedent(f"""
                 第{i}家店：
 
+                編號：{short_id}
                 地點名稱：{name}
                 地址：{address}
                 評分：{rating}
@@ -55,94 +54,127 @@ def parse_key_prompt(additional_prompt: str, type: str) -> str:
         """)
     return final_prompt
 
-def parse_rag_output(rag_text: str):
+def parse_rag_output(rag_text: str, data: dict, req_data: dict):
     """
     解析 RAG 回傳的文字，生成符合 options.json 的 list
+
+    data 為 Google 搜尋結果 (原 data.json)，req_data 為使用者需求 (原 request.json)
     """
     options = []
-    
-    data_path = os.path.join(BASE_DIR, "json", "data.json")
-    with open(data_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    req_path = os.path.join(BASE_DIR, "json", "request.json")
-    with open(req_path, "r", encoding="utf-8") as f:
-        req_data = json.load(f)
 
     # 將每個推薦地點切分出來
     # 每個推薦地點之間都有 "---------" 分隔
-    places = re.split(r'-{5,}', rag_text)
+    places = re.split(RAG_SEPARATOR, rag_text)
+    store = CandidateStore.from_places(data)
 
     for place_text in places:
-        # 忽略空字串
-        if not place_text.strip():
-            continue
-        # print(place_text)
-        # print("-------------------")
-
-        # 解析地點名稱
-        name_match = re.search(r'地點名稱\s*[:：]\s*(.+)', place_text)
-        name = name_match.group(1).strip() if name_match else ""
-        
-        # 解析評分
-        rating_match = re.search(r'評分\s*[:：]\s*([0-9.]+)', place_text)
-        rating = float(rating_match.group(1)) if rating_match else 0.0
-
-        # 解析推薦文
-        reason_match = re.search(r'推薦文\s*[:：]\s*(.+)', place_text)
-        ai_reason = reason_match.group(1).strip() if reason_match else ""
-
-        # 解析 tags，轉成 list
-        tags_match = re.search(r'tags\s*[:：]\s*(.+)', place_text, re.IGNORECASE)
-        tags = (
-            [t.strip() for t in re.split(r'[、,]', tags_match.group(1))]
-            if tags_match else []
-        )
-        print(tags_match)
-        print(tags)
-        print("=====================")
-        # 取得time_slot
-        time_slot = req_data["time_slot"]
-
-        # 取得類型
-
-        # 取得lat, lng
-        lat = 0.0
-        lng = 0.0
-        for place in data.get('results', []):
-            place_name = place.get('name', "")
-            if name in place_name or place_name in name:
-                location = place.get('geometry', {}).get('location', {})
-                lat = location.get('lat', "")
-                lng = location.get('lng', "")
-                break
-
-        # 計算距離
-        start_lat = req_data['coordinates'].get('lat', 0.0)
-        start_lng = req_data['coordinates'].get('lng', 0.0)
-
-        point1 = (start_lat, start_lng)
-        point2 = (lat, lng)
+        option = parse_rag_block(place_text, data, req_data, store, with_distance=False)
+        if option is not None:
+            options.append(option)
 
-        distance = haversine(point1, point2, unit=Unit.KILOMETERS)
+    # 所有選項的距離一次以向量化計算
+    return fill_distances(options, req_data)
 
-        distance_info = f"{distance:.2f} km"
-
-        # 組成 options dict
-        option = {
-            "place_name": name,
-            "category": "美食",          # 預設填美食
-            "time_range": req_data["time_slot"],   # 預設時間區段
-            "rating": rating,
-            "tags": tags,
-            "ai_reason": ai_reason,
-            "distance_info": distance_info,
-            "lat": lat,
-            "lng": lng
-        }
+def parse_rag_block(place_text: str, data: dict, req_data: dict, store: CandidateStore = None,
+                    with_distance: bool = True):
+    """
+    解析單一個推薦地點的文字區塊，空白區塊回傳 None
 
-        options.append(option)
+    store 為 data 的候選地點索引，連續解析多個區塊時可傳入同一個以免重建
+    with_distance=False 時不計算距離，由呼叫端對所有選項一次計算
+    """
+    # 忽略空字串
+    if not place_text.strip():
+        return None
+    # print(place_text)
+    # print("-------------------")
+
+    # 解析地點編號
+    id_match = re.search(r'編號\s*[:：]\s*([Pp]\d+)', place_text)
+    short_id = id_match.group(1) if id_match else ""
+
+    # 解析地點名稱
+    name_match = re.search(r'地點名稱\s*[:：]\s*(.+)', place_text)
+    name = name_match.group(1).strip() if name_match else ""
+    
+    # 解析評分
+    rating_match = re.search(r'評分\s*[:：]\s*([0-9.]+)', place_text)
+    rating = float(rating_match.group(1)) if rating_match else 0.0
+
+    # 解析推薦文
+    reason_match = re.search(r'推薦文\s*[:：]\s*(.+)', place_text)
+    ai_reason = reason_match.group(1).strip() if reason_match else ""
+
+    # 解析 tags，轉成 list
+    tags_match = re.search(r'tags\s*[:：]\s*(.+)', place_text, re.IGNORECASE)
+    tags = (
+        [t.strip() for t in re.split(r'[、,]', tags_match.group(1))]
+        if tags_match else []
+    )
+    # 取得time_slot
+    time_slot = req_data["time_slot"]
+
+    # 取得類型
+
+    # 取得lat, lng：以編號 (或完整名稱) 直接對應回候選地點
+    if store is None:
+        store = CandidateStore.from_places(data)
+    place = store.resolve(short_id=short_id, name=name)
+    if place is None and name:
+        # LLM 沒有照格式給編號、名稱也不完全相同時，才退回名稱的部分比對
+        place = next((p for p in store.results()
+                      if p.get('name') and (name in p['name'] or p['name'] in name)), None)
+
+    lat = 0.0
+    lng = 0.0
+    place_id = ""
+    if place is not None:
+        location = place.get('geometry', {}).get('location', {})
+        lat = location.get('lat', "")
+        lng = location.get('lng', "")
+        place_id = place.get('place_id', "")
+        if not name:
+            name = place.get('name', "")
+
+    # 組成 options dict
+    option = {
+        "place_name": name,
+        "category": "美食",          # 預設填美食
+        "time_range": req_data["time_slot"],   # 預設時間區段
+        "rating": rating,
+        "tags": tags,
+        "ai_reason": ai_reason,
+        "distance_info": "",
+        "lat": lat,
+        "lng": lng,
+        "place_id": place_id
+    }
+
+    # 計算距離
+    if with_distance:
+        fill_distances([option], req_data)
+
+    return option
+
+def iter_rag_blocks(chunks):
+    """
+    將串流進來的文字片段，依 "---------" 分隔，每湊滿一個完整的推薦地點就 yield 出來
 
-    return options
+    分隔線本身也可能被切成好幾段送達，所以只有在分隔線之後已經出現其他文字時，
+    才視為該區塊結束；串流結束時剩下的文字為最後一個區塊
+    """
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            match = re.search(RAG_SEPARATOR, buffer)
+            if not match or match.end() == len(buffer):
+                break
+            block, buffer = buffer[:match.start()], buffer[match.end():]
+            if block.strip():
+                yield block
+    if buffer.strip():
+        yield re.sub(RAG_SEPARATOR + r'\s*$', '', buffer)
 
 def parse_key_output(key_text: str) -> list:
    key_text = key_text.strip('"')
@@ -0,0 +1,116 @@
+import os, json
+import threading
+from collections import OrderedDict
+import metrics
+
+BASE_DIR = os.path.dirname(__file__)
+
+# 設定 DEBUG_DUMP_JSON=1 時，才把每個階段的資料輸出到 server/json/ 方便除錯
+DEBUG_DUMP = os.getenv("DEBUG_DUMP_JSON", "0") == "1"
+
+# 最多保留幾個 session 的生成結果 (給 regenerate / get_ai_options 使用)
+MAX_SESSIONS = 256
+
+DEFAULT_SESSION = "default"
+
+
+def dump_json(filename: str, data) -> None:
+    """
+    除錯用：將資料寫到 server/json/<filename>，未開啟 DEBUG_DUMP 時不做任何事
+    """
+    if not DEBUG_DUMP:
+        return
+    path = os.path.join(BASE_DIR, "json", filename)
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        print(f"❌ Debug dump 失敗 ({filename}): {e}")
+
+
+class PipelineContext:
+    """
+    單次生成流程的資料
+
+    取代原本 request.json / data.json / options.json 的檔案往返，
+    讓 key AI、Google 搜尋、RAG AI 與解析之間直接在記憶體中傳遞資料
+    """
+
+    def __init__(self, request: dict, session_id: str = None):
+        self.request = request or {}
+        self.session_id = (session_id or self.request.get("trip_id")
+                           or self.request.get("session_id") or DEFAULT_SESSION)
+        self.keys = []              # key AI 產生的關鍵字
+        self.places = {             # Google Places 合併後的結果 (原 data.json)
+            "html_attributions": [],
+            "results": [],
+            "status": "OK"
+        }
+        self.rag_reply = ""         # RAG AI 原始回覆
+        self.bypass_cache = bool(self.request.get("no_cache", False))   # 略過語意快取
+        self.options = None         # 解析後的選項 (原 options.json)
+        self.prefetched = None      # regenerate 時取得的預先生成結果 (prefetch.Batch)
+        # 建立 context 的 HTTP 請求的 request id，背景 job 執行時沿用，讓 log 串得起來
+        self.request_id = metrics.current_request_id()
+
+        # 串流模式：RAG AI 每產生完一個推薦地點，就透過 add_option 推給等待中的 SSE 連線
+        self.stream = bool(self.request.get("stream", False))
+        self.finished = False
+        self._cond = threading.Condition()
+
+    def add_option(self, option: dict) -> None:
+        """新增一個解析完成的選項，並喚醒等待中的讀取端"""
+        with self._cond:
+            if self.options is None:
+                self.options = []
+            self.options.append(option)
+            self._cond.notify_all()
+
+    def finish(self) -> None:
+        """標記流程已結束 (成功或失敗)，讓讀取端不再等待"""
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def wait_for_options(self, seen: int, timeout: float):
+        """
+        等待第 seen 個之後的新選項，或流程結束
+
+        Returns:
+            (list, bool): 新的選項, 流程是否已結束
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.finished or len(self.options or []) > seen, timeout
+            )
+            return list((self.options or [])[seen:]), self.finished
+
+    def dump(self) -> None:
+        """除錯用：輸出成原本的 json 檔案"""
+        dump_json("request.json", self.request)
+        dump_json("data.json", self.places)
+        if self.options is not None:
+            dump_json("options.json", self.options)
+
+
+# --- 各 session 最近一次的生成結果 ---
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def remember(ctx: PipelineContext) -> None:
+    """保存該 session 最近一次的 context，超過 MAX_SESSIONS 時淘汰最久沒用的"""
+    with _sessions_lock:
+        _sessions[ctx.session_id] = ctx
+        _sessions.move_to_end(ctx.session_id)
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+
+
+def recall(session_id: str = None):
+    """取得該 session 最近一次的 context，不存在時回傳 None"""
+    with _sessions_lock:
+        ctx = _sessions.get(session_id or DEFAULT_SESSION)
+        if ctx is not None:
+            _sessions.move_to_end(ctx.session_id)
+        return ctx
@@ -0,0 +1,63 @@
+import os
+import math
+import time
+from cache import TieredCache
+
+"""Nearby Search 結果快取
+以 (geohash 格子, 關鍵字, 半徑級距, 時段) 為 key，
+同一區域附近重複的搜尋可以直接使用快取，不必再呼叫 Places API
+因為搜尋時有帶 opennow，key 中包含目前的時段，跨時段不會拿到舊的營業狀態
+"""
+
+# geohash 精度 (6 約 1.2km x 0.6km，7 約 150m x 150m)
+GEOHASH_PRECISION = int(os.getenv("PLACES_CACHE_PRECISION", "6"))
+# 半徑級距 (公尺)，搜尋半徑會無條件進位到此級距
+RADIUS_STEP = int(os.getenv("PLACES_CACHE_RADIUS_STEP", "500"))
+# 時段長度 (分鐘)
+TIME_SLOT_MINUTES = int(os.getenv("PLACES_CACHE_SLOT_MINUTES", "60"))
+
+places_cache = TieredCache(
+    "nearby_search",
+    max_items=int(os.getenv("PLACES_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("PLACES_CACHE_TTL", "900")),
+    persistent=os.getenv("PLACES_CACHE_PERSIST", "0") == "1"
+)
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    """將經緯度編碼成 geohash 字串"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    code, bits, ch, even = [], 0, 0, True
+    while len(code) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        ch <<= 1
+        if value >= mid:
+            ch |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            code.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(code)
+
+
+def radius_bucket(radius: int) -> int:
+    """將半徑進位到 RADIUS_STEP 的倍數"""
+    return max(RADIUS_STEP, int(math.ceil(radius / RADIUS_STEP)) * RADIUS_STEP)
+
+
+def time_slot(now: float = None) -> str:
+    """目前所在的時段 (本地時間)，用來區分 opennow 的結果"""
+    t = time.localtime(now)
+    slot = (t.tm_hour * 60 + t.tm_min) // TIME_SLOT_MINUTES
+    return f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}-{slot}"
+
+
+def cache_key(lat: float, lng: float, keyword: str, radius: int) -> str:
+    return f"{geohash(float(lat), float(lng))}|{keyword.strip().lower()}|{radius_bucket(radius)}|{time_slot()}"
@@ -0,0 +1,274 @@
+import os, json
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import history
+import jobs
+import metrics
+from candidates import CandidateStore
+from parsing import iter_rag_blocks, parse_rag_block
+from pipeline import PipelineContext
+from llm_client import stream_RAG_llm
+from tools import build_options_prompt, rag_model
+
+"""regenerate 的預先生成 (speculative prefetch)
+設定 REGENERATE_PREFETCH=1 時，每次把選項交給使用者之後，就在背景以同樣的需求先生成下一批
+(prompt 中排除這個 session 已經顯示過的地點)；使用者按下 regenerate 且需求沒有改變時直接回傳，
+需求改變了就丟棄 (仍在生成中則取消，串流中斷時與 gateway 的連線會立即關閉)
+
+為了不拖慢第一次生成的請求：
+    預先生成使用自己的執行緒 (PREFETCH_WORKERS)，不佔用 jobs 的生成 worker
+    有生成請求在排隊時不開始預先生成，進行中的也會在下一段串流時取消
+    每個 session 同時最多一個，且每小時最多 PREFETCH_MAX_PER_HOUR 次
+"""
+
+ENABLED = os.getenv("REGENERATE_PREFETCH", "0") == "1"
+WORKERS = int(os.getenv("PREFETCH_WORKERS", "1"))
+MAX_PER_HOUR = int(os.getenv("PREFETCH_MAX_PER_HOUR", "10"))
+# 預先生成的結果保留多久 (秒)
+TTL = float(os.getenv("PREFETCH_TTL", "600"))
+# 等待執行的預先生成上限 (超過就不再排入)
+MAX_QUEUED = WORKERS * 2
+MAX_SESSIONS = 256
+# 排除已顯示的地點後剩不到這麼多間時就不排除 (與 system prompt 的規則相同：沒有新地點時可以重複)
+MIN_CANDIDATES = 5
+# regenerate 時在生成 worker 中等待進行中的預先生成最多幾秒，逾時 (或有其他請求在排隊) 就改為自行生成
+WAIT_TIMEOUT = float(os.getenv("PREFETCH_WAIT", "15"))
+
+# 影響推薦結果的請求欄位，任一項改變就視為需求改變
+FINGERPRINT_FIELDS = ("prompt", "companion", "category_selection", "max_travel_distance", "time_slot", "coordinates")
+
+
+class Batch:
+    """一批預先生成的選項"""
+
+    def __init__(self, ctx: PipelineContext, fingerprint: str):
+        self.ctx = ctx
+        self.fingerprint = fingerprint
+        self.created_at = time.time()
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.options = None
+        self.reply = ""
+        self.history_note = ""
+
+    def ready(self) -> bool:
+        return self.done.is_set() and self.options is not None and not self.cancelled.is_set()
+
+
+class _Session:
+    def __init__(self):
+        self.shown = set()      # 這個 session 已顯示過的 place_id
+        self.started = deque()  # 最近一小時開始預先生成的時間
+        self.batch = None
+
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="prefetch")
+_sessions = OrderedDict()
+_lock = threading.Lock()
+_queued = 0
+
+hits = 0
+misses = 0
+discarded = 0
+cancelled = 0
+skipped = 0
+
+
+def fingerprint(req_data: dict) -> str:
+    fields = {name: req_data.get(name) for name in FINGERPRINT_FIELDS}
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _foreground_waiting() -> bool:
+    """有生成請求在排隊 (生成 worker 全忙) 時，預先生成要讓路"""
+    return jobs.pending() > jobs.MAX_WORKERS
+
+
+def _session_locked(session_id: str) -> _Session:
+    session = _sessions.get(session_id)
+    if session is None:
+        session = _sessions[session_id] = _Session()
+    _sessions.move_to_end(session_id)
+    while len(_sessions) > MAX_SESSIONS:
+        _, old = _sessions.popitem(last=False)
+        if old.batch is not None:
+            old.batch.cancelled.set()
+    return session
+
+
+def _cancel_locked(session: _Session) -> None:
+    # 只設定旗標，真的中斷串流時才由 _run 計入 cancelled
+    if session.batch is not None:
+        session.batch.cancelled.set()
+        session.batch = None
+
+
+def _exclude_shown(places: dict, shown: set) -> dict:
+    remaining = [p for p in places.get("results", []) if p.get("place_id") not in shown]
+    if len(remaining) < MIN_CANDIDATES:
+        return places
+    return dict(places, results=remaining)
+
+
+def _run(batch: Batch, shown: set) -> None:
+    global _queued, skipped, cancelled
+    ctx = batch.ctx
+    with _lock:
+        _queued -= 1
+    try:
+        with metrics.bind_request_id(ctx.request_id):
+            if batch.cancelled.is_set() or _foreground_waiting():
+                with _lock:
+                    skipped += 1
+                batch.cancelled.set()
+                return
+
+            with metrics.stage("prefetch"):
+                options_prompt, batch.history_note, location = build_options_prompt(
+                    ctx, _exclude_shown(ctx.places, shown))
+                store = CandidateStore.from_places(ctx.places)
+                fragments = []
+                options = []
+                # history 等到真的交給使用者時才記錄
+                tokens = stream_RAG_llm(rag_model, options_prompt, ctx.session_id, batch.history_note,
+                                        location, record_history=False)
+                try:
+                    for token in tokens:
+                        if batch.cancelled.is_set() or _foreground_waiting():
+                            batch.cancelled.set()
+                            with _lock:
+                                cancelled += 1
+                            print(f"🛑 [{ctx.request_id}] 取消預先生成 ({ctx.session_id})")
+                            return
+                        fragments.append(token)
+                finally:
+                    tokens.close()
+
+                batch.reply = "".join(fragments)
+                for block in iter_rag_blocks([batch.reply]):
+                    option = parse_rag_block(block, ctx.places, ctx.request, store)
+                    if option is not None:
+                        options.append(option)
+                batch.options = options
+            print(f"🔮 [{ctx.request_id}] 已預先生成 {len(options)} 個選項 ({ctx.session_id})")
+    except Exception as e:
+        print(f"❌ [{ctx.request_id}] 預先生成失敗: {e}")
+    finally:
+        batch.done.set()
+
+
+def schedule(ctx: PipelineContext) -> None:
+    """
+    選項交給使用者之後呼叫：記錄已顯示的地點，並在背景預先生成下一批 (取代這個 session 先前的)
+    """
+    global _queued, skipped
+    if not ENABLED or not ctx.options:
+        return
+
+    now = time.time()
+    with _lock:
+        session = _session_locked(ctx.session_id)
+        session.shown.update(o.get("place_id") for o in ctx.options if o.get("place_id"))
+        _cancel_locked(session)
+
+        while session.started and now - session.started[0] > 3600:
+            session.started.popleft()
+        if len(session.started) >= MAX_PER_HOUR or _queued >= MAX_QUEUED or _foreground_waiting():
+            skipped += 1
+            return
+        session.started.append(now)
+
+        next_ctx = PipelineContext(dict(ctx.request), ctx.session_id)
+        next_ctx.request_id = ctx.request_id
+        next_ctx.keys = ctx.keys
+        next_ctx.places = ctx.places
+        batch = session.batch = Batch(next_ctx, fingerprint(ctx.request))
+        _queued += 1
+        shown = set(session.shown)
+    _executor.submit(_run, batch, shown)
+
+
+def take(ctx: PipelineContext):
+    """
+    regenerate 時取出這個 session 的預先生成結果 (取出後就不再保留)
+    需求已改變或已過期時丟棄並回傳 None；仍在生成中時回傳進行中的 Batch
+    """
+    global misses, discarded
+    if not ENABLED:
+        return None
+    with _lock:
+        session = _sessions.get(ctx.session_id)
+        batch = session.batch if session is not None else None
+        if batch is None or batch.cancelled.is_set():
+            misses += 1
+            return None
+        session.batch = None
+        if batch.fingerprint != fingerprint(ctx.request) or time.time() - batch.created_at > TTL:
+            batch.cancelled.set()
+            discarded += 1
+            misses += 1
+            print(f"🗑️ [{ctx.request_id}] 需求已改變，丟棄預先生成的選項 ({ctx.session_id})")
+            return None
+        return batch
+
+
+def deliver(ctx: PipelineContext, batch: Batch) -> bool:
+    """
+    將預先生成的選項交給 ctx (仍在生成中則最多等待 WAIT_TIMEOUT 秒)，並將該輪對話加入 history
+    沒能使用時會取消該批，讓預先生成的執行緒不再繼續
+
+    Returns:
+        bool: 是否成功使用，False 時由呼叫端自行生成
+    """
+    global hits, misses
+    if batch is None:
+        return False
+    # 等待時佔用著生成 worker，有其他請求在排隊就不再等
+    deadline = time.time() + WAIT_TIMEOUT
+    while not batch.done.wait(0.5):
+        if time.time() >= deadline or _foreground_waiting():
+            break
+    if not batch.ready():
+        batch.cancelled.set()
+        with _lock:
+            misses += 1
+        return False
+
+    ctx.options = []
+    for option in batch.options:
+        ctx.add_option(option)
+    ctx.rag_reply = batch.reply
+    history.record_turn(ctx.session_id, batch.history_note, batch.reply)
+    with _lock:
+        hits += 1
+    print(f"⚡ [{ctx.request_id}] 使用預先生成的選項 ({ctx.session_id})")
+    ctx.dump()
+    return True
+
+
+def reset(session_id: str) -> None:
+    """重新生成 (新的搜尋結果) 時，取消預先生成並清除已顯示的地點"""
+    if not ENABLED:
+        return
+    with _lock:
+        session = _sessions.pop(session_id, None)
+        if session is not None:
+            _cancel_locked(session)
+
+
+def stats() -> dict:
+    with _lock:
+        total = hits + misses
+        return {
+            "enabled": ENABLED,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "discarded": discarded,
+            "cancelled": cancelled,
+            "skipped": skipped,
+            "queued": _queued,
+        }
@@ -0,0 +1,169 @@
+import os
+import re
+import threading
+from history import estimate_tokens
+
+"""RAG prompt 的 token 預算
+以本地 tokenizer 計算 system prompt、history、檢索段落與候選清單各自的 token 數，
+每一區都有上限，總數超過 MAX_INPUT_TOKENS 時依優先順序刪減：
+檢索段落 (先丟分數最低的) → 最舊的 history → 排名最後的候選地點；system prompt 不刪減
+
+檢索段落因為 chunk_overlap 常常前後重疊，組合前會先合併重疊的部分
+"""
+
+MAX_INPUT_TOKENS = int(os.getenv("PROMPT_MAX_INPUT_TOKENS", "6000"))
+HISTORY_BUDGET = int(os.getenv("PROMPT_HISTORY_BUDGET", "800"))
+CONTEXT_BUDGET = int(os.getenv("PROMPT_CONTEXT_BUDGET", "1500"))
+CANDIDATES_BUDGET = int(os.getenv("PROMPT_CANDIDATES_BUDGET", "3000"))
+# 本地 tokenizer (Hugging Face 名稱或路徑)，載入失敗時改用字元數估計
+TOKENIZER_NAME = os.getenv("PROMPT_TOKENIZER", "google/embeddinggemma-300m")
+# 兩段文字前後重疊至少幾個字元才合併
+MIN_OVERLAP_CHARS = 30
+
+CONTEXT_TEMPLATE = "根據下列資料：\n{context}\n\n回答使用者的問題：{prompt}\n若無法回答則請自行上網查找資料。"
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+_tokenizer_failed = False
+
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "total_tokens": 0, "trimmed_calls": 0, "last": None}
+
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is not None or _tokenizer_failed:
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            try:
+                from transformers import AutoTokenizer
+                # 只使用本機已下載的檔案，不在請求中連網
+                _tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME, local_files_only=True)
+            except Exception as e:
+                print(f"⚠️ 無法載入 tokenizer ({TOKENIZER_NAME})，改用估計值: {e}")
+                _tokenizer_failed = True
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _overlap(a: str, b: str) -> int:
+    """a 的結尾與 b 的開頭重疊的字元數"""
+    for size in range(min(len(a), len(b)), MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def merge_chunks(chunks: list) -> list:
+    """
+    合併重疊的檢索段落：
+    完全包含在其他段落中的直接移除，前後接續重疊的接成一段
+    """
+    merged = []
+    for chunk in chunks:
+        chunk = chunk.strip()
+        if not chunk or any(chunk in m for m in merged):
+            continue
+        merged = [m for m in merged if m not in chunk]
+        for i, m in enumerate(merged):
+            size = _overlap(m, chunk)
+            if size:
+                merged[i] = m + chunk[size:]
+                break
+            size = _overlap(chunk, m)
+            if size:
+                merged[i] = chunk + m[size:]
+                break
+        else:
+            merged.append(chunk)
+    return merged
+
+
+def _trim_candidates(user_prompt: str, budget: int) -> str:
+    """候選清單超出預算時，從最後一間 (排名最低) 開始刪除"""
+    blocks = re.split(r"(?=\n第\d+家店：)", user_prompt)
+    while len(blocks) > 1 and count_tokens("".join(blocks)) > budget:
+        blocks.pop()
+    return "".join(blocks)
+
+
+def _history_tokens(turns: list) -> int:
+    return sum(count_tokens(m["content"]) for m in turns)
+
+
+def assemble(system_prompt: str, history_messages: list, chunks: list, user_prompt: str) -> dict:
+    """
+    組出符合 token 預算的 messages
+
+    Returns:
+        dict: messages, final_prompt, tokens (各區 token 數)
+    """
+    system_tokens = count_tokens(system_prompt)
+
+    # 各區先套用自己的上限
+    chunks = merge_chunks(chunks)
+    while chunks and count_tokens("\n\n".join(chunks)) > CONTEXT_BUDGET:
+        chunks.pop()
+
+    turns = list(history_messages)
+    while turns and _history_tokens(turns) > HISTORY_BUDGET:
+        turns = turns[2:]      # 每輪包含 user + assistant
+
+    user_prompt = _trim_candidates(user_prompt, CANDIDATES_BUDGET)
+
+    # 總數仍超過時，依優先順序刪減
+    def total():
+        return (system_tokens + _history_tokens(turns)
+                + count_tokens(CONTEXT_TEMPLATE.format(context="\n\n".join(chunks), prompt=user_prompt)))
+
+    trimmed = False
+    while total() > MAX_INPUT_TOKENS:
+        trimmed = True
+        if chunks:
+            chunks.pop()
+        elif turns:
+            turns = turns[2:]
+        else:
+            shorter = _trim_candidates(user_prompt, count_tokens(user_prompt) - 1)
+            if shorter == user_prompt:
+                break
+            user_prompt = shorter
+
+    context = "\n\n".join(chunks)
+    final_prompt = CONTEXT_TEMPLATE.format(context=context, prompt=user_prompt)
+    messages = [{"role": "system", "content": system_prompt}] + turns + [{"role": "user", "content": final_prompt}]
+
+    tokens = {
+        "system": system_tokens,
+        "history": _history_tokens(turns),
+        "context": count_tokens(context),
+        "candidates": count_tokens(user_prompt),
+    }
+    tokens["total"] = system_tokens + tokens["history"] + count_tokens(final_prompt)
+    print(f"🧮 Prompt tokens: system={tokens['system']} history={tokens['history']} "
+          f"context={tokens['context']} candidates={tokens['candidates']} total={tokens['total']}"
+          + (" (已刪減)" if trimmed else ""))
+
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["total_tokens"] += tokens["total"]
+        _stats["trimmed_calls"] += int(trimmed)
+        _stats["last"] = tokens
+
+    return {"messages": messages, "final_prompt": final_prompt, "tokens": tokens}
+
+
+def stats() -> dict:
+    with _stats_lock:
+        data = dict(_stats)
+        data["avg_total_tokens"] = round(data["total_tokens"] / data["calls"], 1) if data["calls"] else 0.0
+        return data
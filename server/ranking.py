@@ -0,0 +1,77 @@
+import os
+import numpy as np
+from geo import GeoPoints, start_point
+
+"""候選地點預先排序
+Google 搜尋回來的地點 (最多約 60 間) 不再全部塞進 RAG prompt，
+而是先在本地以向量化方式綜合評分，只把前 TOP_K 名交給 gpt-oss:120b，
+prompt 變短可以直接減少 gateway 的 prefill 時間
+
+分數 = 語意相似度 (使用者需求 vs 地點名稱與類型) + 評分 + 評論數 (取 log) - 距離
+"""
+
+TOP_K = int(os.getenv("RANK_TOP_K", "15"))
+
+WEIGHT_SIMILARITY = float(os.getenv("RANK_W_SIMILARITY", "1.0"))
+WEIGHT_RATING = float(os.getenv("RANK_W_RATING", "0.6"))
+WEIGHT_POPULARITY = float(os.getenv("RANK_W_POPULARITY", "0.4"))
+WEIGHT_DISTANCE = float(os.getenv("RANK_W_DISTANCE", "0.5"))
+
+
+def _place_text(place: dict) -> str:
+    types = "、".join(t for t in place.get("types", []) if t not in ("point_of_interest", "establishment"))
+    return f"{place.get('name', '')} {types}".strip()
+
+
+def _query_text(req_data: dict) -> str:
+    categories = req_data.get("category_selection", [])
+    if isinstance(categories, list):
+        categories = "、".join(categories)
+    return f"{categories} {req_data.get('prompt', '')}".strip()
+
+
+def _similarity(req_data: dict, results: list):
+    """使用者需求與各地點的 cosine 相似度，模型無法使用時回傳全 0"""
+    import embed_cache
+
+    try:
+        query = np.asarray(embed_cache.embed_query(_query_text(req_data)), dtype=np.float32)
+        docs = np.asarray(embed_cache.embed_documents([_place_text(p) for p in results]), dtype=np.float32)
+        return docs @ query
+    except Exception as e:
+        print(f"⚠️ 語意相似度計算失敗，僅以評分與距離排序: {e}")
+        return np.zeros(len(results), dtype=np.float32)
+
+
+def score_candidates(req_data: dict, results: list):
+    """一次計算所有候選地點的分數 (numpy array)"""
+    n = len(results)
+    rating = np.array([p.get("rating") or 0.0 for p in results], dtype=np.float64)
+    total = np.array([p.get("user_ratings_total") or 0 for p in results], dtype=np.float64)
+
+    distance = GeoPoints(results).distances_from(*start_point(req_data))
+    finite = np.isfinite(distance)
+    max_distance = distance[finite].max() if finite.any() else 1.0
+    distance = np.where(finite, distance / max(max_distance, 1e-6), 1.0)
+
+    popularity = np.log1p(total)
+    popularity = popularity / popularity.max() if n and popularity.max() > 0 else popularity
+
+    return (WEIGHT_SIMILARITY * _similarity(req_data, results)
+            + WEIGHT_RATING * rating / 5.0
+            + WEIGHT_POPULARITY * popularity
+            - WEIGHT_DISTANCE * distance)
+
+
+def rank_candidates(places: dict, req_data: dict, top_k: int = TOP_K) -> dict:
+    """
+    回傳只保留前 top_k 名的搜尋結果 (與原本 data.json 相同格式)，依分數由高到低排序
+    """
+    results = places.get("results", [])
+    if top_k <= 0 or len(results) <= top_k:
+        return places
+
+    scores = score_candidates(req_data, results)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    print(f"📊 候選地點 {len(results)} → {len(order)} 間")
+    return dict(places, results=[results[i] for i in order])
@@ -0,0 +1,54 @@
+import os
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Token bucket 限流器 (thread-safe)
+
+    每秒補充 rate 個 token，最多累積 capacity 個；
+    acquire() 取不到 token 時只會等待到下一個 token 補上為止，
+    不像固定的 time.sleep 每個請求都要付出延遲
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        """
+        取得 token，必要時等待
+
+        :param timeout: 最多等待秒數，None 表示一直等
+        :return: 是否成功取得
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill_locked()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+# 整個 process 共用的 Google Places 限流器
+places_limiter = TokenBucket(
+    rate=float(os.getenv("PLACES_QPS", "5")),
+    capacity=float(os.getenv("PLACES_BURST", "5"))
+)
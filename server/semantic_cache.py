@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+from geo import fill_distances
+import embed_cache
+from places_cache import geohash
+
+"""RAG 回覆的語意快取
+將請求 (同行對象、類型、座標格子、需求 prompt) 以既有的 embedding model 轉成向量，存在小型 FAISS index 中，
+新的請求若與快取中的某筆在同一個座標格子、相似度超過門檻、且候選地點重疊度足夠，
+就直接回傳當時已解析好的選項，不必再呼叫 gpt-oss:120b
+
+請求中帶 "no_cache": true 可略過快取
+"""
+
+ENABLED = os.getenv("SEMANTIC_CACHE", "1") == "1"
+# cosine 相似度門檻 (向量已正規化，內積即 cosine)
+SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# 候選地點 place_id 的 Jaccard 重疊度門檻
+MIN_CANDIDATE_OVERLAP = float(os.getenv("SEMANTIC_CACHE_OVERLAP", "0.6"))
+TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "1800"))
+MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+# 每次從 index 取出幾個最相似的候選再做條件過濾
+SEARCH_K = 8
+
+_lock = threading.Lock()
+_index = None           # faiss.IndexIDMap2(IndexFlatIP)
+_entries = {}           # id -> {"cell", "candidates", "options", "expires_at"}
+_next_id = 0
+
+hits = 0
+misses = 0
+bypassed = 0
+
+
+def _request_text(req_data: dict) -> str:
+    categories = req_data.get("category_selection", [])
+    if isinstance(categories, list):
+        categories = "、".join(categories)
+    return (f"同行對象：{req_data.get('companion', '')} | 類型：{categories} | "
+            f"距離：{req_data.get('max_travel_distance', '')} | 需求：{req_data.get('prompt', '')}")
+
+
+def _cell(req_data: dict) -> str:
+    coords = req_data.get("coordinates") or {}
+    try:
+        return geohash(float(coords.get("lat")), float(coords.get("lng")))
+    except (TypeError, ValueError):
+        return ""
+
+
+def _candidate_ids(places: dict) -> set:
+    return {r.get("place_id") or r.get("name", "") for r in places.get("results", [])}
+
+
+def _overlap(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _restamp(options: list, req_data: dict) -> list:
+    """快取的選項改用本次請求的時段與起點重新計算距離"""
+    result = []
+    for option in options:
+        option = dict(option)
+        option["time_range"] = req_data.get("time_slot", option.get("time_range"))
+        result.append(option)
+    return fill_distances(result, req_data)
+
+
+def _vector(req_data: dict):
+    import numpy as np
+
+    vector = np.asarray([embed_cache.embed_query(_request_text(req_data))], dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _evict_locked(now: float) -> None:
+    import numpy as np
+
+    expired = [i for i, e in _entries.items() if e["expires_at"] < now]
+    overflow = len(_entries) - len(expired) - MAX_ENTRIES
+    if overflow > 0:
+        alive = sorted((e["expires_at"], i) for i, e in _entries.items() if e["expires_at"] >= now)
+        expired += [i for _, i in alive[:overflow]]
+    if expired:
+        _index.remove_ids(np.asarray(expired, dtype=np.int64))
+        for i in expired:
+            del _entries[i]
+
+
+def lookup(req_data: dict, places: dict, bypass: bool = False):
+    """
+    查詢語意快取
+
+    :param bypass: 為 True 時 (或請求帶 no_cache) 直接略過
+
+    Returns:
+        list | None: 命中時回傳選項 (已換成本次的時段與距離)，否則 None
+    """
+    global hits, misses, bypassed
+    if not ENABLED or bypass or req_data.get("no_cache"):
+        with _lock:
+            bypassed += 1
+        return None
+
+    vector = _vector(req_data)
+    cell = _cell(req_data)
+    candidates = _candidate_ids(places)
+
+    with _lock:
+        if _index is None or _index.ntotal == 0:
+            misses += 1
+            return None
+        _evict_locked(time.time())
+        scores, ids = _index.search(vector, min(SEARCH_K, _index.ntotal))
+        for score, i in zip(scores[0], ids[0]):
+            entry = _entries.get(int(i))
+            if entry is None or score < SIMILARITY_THRESHOLD:
+                continue
+            if entry["cell"] != cell or _overlap(entry["candidates"], candidates) < MIN_CANDIDATE_OVERLAP:
+                continue
+            hits += 1
+            print(f"⚡ 語意快取命中 (相似度 {score:.3f})")
+            return _restamp(entry["options"], req_data)
+        misses += 1
+    return None
+
+
+def store(req_data: dict, places: dict, options: list) -> None:
+    """將解析好的選項存入語意快取"""
+    global _index, _next_id
+    if not ENABLED or not options:
+        return
+
+    import numpy as np
+    import faiss
+
+    vector = _vector(req_data)
+    with _lock:
+        if _index is None:
+            _index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+        entry_id = _next_id
+        _next_id += 1
+        _index.add_with_ids(vector, np.asarray([entry_id], dtype=np.int64))
+        _entries[entry_id] = {
+            "cell": _cell(req_data),
+            "candidates": _candidate_ids(places),
+            "options": [dict(o) for o in options],
+            "expires_at": time.time() + TTL
+        }
+        _evict_locked(time.time())
+
+
+def stats() -> dict:
+    with _lock:
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "bypassed": bypassed,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "entries": len(_entries)
+        }
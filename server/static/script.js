@@ -9,6 +9,8 @@ let currentViewingTripId = null;
 let isInstantMode = false; 
 let activeServerTripId = null; // 用來儲存後端回傳的 ID
 let aiGeneratedOptions = null;
+// 沒有旅程 ID (即時模式) 時，用來區分不同使用者的對話歷史
+const clientSessionId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
 
 let tripSettings = { 
     tripName: '', 
@@ -279,6 +281,8 @@ function generateAiPayload() {
         "max_travel_distance": radius,
         "prompt": extraReq,
         "companion": tripSettings.companion,
+        "trip_id": activeServerTripId,
+        "session_id": clientSessionId,
         "coordinates": {
             "lat": prevLat,
             "lng": prevLng
@@ -310,61 +314,9 @@ async function startLoading() {
 
     const payload = generateAiPayload();
     
-    // 1. 傳送 request.json
-    try {
-        await fetch('/api/generate_ai_prompt', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
-        });
-    } catch (e) { console.error("需求傳送失敗", e); }
-
-    // 2. 等待並讀取 options.json
-    if(loadingText) loadingText.innerText = "等待 AI 分析資料...";
-    
-    setTimeout(async () => {
-        try {
-            const response = await fetch('/api/get_ai_options');
-            
-            if (response.ok) {
-                const data = await response.json();
-                console.log("✅ 原始 AI 資料:", data.options);
-                
-                if (Array.isArray(data.options)) {
-                    aiGeneratedOptions = data.options.map((item, index) => ({
-                        id: Date.now() + index, 
-                        
-                        // 2. 欄位對應轉換
-                        name: item.place_name,       // place_name -> name
-                        type: item.category,         // category -> type
-                        rating: item.rating,         // rating (不變)
-                        tags: item.tags,             // tags (不變)
-                        reason: item.ai_reason,      // ai_reason -> reason
-                        distance: item.distance_info,// distance_info -> distance
-                        lat: item.lat,               // lat (不變)
-                        lng: item.lng,               // lng (不變)
-                        timeRange: item.time_range   // 保留備用
-                    }));
-                }
-                
-                if(loadingText) loadingText.innerText = "生成完畢！";
-                
-                setTimeout(() => {
-                    loading.classList.add('hidden'); loading.classList.remove('flex');
-                    goToStep(3); // 這裡會觸發 renderOptions
-                }, 500);
-
-            } else {
-                console.warn("尚未取得 options.json，使用 Mock 資料");
-                loading.classList.add('hidden'); loading.classList.remove('flex');
-                goToStep(3);
-            }
-        } catch (e) {
-            console.error("讀取選項失敗:", e);
-            loading.classList.add('hidden'); loading.classList.remove('flex');
-            goToStep(3);
-        }
-    }, 2000);  // waiting time 
+    // 1. 送出需求，取得 job id
+    // 2. 以 job id 長輪詢，只會拿到屬於自己的結果
+    await runAiJob('/api/generate_ai_prompt', payload, loading, loadingText);
 }
 
 //Reload prompt
@@ -384,62 +336,120 @@ async function ReLoading() {
     else {
         payload.prompt = "";
     }
-    // 1. 傳送 request.json
+    await runAiJob('/api/regenerate_ai_prompt', payload, loading, loadingText);
+}
+
+// 送出生成需求並等待對應的 job 完成
+async function runAiJob(url, payload, loading, loadingText) {
+    const finish = () => {
+        loading.classList.add('hidden'); loading.classList.remove('flex');
+        goToStep(3); // 這裡會觸發 renderOptions
+    };
+
+    // 瀏覽器支援 SSE 時改用串流模式，每完成一個推薦地點就先顯示
+    const useStream = !!window.EventSource;
+    payload.stream = useStream;
+
+    let jobId = null;
     try {
-        await fetch('/api/regenerate_ai_prompt', {
+        const response = await fetch(url, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
         });
+        const data = await response.json();
+        jobId = data.job_id;
+        if (!jobId) console.error("需求傳送失敗", data.message);
     } catch (e) { console.error("需求傳送失敗", e); }
 
-    // 2. 等待並讀取 place.json
+    if (!jobId) {
+        finish();
+        return;
+    }
+
     if(loadingText) loadingText.innerText = "等待 AI 分析資料...";
-    
-    setTimeout(async () => {
-        try {
-            const response = await fetch('/api/get_ai_options');
-            
-            if (response.ok) {
-                const data = await response.json();
+
+    if (useStream) {
+        streamAiJob(jobId, finish);
+        return;
+    }
+
+    try {
+        while (true) {
+            const response = await fetch(`/api/get_ai_job/${jobId}?wait=20`);
+            const data = await response.json();
+
+            if (!response.ok || data.status === 'error') {
+                console.warn("生成失敗，使用 Mock 資料", data.message);
+                break;
+            }
+            if (data.status === 'done') {
                 console.log("✅ 原始 AI 資料:", data.options);
-                
-                if (Array.isArray(data.options)) {
-                    aiGeneratedOptions = data.options.map((item, index) => ({
-                        // 1. 自動產生 ID (因為 json 裡沒有)
-                        id: Date.now() + index, 
-                        
-                        // 2. 欄位對應轉換
-                        name: item.place_name,       // place_name -> name
-                        type: item.category,         // category -> type
-                        rating: item.rating,         // rating (不變)
-                        tags: item.tags,             // tags (不變)
-                        reason: item.ai_reason,      // ai_reason -> reason
-                        distance: item.distance_info,// distance_info -> distance
-                        lat: item.lat,               // lat (不變)
-                        lng: item.lng,               // lng (不變)
-                        timeRange: item.time_range   // 保留備用
-                    }));
-                }
-                
+                applyAiOptions(data.options);
                 if(loadingText) loadingText.innerText = "生成完畢！";
-                
-                setTimeout(() => {
-                    loading.classList.add('hidden'); loading.classList.remove('flex');
-                    goToStep(3); // 這裡會觸發 renderOptions
-                }, 500);
-
-            } else {
-                console.warn("尚未取得 option.json，使用 Mock 資料");
-                loading.classList.add('hidden'); loading.classList.remove('flex');
-                goToStep(3);
+                setTimeout(finish, 500);
+                return;
             }
-        } catch (e) {
-            console.error("讀取選項失敗:", e);
-            loading.classList.add('hidden'); loading.classList.remove('flex');
-            goToStep(3);
+            // queued / running：繼續等待
+        }
+    } catch (e) {
+        console.error("讀取選項失敗:", e);
+    }
+    finish();
+}
+
+// 以 SSE 接收 job 的推薦地點，第一張卡片到達時就切換到選項頁
+function streamAiJob(jobId, finish) {
+    const source = new EventSource(`/api/stream_ai_job/${jobId}`);
+    const received = [];
+    let shown = false;
+
+    source.addEventListener('option', (event) => {
+        received.push(JSON.parse(event.data));
+        applyAiOptions(received);
+        if (!shown) {
+            shown = true;
+            finish();
+        } else {
+            renderOptions();
+        }
+    });
+
+    source.addEventListener('done', (event) => {
+        source.close();
+        const data = JSON.parse(event.data);
+        if (data.status === 'error') console.warn("生成失敗", data.message);
+        else console.log("✅ 原始 AI 資料:", data.options);
+        if (!shown) {
+            if (Array.isArray(data.options)) applyAiOptions(data.options);
+            finish();
         }
-    }, 2000); 
+    });
+
+    source.onerror = () => {
+        // 連線中斷時不自動重連，避免重複送出卡片
+        source.close();
+        if (!shown) finish();
+    };
+}
+
+function applyAiOptions(options) {
+    if (!Array.isArray(options)) return;
+    aiGeneratedOptions = options.map((item, index) => ({
+        // 1. 自動產生 ID (因為 json 裡沒有)
+        id: Date.now() + index, 
+        
+        // 2. 欄位對應轉換
+        name: item.place_name,       // place_name -> name
+        type: item.category,         // category -> type
+        rating: item.rating,         // rating (不變)
+        tags: item.tags,             // tags (不變)
+        reason: item.ai_reason,      // ai_reason -> reason
+        distance: item.distance_info,// distance_info -> distance
+        lat: item.lat,               // lat (不變)
+        lng: item.lng,               // lng (不變)
+        timeRange: item.time_range   // 保留備用
+    }));
 }
 
 // --- Step 3: 顯示選項 ---
@@ -1,5 +1,11 @@
-from llm_client import call_RAG_llm, call_key_llm
+from llm_client import call_RAG_llm, call_key_llm, stream_RAG_llm
 from parsing import *
+from pipeline import PipelineContext
+import semantic_cache
+from ranking import rank_candidates
+from candidates import CandidateStore
+from geo import filter_places_by_radius, trip_location
+import metrics
 import os, json
 
 key_model = "gemma3:4b"
@@ -7,7 +13,7 @@ rag_model = "gpt-oss:120b"
 # rag_model = "gemma3:4b"
 BASE_DIR = os.path.dirname(__file__)
 
-def generate_keys() -> list:
+def generate_keys(ctx: PipelineContext) -> list:
     """
     產生關鍵字
     
@@ -16,44 +22,109 @@ def generate_keys() -> list:
     Returns:
         list: 三個關鍵字
     """
-    req_path = os.path.join(BASE_DIR, "json", "request.json")
-
-    with open(req_path, "r", encoding="utf-8") as f:
-        req_data = json.load(f)
+    req_data = ctx.request
 
     # 取出你要的欄位
     prompt = req_data.get("prompt", "")
     type = req_data.get("category_selection", "")
-    keys_reply = call_key_llm(key_model, parse_key_prompt(prompt, type))
+    with metrics.stage("key_llm"):
+        keys_reply = call_key_llm(key_model, parse_key_prompt(prompt, type))
 
-    keys_list = parse_key_output(keys_reply)
+    with metrics.stage("parse_key_output"):
+        keys_list = parse_key_output(keys_reply)
+    ctx.keys = keys_list
 
     return keys_list
 
-def generate_options_json():
-    """
-    根據接收使用者的請求prompt以及旅遊對象，呼叫RAG AI產生五個選項\n
-    並將選項儲存到options.json中
+def build_options_prompt(ctx: PipelineContext, places: dict = None):
     """
-    req_path = os.path.join(BASE_DIR, "json", "request.json")
+    組出 RAG AI 的 user prompt
 
-    with open(req_path, "r", encoding="utf-8") as f:
-        req_data = json.load(f) 
+    :param places: 放進 prompt 的候選地點，None 時使用 ctx.places
+    :return: (options_prompt, history_note, location)
+    """
+    req_data = ctx.request
 
     prompt = req_data.get("prompt", "")      
     target = req_data.get("companion", "")    
 
-    reply = call_RAG_llm(rag_model, parse_options_prompt(prompt, target))
+    # 先移除超出距離的地點，再只把預先排序後的前 K 間放進 prompt
+    # (解析回覆時仍用完整的搜尋結果對應座標)
+    with metrics.stage("build_prompt"):
+        prompt_places = rank_candidates(filter_places_by_radius(places or ctx.places, req_data), req_data)
+        options_prompt = parse_options_prompt(prompt, target, prompt_places)
+    # history 只保存需求摘要，不保存檢索資料與整份候選清單
+    history_note = f"旅遊對象：{target}，需求：{prompt or '無'}"
+    # 檢索參考資料時只搜尋行程所在地區的 shard
+    location = trip_location(req_data)
+    return options_prompt, history_note, location
+
+def generate_options_json(ctx: PipelineContext) -> list:
+    """
+    根據接收使用者的請求prompt以及旅遊對象，呼叫RAG AI產生五個選項\n
+    並將選項存回 ctx.options (開啟 DEBUG_DUMP_JSON 時另外輸出 options.json)
+    """
+    req_data = ctx.request
+
+    # 相似的請求直接使用語意快取中已解析好的選項
+    cached = _semantic_lookup(ctx)
+    if cached is not None:
+        ctx.options = []
+        for option in cached:
+            ctx.add_option(option)
+        ctx.dump()
+        return ctx.options
+
+    options_prompt, history_note, location = build_options_prompt(ctx)
+
+    if ctx.stream:
+        # 串流模式：每收到一個完整的推薦地點就先解析、推給前端
+        ctx.options = []
+        fragments = []
+        def tokens():
+            for token in stream_RAG_llm(rag_model, options_prompt, ctx.session_id, history_note, location):
+                fragments.append(token)
+                yield token
+        store = CandidateStore.from_places(ctx.places)
+        # 串流時 RAG AI 與解析交錯進行，整段記為同一個階段
+        with metrics.stage("rag_llm_stream"):
+            for block in iter_rag_blocks(tokens()):
+                option = parse_rag_block(block, ctx.places, req_data, store)
+                if option is not None:
+                    ctx.add_option(option)
+        ctx.rag_reply = "".join(fragments)
+        _semantic_store(ctx)
+        ctx.dump()
+        return ctx.options
+
+    with metrics.stage("rag_llm"):
+        reply = call_RAG_llm(rag_model, options_prompt, ctx.session_id, history_note, location)
+    ctx.rag_reply = reply
 
     # print("------------------")
     # print("Reply of RAG AI: ")
     # print(reply)
     # print("------------------")
 
-    options = parse_rag_output(reply)
+    with metrics.stage("parse_rag_output"):
+        options = parse_rag_output(reply, ctx.places, req_data)
+    ctx.options = options
+    _semantic_store(ctx)
+
+    ctx.dump()
+
+    return options
 
-    options_path = os.path.join(BASE_DIR, "json", "options.json")
-    with open(options_path, "w", encoding="utf-8") as f:
-        json.dump(options, f, ensure_ascii=False, indent=4)
+def _semantic_lookup(ctx: PipelineContext):
+    """查詢語意快取，快取本身出錯時視為未命中，不影響生成"""
+    try:
+        return semantic_cache.lookup(ctx.request, ctx.places, bypass=ctx.bypass_cache)
+    except Exception as e:
+        print(f"❌ 語意快取查詢失敗: {e}")
+        return None
 
-    return
\ No newline at end of file
+def _semantic_store(ctx: PipelineContext):
+    try:
+        semantic_cache.store(ctx.request, ctx.places, ctx.options)
+    except Exception as e:
+        print(f"❌ 語意快取寫入失敗: {e}")
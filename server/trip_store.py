@@ -0,0 +1,179 @@
+import os, json
+import sqlite3
+import threading
+import sys
+
+"""旅程資料庫
+以 SQLite (WAL 模式) 取代 trips_data.json 的整檔讀寫
+每筆旅程以 trip id 為主鍵，行程項目另存一張表，新增項目只會寫入一列
+"""
+
+BASE_DIR = os.path.dirname(__file__)
+DB_FILE = os.getenv("TRIP_DB_FILE", os.path.join(BASE_DIR, 'json', 'trips.db'))
+LEGACY_JSON_FILE = os.path.join(BASE_DIR, 'json', 'trips_data.json')
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    id          TEXT PRIMARY KEY,
+    created_at  TEXT NOT NULL,
+    meta        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schedule_items (
+    trip_id     TEXT NOT NULL REFERENCES trips(id) ON DELETE CASCADE,
+    seq         INTEGER NOT NULL,
+    item        TEXT NOT NULL,
+    PRIMARY KEY (trip_id, seq)
+);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def _get_conn() -> sqlite3.Connection:
+    """每個執行緒使用自己的連線，第一次使用時建立資料表並匯入舊的 json"""
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                conn.executescript(_SCHEMA)
+                count = conn.execute("SELECT COUNT(*) FROM trips").fetchone()[0]
+                if count == 0 and os.path.exists(LEGACY_JSON_FILE):
+                    _import_trips(conn, load_json_trips(LEGACY_JSON_FILE))
+                _initialized = True
+    return conn
+
+
+def _row_to_trip(conn, row) -> dict:
+    items = conn.execute(
+        "SELECT item FROM schedule_items WHERE trip_id = ? ORDER BY seq", (row["id"],)
+    ).fetchall()
+    return {
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "meta": json.loads(row["meta"]),
+        "schedule": [json.loads(r["item"]) for r in items]
+    }
+
+
+# --- 舊版 json 檔案 ---
+def load_json_trips(path: str = LEGACY_JSON_FILE) -> list:
+    """讀取舊版 trips_data.json，檔案不存在或格式錯誤時回傳空 list"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return []
+
+
+def _import_trips(conn, trips: list) -> int:
+    with conn:
+        for trip in trips:
+            conn.execute(
+                "INSERT OR REPLACE INTO trips (id, created_at, meta) VALUES (?, ?, ?)",
+                (trip["id"], trip.get("created_at", ""), json.dumps(trip.get("meta", {}), ensure_ascii=False))
+            )
+            conn.execute("DELETE FROM schedule_items WHERE trip_id = ?", (trip["id"],))
+            conn.executemany(
+                "INSERT INTO schedule_items (trip_id, seq, item) VALUES (?, ?, ?)",
+                [(trip["id"], i, json.dumps(item, ensure_ascii=False))
+                 for i, item in enumerate(trip.get("schedule", []))]
+            )
+    return len(trips)
+
+
+def import_json(path: str = LEGACY_JSON_FILE) -> int:
+    """
+    將舊版 trips_data.json 匯入資料庫，相同 id 的旅程會被覆蓋
+
+    Returns:
+        int: 匯入的旅程數量
+    """
+    trips = load_json_trips(path)
+    count = _import_trips(_get_conn(), trips)
+    print(f"✅ 已從 {path} 匯入 {count} 筆旅程")
+    return count
+
+
+# --- 旅程操作 ---
+def create_trip(trip: dict) -> None:
+    """新增一筆旅程 (包含 id, created_at, meta, schedule)"""
+    _import_trips(_get_conn(), [trip])
+
+
+def get_trip(trip_id: str):
+    """以 id 取得單筆旅程，不存在時回傳 None"""
+    conn = _get_conn()
+    row = conn.execute("SELECT * FROM trips WHERE id = ?", (trip_id,)).fetchone()
+    return _row_to_trip(conn, row) if row else None
+
+
+def get_meta(trip_id: str):
+    """只取得旅程的 meta，不存在時回傳 None"""
+    row = _get_conn().execute("SELECT meta FROM trips WHERE id = ?", (trip_id,)).fetchone()
+    return json.loads(row["meta"]) if row else None
+
+
+def update_meta(trip_id: str, meta: dict) -> bool:
+    """更新旅程的 meta，回傳是否有找到該旅程"""
+    conn = _get_conn()
+    with conn:
+        cur = conn.execute(
+            "UPDATE trips SET meta = ? WHERE id = ?",
+            (json.dumps(meta, ensure_ascii=False), trip_id)
+        )
+    return cur.rowcount > 0
+
+
+def add_item(trip_id: str, item: dict) -> bool:
+    """在旅程的 schedule 最後新增一個項目，回傳是否有找到該旅程"""
+    conn = _get_conn()
+    with conn:
+        # BEGIN IMMEDIATE 先取得寫入鎖，避免兩個請求拿到同一個 seq
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM trips WHERE id = ?", (trip_id,)).fetchone() is None:
+            return False
+        seq = conn.execute(
+            "SELECT COALESCE(MAX(seq), -1) + 1 FROM schedule_items WHERE trip_id = ?", (trip_id,)
+        ).fetchone()[0]
+        conn.execute(
+            "INSERT INTO schedule_items (trip_id, seq, item) VALUES (?, ?, ?)",
+            (trip_id, seq, json.dumps(item, ensure_ascii=False))
+        )
+    return True
+
+
+def list_trips() -> list:
+    """取得所有旅程 (依建立時間排序)"""
+    conn = _get_conn()
+    schedules = {}
+    for r in conn.execute("SELECT trip_id, item FROM schedule_items ORDER BY trip_id, seq"):
+        schedules.setdefault(r["trip_id"], []).append(json.loads(r["item"]))
+    rows = conn.execute("SELECT * FROM trips ORDER BY created_at").fetchall()
+    return [{
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "meta": json.loads(row["meta"]),
+        "schedule": schedules.get(row["id"], [])
+    } for row in rows]
+
+
+if __name__ == '__main__':
+    # python trip_store.py [trips_data.json 路徑]
+    import_json(sys.argv[1] if len(sys.argv) > 1 else LEGACY_JSON_FILE)
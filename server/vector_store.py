@@ -0,0 +1,334 @@
+import os, json
+import time
+import sqlite3
+import threading
+
+"""向量資料庫的延遲載入
+embedding model 與 FAISS 不在 import 時載入，而是啟動後於背景執行緒載入 (start_warmup)，
+或在第一次使用時載入 (wait_ready)；載入期間 /readyz 會回報目前狀態
+
+設定 HF_OFFLINE=1 時不登入 Hugging Face，直接從本機快取載入模型 (不需要 HUGGING_FACE_TOKEN)
+
+faiss_db 中有 createDB.py 建立的 routing.json + shards/ + docstore.db 時，
+依行程座標只搜尋涵蓋該地點的地區 shard (以及 general)，每個 shard 第一次用到時才以 mmap 讀取
+(多個 worker 共用 page cache)，chunk 文字從 SQLite docstore 取回，不需要 unpickle；
+只有舊版的 index.faiss + index.pkl 時才退回 LangChain 的 FAISS.load_local
+"""
+
+BASE_DIR = os.path.dirname(__file__)
+faiss_path = os.path.join(os.path.dirname(BASE_DIR), "vector_dataset", "faiss_db")
+ROUTING_FILE = os.path.join(faiss_path, "routing.json")
+DOCSTORE_FILE = os.path.join(faiss_path, "docstore.db")
+
+OFFLINE = os.getenv("HF_OFFLINE", "0") == "1"
+# 每次檢索幾個相關段落
+TOP_K = 4
+# 覆寫 index_meta.json 中的搜尋參數 (IVF 類的 nprobe、HNSW 的 efSearch)
+NPROBE = os.getenv("FAISS_NPROBE")
+EF_SEARCH = os.getenv("FAISS_EF_SEARCH")
+# 行程座標距離地區中心在 (涵蓋半徑 + 此值) 公里內就搜尋該地區的 shard
+ROUTE_MARGIN_KM = float(os.getenv("VECTOR_ROUTE_MARGIN_KM", "10"))
+
+COLD = "cold"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+_state = {"status": COLD, "error": None, "started_at": None, "seconds": None, "format": None}
+_lock = threading.Lock()
+_loaded = threading.Event()
+
+embedding_model = None
+routing = None          # routing.json (新格式)
+docstore = None         # SqliteDocstore (新格式)
+vectorstore = None      # LangChain FAISS (舊格式)
+
+_shards = {}            # 地區 -> 已載入的 faiss index
+_shards_lock = threading.Lock()
+
+
+class SqliteDocstore:
+    """以 "地區:row" (shard index 中的位置) 從 createDB.py 產生的 docstore.db 取回 chunk (唯讀、thread-local 連線)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def get(self, keys: list) -> list:
+        from langchain_core.documents import Document
+
+        by_region = {}
+        for key in keys:
+            region, row = key.rsplit(":", 1)
+            by_region.setdefault(region, []).append(int(row))
+
+        found = {}
+        for region, rows in by_region.items():
+            for row, content, metadata in self._conn().execute(
+                f"SELECT row, content, metadata FROM chunks WHERE region = ? AND row IN ({','.join('?' * len(rows))})",
+                [region] + rows
+            ):
+                found[f"{region}:{row}"] = Document(page_content=content, metadata=json.loads(metadata))
+        return [found[key] for key in keys if key in found]
+
+
+def _read_index(path: str, index_type: str):
+    """
+    以 mmap 讀取 index，讀取失敗時整個讀入記憶體，回傳 (index, 是否為 mmap)
+    IO_FLAG_MMAP 只會 mmap IVF 類 (ivf / pq / sq) 的 inverted list，flat 與 hnsw 仍會整個複製進記憶體，
+    所以這兩種改用 IO_FLAG_MMAP_IFC (直接在 mmap 的檔案上使用向量，較新版本的 faiss 才有)
+    """
+    import faiss
+
+    if index_type in ("ivf", "pq", "sq"):
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    elif hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        flags = faiss.IO_FLAG_MMAP_IFC
+    else:
+        print(f"⚠️ 這個版本的 faiss 無法 mmap {index_type} index，整個載入記憶體")
+        return faiss.read_index(path), False
+
+    try:
+        return faiss.read_index(path, flags), True
+    except RuntimeError as e:
+        print(f"⚠️ 無法以 mmap 讀取 index，改為整個載入: {e}")
+        return faiss.read_index(path), False
+
+
+def _load_shard(region: str):
+    import faiss
+
+    path = os.path.join(faiss_path, routing["shards"][region]["path"])
+    with open(os.path.join(path, "index_meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    index, mmapped = _read_index(os.path.join(path, "vectors.index"), meta.get("index_type"))
+    search_params = dict(meta.get("search_params", {}))
+    if NPROBE and "nprobe" in search_params:
+        search_params["nprobe"] = int(NPROBE)
+    if EF_SEARCH and "efSearch" in search_params:
+        search_params["efSearch"] = int(EF_SEARCH)
+    for name, value in search_params.items():
+        faiss.ParameterSpace().set_index_parameter(index, name, value)
+
+    print(f"📚 載入 shard {region} ({meta.get('index_type')}{', mmap' if mmapped else ''})："
+          f"{index.ntotal} 個 chunk，搜尋參數 {search_params}")
+    return index
+
+
+def get_shard(region: str):
+    """取得地區的 shard index，第一次用到時才載入"""
+    index = _shards.get(region)
+    if index is None:
+        with _shards_lock:
+            index = _shards.get(region)
+            if index is None:
+                index = _shards[region] = _load_shard(region)
+    return index
+
+
+def _load_routing() -> None:
+    global routing, docstore
+
+    with open(ROUTING_FILE, "r", encoding="utf-8") as f:
+        routing = json.load(f)
+    docstore = SqliteDocstore(DOCSTORE_FILE)
+    with _lock:
+        _state["format"] = "sharded"
+    print(f"🗺️ 向量資料庫共 {len(routing['shards'])} 個 shard：" + "、".join(routing["shards"]))
+
+
+def _load_legacy() -> None:
+    global vectorstore
+    from langchain_community.vectorstores import FAISS
+
+    print("⚠️ 使用舊版 index.faiss + index.pkl (請執行 createDB.py --convert-legacy 轉換)")
+    vectorstore = FAISS.load_local(
+        faiss_path,
+        embeddings=embedding_model,
+        allow_dangerous_deserialization=True
+    )
+    with _lock:
+        _state["format"] = "legacy"
+
+
+def _load() -> None:
+    global embedding_model
+
+    if OFFLINE:
+        # 只使用本機快取，不連線到 Hugging Face
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    else:
+        HF_TOKEN = os.environ.get("HUGGING_FACE_TOKEN")
+        if not HF_TOKEN:
+            raise RuntimeError("HUGGING_FACE_TOKEN not set (或設定 HF_OFFLINE=1 使用本機快取)")
+        from huggingface_hub import login
+        login(token=HF_TOKEN)
+
+    from embeddings import EmbeddingGemmaEmbeddings
+
+    embedding_model = EmbeddingGemmaEmbeddings()
+    if os.path.exists(ROUTING_FILE) and os.path.exists(DOCSTORE_FILE):
+        _load_routing()
+    else:
+        _load_legacy()
+
+
+def load_local(path: str, embedding) -> None:
+    """
+    以指定的 embedding model 直接載入 path 中 (createDB.py 格式) 的向量資料庫，不登入 Hugging Face
+    給 benchmark.py 等離線工具使用，會取代目前已載入的資料庫
+    """
+    global faiss_path, ROUTING_FILE, DOCSTORE_FILE, embedding_model, vectorstore
+
+    with _shards_lock:
+        _shards.clear()
+    faiss_path = path
+    ROUTING_FILE = os.path.join(path, "routing.json")
+    DOCSTORE_FILE = os.path.join(path, "docstore.db")
+    embedding_model = embedding
+    vectorstore = None
+    _load_routing()
+    with _lock:
+        _state.update(status=READY, error=None, started_at=time.time(), seconds=0.0)
+    _loaded.set()
+
+
+def _warmup() -> None:
+    start = time.perf_counter()
+    print("🔥 正在載入 embedding model 與向量資料庫 ...")
+    try:
+        _load()
+        with _lock:
+            _state["status"] = READY
+        print(f"✅ 向量資料庫載入完成 ({time.perf_counter() - start:.1f}s)")
+    except Exception as e:
+        with _lock:
+            _state["status"] = FAILED
+            _state["error"] = str(e)
+        print(f"❌ 向量資料庫載入失敗: {e}")
+    finally:
+        with _lock:
+            _state["seconds"] = round(time.perf_counter() - start, 2)
+        _loaded.set()
+
+
+def start_warmup(background: bool = True) -> None:
+    """
+    開始載入 (已載入或載入中時不做事，上次失敗則重新嘗試)
+    background=False 時在目前執行緒載入完才返回
+    """
+    with _lock:
+        if _state["status"] in (LOADING, READY):
+            return
+        _loaded.clear()
+        _state["status"] = LOADING
+        _state["error"] = None
+        _state["started_at"] = time.time()
+    if background:
+        threading.Thread(target=_warmup, name="vector-warmup", daemon=True).start()
+    else:
+        _warmup()
+
+
+def wait_ready(timeout: float = None) -> None:
+    """
+    等待向量資料庫載入完成，尚未載入時會觸發載入
+
+    :raises RuntimeError: 載入失敗或等待逾時
+    """
+    start_warmup()
+    if not _loaded.wait(timeout):
+        raise RuntimeError("向量資料庫仍在載入中")
+    if _state["status"] != READY:
+        raise RuntimeError(f"向量資料庫載入失敗: {_state['error']}")
+
+
+def get_embedding_model(timeout: float = None):
+    """取得 embedding model，尚未載入時會觸發載入並等待"""
+    wait_ready(timeout)
+    return embedding_model
+
+
+def route(location=None) -> list:
+    """
+    依行程座標 (lat, lng) 決定要搜尋的 shard：涵蓋該地點的地區 (由近到遠) 加上 general
+    沒有座標、或沒有任何 shard 符合時搜尋全部；舊格式回傳空 list
+    """
+    wait_ready()
+    if routing is None:
+        return []
+    shards = routing["shards"]
+    if location is None:
+        return sorted(shards)
+
+    from geo import haversine_km
+
+    lat, lng = location
+    nearby = []
+    for region, info in shards.items():
+        if not info.get("center"):
+            continue
+        distance = float(haversine_km(lat, lng, info["center"][0], info["center"][1]))
+        if distance <= (info.get("radius_km") or 0) + ROUTE_MARGIN_KM:
+            nearby.append((distance, region))
+    selected = [region for _, region in sorted(nearby)]
+    if routing.get("general") in shards:
+        selected.append(routing["general"])
+    return selected or sorted(shards)
+
+
+def search_ids(vector, k: int = TOP_K, regions: list = None) -> list:
+    """
+    以 query 向量搜尋 FAISS，回傳 top-k 的 id (新格式為 "地區:row"，舊格式為 docstore id)
+
+    :param regions: 要搜尋的 shard (route() 的結果)，None 表示全部
+    """
+    import numpy as np
+
+    wait_ready()
+    query = np.asarray([vector], dtype=np.float32)
+    if routing is not None:
+        hits = []
+        for region in (regions if regions is not None else sorted(routing["shards"])):
+            scores, indices = get_shard(region).search(query, k)
+            hits.extend((float(score), f"{region}:{int(i)}") for score, i in zip(scores[0], indices[0]) if i != -1)
+        # 向量皆已正規化且使用內積，不同 shard 的分數可以直接比較
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [key for _, key in hits[:k]]
+    _, indices = vectorstore.index.search(query, k)
+    return [vectorstore.index_to_docstore_id[i] for i in indices[0] if i != -1]
+
+
+def get_documents(doc_ids: list) -> list:
+    """以 search_ids 回傳的 id 取回 Document"""
+    wait_ready()
+    if docstore is not None:
+        return docstore.get(doc_ids)
+    docs = []
+    for doc_id in doc_ids:
+        doc = vectorstore.docstore.search(doc_id)
+        if not isinstance(doc, str):    # 找不到時 InMemoryDocstore 會回傳錯誤訊息字串
+            docs.append(doc)
+    return docs
+
+
+def is_ready() -> bool:
+    return _state["status"] == READY
+
+
+def state() -> dict:
+    with _lock:
+        data = dict(_state, offline=OFFLINE)
+    if routing is not None:
+        data["shards"] = {region: {"ntotal": info.get("ntotal"), "loaded": region in _shards}
+                          for region, info in routing["shards"].items()}
+    return data
@@ -1,50 +1,174 @@
-import os
+import os, json
+import time
+import random
+import hashlib
+import sqlite3
+import shutil
+import fnmatch
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import faiss
 from langchain_community.document_loaders import TextLoader, PyPDFLoader, UnstructuredWordDocumentLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from huggingface_hub import login
-from langchain_community.vectorstores import FAISS
 
-""" 載入檔案
+"""建立向量資料庫
+預設為增量模式：以 faiss_db/manifest.json 記錄每個檔案的內容 hash 與其 chunk id，
+只載入、切分、embed 新增或內容有變動的檔案，已刪除或變動檔案的 chunk 會從 docstore 中移除
+每個 chunk 的向量另外依內容 hash 存在 chunk_embeddings.db，內容相同的 chunk 不會重新 embed
 
-將放在 ./uploaded_files 中的檔案載入，並將其讀成documents
+檔案以 process pool 平行解析 (預設使用所有 CPU 核心)，切好的 chunk 以固定批次送進 embedding model
+並逐批寫入 docstore，記憶體用量只跟批次大小與同時解析的檔案數有關，不會隨資料量成長
+
+faiss_db 的內容 (伺服器不再需要 pickle)：
+    docstore.db      chunk 的文字、metadata 與所屬地區 (SQLite)，(region, row) 對應 shard index 中的位置
+    shards/<地區>/    各地區的 vectors.index (flat / ivf / hnsw / pq / sq) 與 index_meta.json，伺服器以 mmap 讀取
+    routing.json     各 shard 的中心座標與涵蓋半徑，伺服器依行程座標只搜尋相關的 shard
+
+chunk 的地區依 regions.json 決定，優先順序：files 中的檔名規則 → uploaded_files/<地區>/ 子目錄
+→ 檔名中的縣市名稱；都對不上時歸為 general (每次查詢都會搜尋)
+只有內容或地區有變動的 shard 會重建
+
+    python createDB.py                              # 增量更新
+    python createDB.py --full                       # 全部重建
+    python createDB.py --workers 4 --batch-size 32
+    python createDB.py --index-type ivf --nlist 1024 --nprobe 16
+    python createDB.py --convert-legacy             # 將舊版 index.faiss + index.pkl 轉成新格式
 """
 BASE_DIR = os.path.dirname(__file__)
 
-
 folder_path = os.path.join(BASE_DIR, 'uploaded_files')
-documents = []
- 
-if not os.path.exists(folder_path):
-    raise RuntimeError(f"{folder_path} not found")
+DB_DIR = os.path.join(BASE_DIR, 'faiss_db')
+MANIFEST_FILE = os.path.join(DB_DIR, 'manifest.json')
+DOCSTORE_FILE = os.path.join(DB_DIR, 'docstore.db')
+SHARDS_DIR = os.path.join(DB_DIR, 'shards')
+ROUTING_FILE = os.path.join(DB_DIR, 'routing.json')
+REGIONS_FILE = os.path.join(BASE_DIR, 'regions.json')
+EMBED_CACHE_FILE = os.path.join(BASE_DIR, 'chunk_embeddings.db')
+
+MODEL_NAME = "google/embeddinggemma-300m"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+# 解析檔案的 process 數與每批 embed 的 chunk 數
+WORKERS = int(os.getenv("CREATEDB_WORKERS", str(os.cpu_count() or 1)))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
 
-for file in os.listdir(folder_path):
-    path = os.path.join(folder_path, file)
+# index 類型與預設參數
+INDEX_TYPES = ("flat", "ivf", "hnsw", "pq", "sq")
+INDEX_DEFAULTS = {
+    "index_type": os.getenv("FAISS_INDEX_TYPE", "flat"),
+    "nlist": 0,          # 0 表示依資料量自動決定 (約 4 * sqrt(N))
+    "nprobe": 8,
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+    "pq_m": 16,          # PQ 子向量數 (需整除向量維度)
+    "sq_bits": 8,        # SQ 每維 bit 數 (4 / 6 / 8)
+}
+# IVF 類每個 cluster 至少要有的訓練向量數，資料量不足時改用 flat
+MIN_POINTS_PER_CENTROID = 39
+# 寫入 index 時每批從 docstore 讀出的 chunk 數
+ADD_BATCH_SIZE = 4096
+# 沒有對應地區的 chunk 所在的 shard
+GENERAL_REGION = "general"
 
+""" 載入檔案
+
+將放在 ./uploaded_files 中的檔案載入，並將其讀成documents
+"""
+
+def get_loader(path: str):
+    file = os.path.basename(path)
     if file.endswith(".txt"):
         print(f"📄 正在導入 TXT：{file}")
-        loader = TextLoader(path, encoding="utf-8")
+        return TextLoader(path, encoding="utf-8")
     elif file.endswith(".pdf"):
         print(f"📕 正在導入 PDF：{file}")
-        loader = PyPDFLoader(path)
+        return PyPDFLoader(path)
     elif file.endswith(".docx"):
         print(f"📝 正在導入 DOCX：{file}")
-        loader = UnstructuredWordDocumentLoader(path)
-    else:
-        continue
+        return UnstructuredWordDocumentLoader(path)
+    return None
+
 
-    documents.extend(loader.load())
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_files() -> dict:
+    """回傳 {相對路徑: 內容 hash}，包含子目錄，只包含支援的檔案類型"""
+    if not os.path.exists(folder_path):
+        raise RuntimeError(f"{folder_path} not found")
+
+    files = {}
+    for root, _, names in os.walk(folder_path):
+        for name in names:
+            if name.endswith((".txt", ".pdf", ".docx")):
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, folder_path).replace(os.sep, "/")] = file_hash(path)
+    return dict(sorted(files.items()))
+
+
+"""地區
+依 regions.json 將每個檔案歸到一個地區，每個地區建立各自的 shard
+"""
+
+def load_regions() -> dict:
+    if not os.path.exists(REGIONS_FILE):
+        return {"files": {}, "regions": {}}
+    with open(REGIONS_FILE, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config.setdefault("files", {})
+    config.setdefault("regions", {})
+    return config
+
+
+def region_of(file: str, config: dict) -> str:
+    """檔案 (uploaded_files 下的相對路徑) 所屬的地區代碼"""
+    for pattern, region in config["files"].items():
+        if fnmatch.fnmatch(file, pattern):
+            return region
+
+    regions = config["regions"]
+    parts = file.split("/")
+    # 子目錄名稱為地區代碼或別名
+    for part in parts[:-1]:
+        for region, info in regions.items():
+            if part.lower() == region or part == info.get("name") or part in info.get("aliases", []):
+                return region
+
+    # 檔名中出現縣市名稱 (取最長的匹配，避免「新北」被當成「台北」之類的誤判)
+    name = parts[-1]
+    best, best_len = GENERAL_REGION, 0
+    for region, info in regions.items():
+        for alias in [info.get("name", "")] + info.get("aliases", []):
+            if alias and alias.lower() in name.lower() and len(alias) > best_len:
+                best, best_len = region, len(alias)
+    return best
 
 
 """切分文件
 將檔案文件內容依照chunk_size做切分，並設置chunk_overlap保留上下文關係
 """
 
-splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-split_docs = splitter.split_documents(documents)
+splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def load_chunks(file: str, digest: str) -> list:
+    """載入並切分單一檔案，chunk id 由檔案 hash 與序號組成 (內容不變時 id 也不變)"""
+    documents = get_loader(os.path.join(folder_path, *file.split("/"))).load()
+    split_docs = splitter.split_documents(documents)
+    for i, doc in enumerate(split_docs):
+        doc.metadata["source_file"] = file
+        doc.metadata["chunk_id"] = f"{digest[:16]}-{i}"
+    return split_docs
 
-print(f"Loaded {len(documents)} documents")
-print(f"Split into {len(split_docs)} chunks")
 
 """向量模型
 使用 HuggingFace 的 embeddinggemma-300m 模型產生向量
@@ -54,7 +178,7 @@ print(f"Split into {len(split_docs)} chunks")
 class EmbeddingGemmaEmbeddings(HuggingFaceEmbeddings):
     def __init__(self, **kwargs):
         super().__init__(
-            model_name="google/embeddinggemma-300m",        # HF 上的官方模型
+            model_name=MODEL_NAME,                          # HF 上的官方模型
             encode_kwargs={"normalize_embeddings": True},   # 一般檢索慣例
             **kwargs
         )
@@ -67,24 +191,458 @@ class EmbeddingGemmaEmbeddings(HuggingFaceEmbeddings):
     def embed_query(self, text):
         return super().embed_query(f'task: search result | query: {text}')
 
+
 """登入Huggin Face
 須至 https://huggingface.co/ 創建帳號，並前往setting/access token頁面
 按下Create new Token，Token Type 為 Read，將token設置道環境變數中
 登入後才可以將 embedding model 建立起來
 """
 
-HF_TOKEN = os.environ.get("HUGGING_FACE_TOKEN")
-if not HF_TOKEN:
-    raise RuntimeError("HUGGING_FACE_TOKEN not set")
+_embedding_model = None
 
-login(token=HF_TOKEN)
 
+def get_embedding_model():
+    """第一次需要 embed 時才登入並載入模型 (沒有新檔案時不必載入)"""
+    global _embedding_model
+    if _embedding_model is None:
+        HF_TOKEN = os.environ.get("HUGGING_FACE_TOKEN")
+        if not HF_TOKEN:
+            raise RuntimeError("HUGGING_FACE_TOKEN not set")
 
-# 建立向量資料庫
+        login(token=HF_TOKEN)
+        _embedding_model = EmbeddingGemmaEmbeddings()
+    return _embedding_model
 
 
-embedding_model = EmbeddingGemmaEmbeddings()
-vectorstore = FAISS.from_documents(split_docs, embedding_model)
+class ChunkEmbeddingCache:
+    """依 chunk 內容 hash 保存向量 (SQLite，float32 bytes)，相同內容的 chunk 不必重新 embed"""
+
+    def __init__(self, path: str = None):
+        self.conn = sqlite3.connect(path or EMBED_CACHE_FILE)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_vectors (hash TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(f"{MODEL_NAME}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT hash, vector FROM chunk_vectors WHERE hash IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update((h, np.frombuffer(v, dtype=np.float32)) for h, v in rows)
+        return found
+
+    def put_many(self, items: dict) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunk_vectors (hash, vector) VALUES (?, ?)",
+                [(h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()]
+            )
+
+
+def embed_chunks(texts: list, cache: ChunkEmbeddingCache):
+    """
+    回傳每段文字的向量，快取中沒有的才交給 embedding model
+
+    :return: (float32 矩陣, 快取命中數)
+    """
+    keys = [cache.key(text) for text in texts]
+    vectors = cache.get_many(list(set(keys)))
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors:
+            missing[key] = text
+
+    if missing:
+        new_vectors = get_embedding_model().embed_documents(list(missing.values()))
+        fresh = {k: np.asarray(v, dtype=np.float32) for k, v in zip(missing.keys(), new_vectors)}
+        cache.put_many(fresh)
+        vectors.update(fresh)
+    return np.vstack([vectors[key] for key in keys]), len(texts) - len(missing)
+
+
+def _load_chunks_job(args):
+    file, digest = args
+    return file, load_chunks(file, digest)
+
+
+def parse_files(changed: list, files: dict, workers: int):
+    """
+    以 process pool 平行載入並切分檔案，依完成順序 yield (檔名, chunks)
+    同時在處理中的檔案最多 workers * 2 個，避免解析速度遠快於 embed 時累積在記憶體
+    """
+    if workers <= 1 or len(changed) <= 1:
+        for file in changed:
+            yield file, load_chunks(file, files[file])
+        return
+
+    jobs = iter(changed)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = set()
+        while True:
+            for file in jobs:
+                running.add(pool.submit(_load_chunks_job, (file, files[file])))
+                if len(running) >= workers * 2:
+                    break
+            if not running:
+                return
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+"""Docstore
+chunk 的文字與 metadata 存在 SQLite，伺服器以 row (index 中的位置) 取回，不需要 unpickle
+"""
+
+_DOCSTORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id            TEXT PRIMARY KEY,
+    region        TEXT NOT NULL DEFAULT 'general',
+    row           INTEGER,
+    source_file   TEXT NOT NULL,
+    content       TEXT NOT NULL,
+    metadata      TEXT NOT NULL,
+    content_hash  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source_file);
+"""
+
+
+def remove_docstore() -> None:
+    for path in (DOCSTORE_FILE, DOCSTORE_FILE + "-wal", DOCSTORE_FILE + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def open_docstore():
+    conn = sqlite3.connect(DOCSTORE_FILE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_DOCSTORE_SCHEMA)
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(chunks)")]
+    if "region" not in columns:
+        conn.execute("ALTER TABLE chunks ADD COLUMN region TEXT NOT NULL DEFAULT 'general'")
+    conn.execute("DROP INDEX IF EXISTS idx_chunks_row")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_region_row ON chunks(region, row)")
+    return conn
+
+
+def insert_chunks(conn, chunks: list) -> None:
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunks (id, region, row, source_file, content, metadata, content_hash) "
+            "VALUES (?, ?, NULL, ?, ?, ?, ?)",
+            [(doc.metadata["chunk_id"], doc.metadata.get("region", GENERAL_REGION),
+              doc.metadata.get("source_file", ""), doc.page_content,
+              json.dumps(doc.metadata, ensure_ascii=False), ChunkEmbeddingCache.key(doc.page_content))
+             for doc in chunks]
+        )
 
-# 儲存向量資料庫
-vectorstore.save_local("faiss_db")
\ No newline at end of file
+
+def load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_FILE) or not os.path.exists(DOCSTORE_FILE):
+        return {}
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict) -> None:
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def shard_dir(region: str) -> str:
+    return os.path.join(SHARDS_DIR, region)
+
+
+def load_shard_meta(region: str) -> dict:
+    meta_file = os.path.join(shard_dir(region), "index_meta.json")
+    if not os.path.exists(meta_file) or not os.path.exists(os.path.join(shard_dir(region), "vectors.index")):
+        return {}
+    with open(meta_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+"""建立 FAISS index
+flat 為精確搜尋；ivf / pq / sq 先以 k-means 分群，搜尋時只看 nprobe 個 cluster；hnsw 為圖搜尋
+向量皆已正規化，一律使用內積 (即 cosine)
+"""
+
+def index_factory_string(params: dict, dim: int, ntotal: int):
+    """
+    依 index 類型與資料量決定 faiss.index_factory 的描述字串 (會把自動決定的 nlist 寫回 params)
+
+    :return: (描述字串, 實際使用的 index 類型)
+    """
+    index_type = params["index_type"]
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支援的 index 類型：{index_type} (可用：{', '.join(INDEX_TYPES)})")
+
+    if index_type == "flat":
+        return "Flat", "flat"
+    if index_type == "hnsw":
+        return f"HNSW{params['hnsw_m']}", "hnsw"
+
+    nlist = params["nlist"] or max(1, int(4 * ntotal ** 0.5))
+    nlist = min(nlist, ntotal // MIN_POINTS_PER_CENTROID)
+    if nlist < 2:
+        print(f"⚠️ 只有 {ntotal} 個 chunk，不足以訓練 {index_type}，改用 flat")
+        return "Flat", "flat"
+    params["nlist"] = nlist
+
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat", "ivf"
+    if index_type == "pq":
+        if dim % params["pq_m"]:
+            raise ValueError(f"pq_m={params['pq_m']} 必須整除向量維度 {dim}")
+        return f"IVF{nlist},PQ{params['pq_m']}", "pq"
+    return f"IVF{nlist},SQ{params['sq_bits']}", "sq"
+
+
+def _vectors_for_rows(conn, cache: ChunkEmbeddingCache, region: str, rows: list):
+    contents = conn.execute(
+        f"SELECT content FROM chunks WHERE region = ? AND row IN ({','.join('?' * len(rows))}) ORDER BY row",
+        [region] + rows
+    ).fetchall()
+    return embed_chunks([c for c, in contents], cache)[0]
+
+
+def write_shard(conn, cache: ChunkEmbeddingCache, region: str, params: dict) -> dict:
+    """
+    依 docstore 重新編號該地區的 row 並建立 shards/<地區>/vectors.index 與 index_meta.json
+    向量分批從快取讀出，不會一次載入整個資料集
+
+    :return: index_meta
+    """
+    # row 為 shard index 中的位置，依檔名與 chunk id 排序讓結果穩定
+    with conn:
+        conn.execute("UPDATE chunks SET row = NULL WHERE region = ?", (region,))
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM chunks WHERE region = ? ORDER BY source_file, id", (region,))]
+        conn.executemany("UPDATE chunks SET row = ? WHERE id = ?", [(i, chunk_id) for i, chunk_id in enumerate(ids)])
+
+    ntotal = len(ids)
+    dim = _vectors_for_rows(conn, cache, region, [0]).shape[1]
+
+    params = dict(params)
+    spec, index_type = index_factory_string(params, dim, ntotal)
+    print(f"🏗️ [{region}] 建立 {index_type} index ({spec})，{ntotal} 個 chunk，維度 {dim}")
+    start = time.perf_counter()
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = params["ef_construction"]
+
+    if not index.is_trained:
+        # 隨機抽樣訓練 (每個 cluster 約 256 筆，至少全部的 10%)
+        sample_size = min(ntotal, max(params["nlist"] * 256, ntotal // 10))
+        rows = sorted(random.sample(range(ntotal), sample_size))
+        sample = [_vectors_for_rows(conn, cache, region, rows[i:i + ADD_BATCH_SIZE])
+                  for i in range(0, len(rows), ADD_BATCH_SIZE)]
+        index.train(np.vstack(sample))
+
+    for i in range(0, ntotal, ADD_BATCH_SIZE):
+        index.add(_vectors_for_rows(conn, cache, region, list(range(i, min(i + ADD_BATCH_SIZE, ntotal)))))
+        print(f"➕ [{region}] 已加入 {index.ntotal}/{ntotal} 個向量")
+
+    os.makedirs(shard_dir(region), exist_ok=True)
+    index_file = os.path.join(shard_dir(region), "vectors.index")
+    faiss.write_index(index, index_file + ".tmp")
+    os.replace(index_file + ".tmp", index_file)
+
+    search_params = {}
+    if index_type in ("ivf", "pq", "sq"):
+        search_params = {"nprobe": params["nprobe"]}
+    elif index_type == "hnsw":
+        search_params = {"efSearch": params["ef_search"]}
+
+    meta = {
+        "region": region,
+        "model": MODEL_NAME,
+        "index_type": index_type,
+        "factory": spec,
+        "metric": "inner_product",
+        "dim": dim,
+        "ntotal": ntotal,
+        "params": params,
+        "search_params": search_params,
+        "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(shard_dir(region), "index_meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    print(f"✅ [{region}] index 已建立 ({time.perf_counter() - start:.1f}s)")
+    return meta
+
+
+def write_shards(conn, cache: ChunkEmbeddingCache, params: dict, dirty: set, config: dict) -> None:
+    """
+    重建有變動 (或 index 參數不同) 的 shard，移除已經沒有 chunk 的 shard，並寫出 routing.json
+    """
+    counts = dict(conn.execute("SELECT region, COUNT(*) FROM chunks GROUP BY region").fetchall())
+    if not counts:
+        raise RuntimeError(f"{folder_path} 中沒有可建立的檔案")
+
+    for region in sorted(counts):
+        if region in dirty or _index_params_changed(load_shard_meta(region), params):
+            write_shard(conn, cache, region, params)
+
+    if os.path.exists(SHARDS_DIR):
+        for region in os.listdir(SHARDS_DIR):
+            if region not in counts:
+                shutil.rmtree(shard_dir(region))
+                print(f"🗑️ 移除 shard：{region}")
+
+    shards = {}
+    for region, ntotal in sorted(counts.items()):
+        info = config["regions"].get(region, {})
+        meta = load_shard_meta(region)
+        shards[region] = {
+            "name": info.get("name", region),
+            "center": info.get("center"),           # general 沒有中心，每次查詢都會搜尋
+            "radius_km": info.get("radius_km"),
+            "ntotal": ntotal,
+            "index_type": meta.get("index_type"),
+            "path": f"shards/{region}",
+        }
+    with open(ROUTING_FILE + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"model": MODEL_NAME, "general": GENERAL_REGION, "shards": shards}, f, ensure_ascii=False, indent=2)
+    os.replace(ROUTING_FILE + ".tmp", ROUTING_FILE)
+    print("🗺️ 路由表：" + "、".join(f"{s['name']} {s['ntotal']}" for s in shards.values()))
+
+
+def _index_params_changed(meta: dict, params: dict) -> bool:
+    if not meta:
+        return True
+    old = meta.get("params", {})
+    if params["nlist"] and params["nlist"] != old.get("nlist"):
+        return True
+    return any(params[k] != old.get(k) for k in INDEX_DEFAULTS if k != "nlist")
+
+
+def build(full: bool = False, workers: int = WORKERS, batch_size: int = EMBED_BATCH_SIZE,
+          index_params: dict = None) -> None:
+    params = dict(INDEX_DEFAULTS, **(index_params or {}))
+    config = load_regions()
+    files = scan_files()
+    regions = {f: region_of(f, config) for f in files}
+    manifest = {} if full else load_manifest()
+
+    if not manifest:
+        # 沒有 manifest (第一次建立或舊版的 faiss_db) 時全部重建
+        print("🔨 全部重建向量資料庫")
+        remove_docstore()
+    os.makedirs(DB_DIR, exist_ok=True)
+    conn = open_docstore()
+
+    # 內容或所屬地區有變動都視為變動 (地區變動時向量仍來自快取)
+    changed = [f for f, digest in files.items()
+               if manifest.get(f, {}).get("hash") != digest or manifest[f].get("region") != regions[f]]
+    removed = [f for f in manifest if f not in files or f in changed]
+    dirty = {regions[f] for f in changed} | {manifest[f].get("region", GENERAL_REGION) for f in removed}
+    print(f"📂 共 {len(files)} 個檔案：新增/變動 {len(changed)}，刪除 {len(set(manifest) - set(files))}")
+
+    # 移除已刪除或變動檔案的舊 chunk
+    if removed:
+        with conn:
+            conn.executemany("DELETE FROM chunks WHERE source_file = ?", [(f,) for f in removed])
+        print(f"🗑️ 移除 {sum(len(manifest[f]['ids']) for f in removed)} 個舊 chunk")
+    for f in removed:
+        manifest.pop(f, None)
+
+    # 平行解析新增或變動的檔案，切好的 chunk 分批 embed 後寫入 docstore
+    cache = ChunkEmbeddingCache()
+    progress = {"files": 0, "chunks": 0, "cached": 0, "start": time.perf_counter()}
+    pending = []
+
+    def add_batch(batch: list):
+        if not batch:
+            return
+        _, cached = embed_chunks([doc.page_content for doc in batch], cache)
+        insert_chunks(conn, batch)
+
+        progress["chunks"] += len(batch)
+        progress["cached"] += cached
+        elapsed = time.perf_counter() - progress["start"]
+        print(f"🧠 檔案 {progress['files']}/{len(changed)}，chunk {progress['chunks']} "
+              f"(快取命中 {progress['cached']})，{progress['chunks'] / elapsed:.1f} chunks/s")
+
+    for file, chunks in parse_files(changed, files, workers):
+        progress["files"] += 1
+        for doc in chunks:
+            doc.metadata["region"] = regions[file]
+        manifest[file] = {"hash": files[file], "region": regions[file],
+                          "ids": [doc.metadata["chunk_id"] for doc in chunks]}
+        pending.extend(chunks)
+        while len(pending) >= batch_size:
+            add_batch(pending[:batch_size])
+            del pending[:batch_size]
+    add_batch(pending)
+
+    # 只重建有變動的 shard (向量皆來自快取，不需要重新 embed)
+    # shard 都寫好之後才更新 manifest，中途失敗時下次會把這些檔案視為變動再重建一次
+    write_shards(conn, cache, params, dirty, config)
+    save_manifest(manifest)
+    elapsed = time.perf_counter() - progress["start"]
+    print(f"✅ 向量資料庫已更新 (本次處理 {progress['chunks']} 個 chunk，{elapsed:.1f}s)")
+
+
+def convert_legacy(index_params: dict = None) -> None:
+    """
+    將舊版 LangChain 格式 (index.faiss + index.pkl) 轉成 docstore.db + 各地區 shard
+    向量直接從舊 index 取出，不需要原始檔案也不需要 embedding model；地區依 metadata 中的來源檔名判斷
+    """
+    from langchain_community.vectorstores import FAISS
+
+    params = dict(INDEX_DEFAULTS, **(index_params or {}))
+    config = load_regions()
+    # 只用於轉換本機自己產生的檔案
+    legacy = FAISS.load_local(DB_DIR, embeddings=None, allow_dangerous_deserialization=True)
+    vectors = legacy.index.reconstruct_n(0, legacy.index.ntotal)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+
+    cache = ChunkEmbeddingCache()
+    chunks = []
+    fresh = {}
+    for position, doc_id in legacy.index_to_docstore_id.items():
+        doc = legacy.docstore.search(doc_id)
+        doc.metadata.setdefault("source_file", os.path.basename(doc.metadata.get("source", "")))
+        doc.metadata["chunk_id"] = str(doc_id)
+        doc.metadata["region"] = region_of(doc.metadata["source_file"], config)
+        chunks.append(doc)
+        fresh[cache.key(doc.page_content)] = vectors[position]
+    cache.put_many(fresh)
+
+    remove_docstore()
+    conn = open_docstore()
+    insert_chunks(conn, chunks)
+    write_shards(conn, cache, params, {doc.metadata["region"] for doc in chunks}, config)
+    print(f"✅ 已轉換 {len(chunks)} 個 chunk (沒有 manifest，之後執行 createDB.py 會依 uploaded_files 全部重建)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="建立 / 增量更新 faiss_db")
+    parser.add_argument("--full", action="store_true", help="忽略 manifest，全部重建")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="解析檔案的 process 數")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="每批 embed 的 chunk 數")
+    parser.add_argument("--convert-legacy", action="store_true", help="將舊版 index.faiss + index.pkl 轉成新格式")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_DEFAULTS["index_type"])
+    parser.add_argument("--nlist", type=int, default=INDEX_DEFAULTS["nlist"], help="IVF cluster 數 (0 = 自動)")
+    parser.add_argument("--nprobe", type=int, default=INDEX_DEFAULTS["nprobe"], help="IVF 搜尋的 cluster 數")
+    parser.add_argument("--hnsw-m", type=int, default=INDEX_DEFAULTS["hnsw_m"])
+    parser.add_argument("--ef-construction", type=int, default=INDEX_DEFAULTS["ef_construction"])
+    parser.add_argument("--ef-search", type=int, default=INDEX_DEFAULTS["ef_search"])
+    parser.add_argument("--pq-m", type=int, default=INDEX_DEFAULTS["pq_m"], help="PQ 子向量數")
+    parser.add_argument("--sq-bits", type=int, choices=(4, 6, 8), default=INDEX_DEFAULTS["sq_bits"])
+    args = parser.parse_args()
+
+    index_params = {k: getattr(args, k) for k in INDEX_DEFAULTS}
+    if args.convert_legacy:
+        convert_legacy(index_params)
+    else:
+        build(full=args.full, workers=args.workers, batch_size=args.batch_size, index_params=index_params)